@@ -0,0 +1,306 @@
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Optional
+
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# Peak bytes held per output pixel while a render runs (tracemalloc over 4-13 MP renders):
+# raw NDVI path: response body and decoded float32 x2 (16), ndvi / mask / packed copies (8)
+RENDER_BYTES_PER_PIXEL = 24
+# server-coloured RGBA path: recovering the palette with np.unique copies the image several times
+RGBA_RENDER_BYTES_PER_PIXEL = 40
+# each further step of a time series, whose responses are all held until they are summarized
+SERIES_BYTES_PER_PIXEL = 21
+
+
+class AdmissionRejected(Exception):
+    """Not admitted; `status_code` is 429 (this client has too much queued) or 503 (saturated)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("cost", "client", "priority", "enqueued", "granted_at", "_event", "_loop", "_future")
+
+    def __init__(self, cost: int, client: str, priority: str):
+        self.cost = cost
+        self.client = client
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self._event: Optional[threading.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._future: Optional[asyncio.Future] = None
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+    def wake(self) -> None:
+        self.granted_at = time.monotonic()
+        if self._event is not None:
+            self._event.set()
+        elif self._future is not None:
+            self._loop.call_soon_threadsafe(lambda f=self._future: f.done() or f.set_result(None))
+
+
+class Ticket:
+    """
+    An admitted reservation. `run(fn)` holds it for the duration of the work, which may
+    happen on another thread (a single-flight worker); `detach()` is for the caller that
+    leaves early and releases the reservation only if the work never started, after
+    which `run` refuses to start it.
+    """
+
+    def __init__(self, controller: "AdmissionController", cost: int, granted_at: float):
+        self.controller = controller
+        self.cost = cost
+        self.granted_at = granted_at
+        self._lock = threading.Lock()
+        self._started = False
+        self._released = False
+
+    def run(self, fn: Callable[[], Any]) -> Any:
+        """Run fn under the reservation; AdmissionRejected (503) if it was already given back."""
+        with self._lock:
+            withdrawn = self._released
+            self._started = not withdrawn
+        if withdrawn:
+            raise AdmissionRejected(
+                503, f"{self.controller.name}: reservation withdrawn before the work started",
+                self.controller.retry_after(),
+            )
+        try:
+            return fn()
+        finally:
+            self._release()
+
+    def detach(self) -> None:
+        with self._lock:
+            # checked and marked together, so a run() racing with this either starts
+            # holding the reservation or sees it withdrawn
+            if self._started or self._released:
+                return
+            self._released = True
+        self.controller._release(self.cost, self.granted_at)
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.controller._release(self.cost, self.granted_at)
+
+
+class AdmissionController:
+    """
+    Schedules memory-heavy work against a global budget of estimated bytes.
+
+    Requests whose cost is at most `interactive_bytes` are interactive and always go ahead
+    of bulk ones, unless a bulk request has waited `starvation_seconds`; then nothing else
+    is admitted until it fits. Within a class, clients take turns (one admission per client
+    per round), so one client's burst does not delay everyone else. A client with
+    `max_queued_per_client` waiting requests gets 429, a full queue or a wait longer than
+    the timeout gets 503, both with a Retry-After estimate. Background callers pass
+    timeout=None: they queue as bulk, wait as long as needed and are never turned away.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        capacity_bytes: int,
+        interactive_bytes: int,
+        max_queue: int = 64,
+        max_queued_per_client: int = 4,
+        timeout: float = 30.0,
+        starvation_seconds: float = 10.0,
+    ):
+        self.name = name
+        self.capacity_bytes = capacity_bytes
+        self.interactive_bytes = interactive_bytes
+        self.max_queue = max_queue
+        self.max_queued_per_client = max_queued_per_client
+        self.timeout = timeout
+        self.starvation_seconds = starvation_seconds
+
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._running = 0
+        # priority -> client -> waiters in arrival order; client order is the round-robin turn
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {INTERACTIVE: OrderedDict(), BULK: OrderedDict()}
+        self._queued = 0
+        self._queued_by_client: Dict[str, int] = {}
+        # moving average of how long admitted work holds its reservation, for Retry-After
+        self._hold_seconds = 1.0
+
+        self.admitted = 0
+        self.waited = 0
+        self.rejected_client = 0
+        self.rejected_saturated = 0
+        self.timed_out = 0
+
+    # --- public API ---
+    def acquire(self, cost: int, client: str, timeout: Optional[float] = -1) -> Ticket:
+        """Blocking variant for worker threads (jobs, pre-warming)."""
+        timeout = self.timeout if timeout == -1 else timeout
+        waiter = self._enqueue(cost, client, background=timeout is None)
+        if not waiter.granted:
+            waiter._event = threading.Event()
+            # a grant may have landed between _enqueue and creating the event
+            if not waiter.granted:
+                waiter._event.wait(timeout)
+        return self._granted_or_reject(waiter)
+
+    async def acquire_async(self, cost: int, client: str, timeout: Optional[float] = -1) -> Ticket:
+        """Awaitable variant; waiting in the queue holds no thread."""
+        timeout = self.timeout if timeout == -1 else timeout
+        waiter = self._enqueue(cost, client, background=timeout is None)
+        if not waiter.granted:
+            waiter._loop = asyncio.get_running_loop()
+            waiter._future = waiter._loop.create_future()
+            if not waiter.granted:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter._future), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                except asyncio.CancelledError:
+                    # client went away: give the place (or the grant) back
+                    if not self._withdraw(waiter):
+                        self._release(waiter.cost, waiter.granted_at)
+                    raise
+        return self._granted_or_reject(waiter)
+
+    def retry_after(self) -> int:
+        with self._lock:
+            return self._retry_after()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "capacity_bytes": self.capacity_bytes,
+                "in_use_bytes": self._in_use,
+                "running": self._running,
+                "queued": self._queued,
+                "queued_interactive": sum(len(q) for q in self._queues[INTERACTIVE].values()),
+                "admitted": self.admitted,
+                "waited": self.waited,
+                "rejected_client": self.rejected_client,
+                "rejected_saturated": self.rejected_saturated,
+                "timed_out": self.timed_out,
+                "hold_seconds": round(self._hold_seconds, 3),
+            }
+
+    # --- scheduling ---
+    def _enqueue(self, cost: int, client: str, background: bool) -> _Waiter:
+        priority = INTERACTIVE if cost <= self.interactive_bytes and not background else BULK
+        waiter = _Waiter(min(cost, self.capacity_bytes), client, priority)
+        with self._lock:
+            if not self._queued and self._fits(waiter.cost):
+                self._grant(waiter)
+                return waiter
+            if not background:
+                if self._queued_by_client.get(client, 0) >= self.max_queued_per_client:
+                    self.rejected_client += 1
+                    raise AdmissionRejected(
+                        429, f"{self.name}: too many requests queued for this client", self._retry_after()
+                    )
+                if self._queued >= self.max_queue:
+                    self.rejected_saturated += 1
+                    raise AdmissionRejected(503, f"{self.name}: server is saturated", self._retry_after())
+            self._queues[priority].setdefault(client, deque()).append(waiter)
+            self._queued += 1
+            self._queued_by_client[client] = self._queued_by_client.get(client, 0) + 1
+            self.waited += 1
+            self._dispatch()
+        return waiter
+
+    def _granted_or_reject(self, waiter: _Waiter) -> Ticket:
+        if waiter.granted or not self._withdraw(waiter):
+            return Ticket(self, waiter.cost, waiter.granted_at)
+        with self._lock:
+            self.timed_out += 1
+            retry_after = self._retry_after()
+        raise AdmissionRejected(503, f"{self.name}: timed out waiting for capacity", retry_after)
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Take a waiter out of the queue; False when it was granted in the meantime."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queues = self._queues[waiter.priority]
+            queue = queues.get(waiter.client)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                if not queue:
+                    del queues[waiter.client]
+                self._dequeued(waiter)
+            # a large waiter may have been blocking the ones behind it
+            self._dispatch()
+            return True
+
+    def _release(self, cost: int, granted_at: float) -> None:
+        with self._lock:
+            self._in_use -= cost
+            self._running -= 1
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.monotonic() - granted_at)
+            self._dispatch()
+
+    def _fits(self, cost: int) -> bool:
+        return self._in_use + cost <= self.capacity_bytes
+
+    def _grant(self, waiter: _Waiter) -> None:
+        self._in_use += waiter.cost
+        self._running += 1
+        self.admitted += 1
+        waiter.wake()
+
+    def _dequeued(self, waiter: _Waiter) -> None:
+        self._queued -= 1
+        left = self._queued_by_client[waiter.client] - 1
+        if left:
+            self._queued_by_client[waiter.client] = left
+        else:
+            del self._queued_by_client[waiter.client]
+
+    def _next(self) -> Optional[_Waiter]:
+        """Head of the queue: a starved bulk request, else interactive, else bulk, round-robin."""
+        bulk = self._queues[BULK]
+        if bulk:
+            oldest = min((queue[0] for queue in bulk.values()), key=lambda w: w.enqueued)
+            if time.monotonic() - oldest.enqueued >= self.starvation_seconds:
+                return oldest
+        for priority in (INTERACTIVE, BULK):
+            queues = self._queues[priority]
+            if queues:
+                return queues[next(iter(queues))][0]
+        return None
+
+    def _dispatch(self) -> None:
+        """Grant queued requests in order while they fit (caller holds the lock)."""
+        while True:
+            waiter = self._next()
+            if waiter is None or not self._fits(waiter.cost):
+                return
+            queues = self._queues[waiter.priority]
+            queue = queues[waiter.client]
+            queue.popleft()
+            if queue:
+                # this client's turn is over
+                queues.move_to_end(waiter.client)
+            else:
+                del queues[waiter.client]
+            self._dequeued(waiter)
+            self._grant(waiter)
+
+    def _retry_after(self) -> int:
+        # queued work drains at about `running` requests per hold time
+        rounds = 1 + self._queued / max(self._running, 1)
+        return int(min(60, max(1, math.ceil(self._hold_seconds * rounds))))
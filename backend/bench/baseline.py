@@ -0,0 +1,24 @@
+"""Saved benchmark results and the regression check against them."""
+import json
+import platform
+from typing import Dict, List
+
+
+def save(path: str, results: Dict[str, float]) -> None:
+    with open(path, "w") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+
+
+def compare(path: str, results: Dict[str, float], tolerance: float) -> List[str]:
+    """
+    Names whose value (seconds, lower is better) got worse than the baseline by more
+    than `tolerance` (0.2 = 20%). Benchmarks missing on either side are ignored.
+    """
+    with open(path) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    for name, value in results.items():
+        before = baseline.get(name)
+        if before and value > before * (1 + tolerance):
+            regressions.append(f"{name}: {before * 1000:.3f} ms -> {value * 1000:.3f} ms (+{(value / before - 1) * 100:.0f}%)")
+    return regressions
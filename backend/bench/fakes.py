@@ -0,0 +1,278 @@
+"""
+Deterministic stand-ins for Sentinel Hub and Earth Engine, so the NDVI and MODIS code
+paths run without credentials or network. Both return synthetic data that depends only
+on the requested area and dates, and sleep a configurable latency per upstream call.
+"""
+import math
+import time
+import json
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import Dict, Tuple
+
+import numpy as np
+from sentinelhub import SHConfig
+
+import modis
+import sentinel_process
+from metrics import stage
+
+
+EARTH_RADIUS = 6378137.0
+# EE land-cover grid: MCD12Q1 pixels are ~500 m, about 1/222 degree
+LC_CELLS_PER_DEGREE = 222
+
+
+def _seed(*parts) -> float:
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode()).digest()
+    return int.from_bytes(digest[:4], "little") / 2 ** 32
+
+
+def synthetic_ndvi(lon: np.ndarray, lat: np.ndarray, time_interval: Tuple[str, str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ndvi, mask) over pixel-centre coordinates: smooth fields with parcel-sized detail,
+    plus cloud blobs that move with the time interval. Identical inputs give identical output.
+    """
+    phase = _seed(*time_interval) * 2 * math.pi
+    ndvi = (
+        0.35
+        + 0.3 * np.sin(lon * 37.0 + phase) * np.cos(lat * 29.0)
+        + 0.2 * np.sin(lon * 410.0) * np.sin(lat * 530.0 + phase)
+        + 0.1 * np.cos((lon + lat) * 2300.0)
+    ).astype(np.float32)
+    clouds = np.sin(lon * 61.0 - phase) * np.cos(lat * 47.0 + phase) > 0.75
+    water = ndvi < -0.05
+    return np.clip(ndvi, -1.0, 1.0), ~(clouds | water)
+
+
+class FakeSentinelHubClient:
+    """
+    Drop-in for sentinel_process.SentinelHubClient. Each Process API request is answered
+    with synthetic NDVI for its bbox, interval and output size: HxWx2 float32 for the raw
+    evalscript, HxWx4 uint8 for the RGBA one. A batch of n requests with max_threads
+    parallel downloads takes ceil(n / max_threads) * latency, like the real client.
+    """
+
+    def __init__(self, latency: float = 0.0, default_threads: int = 8):
+        self.config = SHConfig()
+        self.latency = latency
+        self.default_threads = default_threads
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.pixels = 0
+
+    def warm(self) -> None:
+        pass
+
+    def download(self, download_requests: list, max_threads=None) -> list:
+        with stage("sh_download"):
+            threads = max_threads or self.default_threads
+            if self.latency > 0:
+                time.sleep(math.ceil(len(download_requests) / threads) * self.latency)
+            return [self._respond(request) for request in download_requests]
+
+    def _respond(self, request) -> np.ndarray:
+        body = request.post_values
+        bounds = body["input"]["bounds"]
+        width, height = body["output"]["width"], body["output"]["height"]
+        time_range = body["input"]["data"][0]["dataFilter"]["timeRange"]
+        interval = (time_range["from"][:10], time_range["to"][:10])
+
+        x_min, y_min, x_max, y_max = bounds["bbox"]
+        xs = x_min + (np.arange(width, dtype=np.float64) + 0.5) * (x_max - x_min) / width
+        ys = y_max - (np.arange(height, dtype=np.float64) + 0.5) * (y_max - y_min) / height
+        if bounds["properties"]["crs"].endswith("/3857"):
+            xs = np.degrees(xs / EARTH_RADIUS)
+            ys = np.degrees(2 * np.arctan(np.exp(ys / EARTH_RADIUS)) - math.pi / 2)
+        lon, lat = np.meshgrid(xs, ys)
+        ndvi, mask = synthetic_ndvi(lon, lat, interval)
+
+        with self._lock:
+            self.requests += 1
+            self.pixels += width * height
+        if "FLOAT32" in body["evalscript"]:
+            return np.dstack([ndvi, mask.astype(np.float32)])
+        return sentinel_process.colorize_ndvi(ndvi, mask)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "megapixels": round(self.pixels / 1e6, 2)}
+
+
+def install_fake_sentinelhub(latency: float = 0.0) -> FakeSentinelHubClient:
+    """Route every get_sh_client() / config=None download through a FakeSentinelHubClient."""
+    client = FakeSentinelHubClient(latency)
+    with sentinel_process._client_lock:
+        sentinel_process._client = client
+    return client
+
+
+# --- Earth Engine ---
+
+def land_cover(lon: np.ndarray, lat: np.ndarray, year: int, lc_type: int) -> np.ndarray:
+    """Synthetic MCD12Q1 class ids of the scheme at 500 m cells; about 4% of cells change class per year."""
+    n = modis.n_classes(lc_type)
+    ix = np.floor(lon * LC_CELLS_PER_DEGREE).astype(np.int64)
+    iy = np.floor(lat * LC_CELLS_PER_DEGREE).astype(np.int64)
+    base = ((ix // 9) * 7 + (iy // 6) * 13 + lc_type) % n
+    changed = (ix * 31 + iy * 17 + year) % 23 == 0
+    return np.where(changed, (base + 1) % n, base)
+
+
+class _Computed:
+    """Deferred server-side value; getInfo() pays the round trip."""
+
+    def __init__(self, engine: "FakeEarthEngine", compute):
+        self._engine = engine
+        self._compute = compute
+
+    def getInfo(self):
+        self._engine._round_trip()
+        return self._compute()
+
+
+class _Image:
+    """Bands are functions (lon, lat) -> masked array, evaluated on the reduction grid."""
+
+    def __init__(self, engine: "FakeEarthEngine", bands: Dict[str, callable]):
+        self._engine = engine
+        self._bands = bands
+
+    @classmethod
+    def cat(cls, images: list) -> "_Image":
+        bands = {}
+        for image in images:
+            bands.update(image._bands)
+        return cls(images[0]._engine, bands)
+
+    def _single(self):
+        if len(self._bands) != 1:
+            raise ValueError("Image arithmetic needs a single-band image")
+        return next(iter(self._bands.values()))
+
+    def _derive(self, fn) -> "_Image":
+        band = self._single()
+        return _Image(self._engine, {"constant": lambda lon, lat: fn(band(lon, lat), lon, lat)})
+
+    def select(self, name: str) -> "_Image":
+        return _Image(self._engine, {name: self._bands[name]})
+
+    def rename(self, name: str) -> "_Image":
+        return _Image(self._engine, {name: self._single()})
+
+    def clip(self, geometry) -> "_Image":
+        return self
+
+    def multiply(self, value) -> "_Image":
+        return self._derive(lambda a, lon, lat: a * value)
+
+    def add(self, other: "_Image") -> "_Image":
+        other_band = other._single()
+        return self._derive(lambda a, lon, lat: a + other_band(lon, lat))
+
+    def lt(self, value) -> "_Image":
+        return self._derive(lambda a, lon, lat: (a < value).astype(np.int64))
+
+    def And(self, other: "_Image") -> "_Image":
+        other_band = other._single()
+        return self._derive(lambda a, lon, lat: ((a != 0) & (other_band(lon, lat) != 0)).astype(np.int64))
+
+    def updateMask(self, mask: "_Image") -> "_Image":
+        mask_band = mask._single()
+        return self._derive(lambda a, lon, lat: np.ma.masked_where(np.ma.filled(mask_band(lon, lat), 0) == 0, a))
+
+    def _histograms(self, bbox) -> Dict[str, dict]:
+        lon, lat = self._engine.grid(bbox)
+        out = {}
+        for name, band in self._bands.items():
+            values = np.ma.compressed(np.ma.asarray(band(lon, lat)))
+            classes, counts = np.unique(values, return_counts=True)
+            out[name] = {str(int(c)): int(n) for c, n in zip(classes, counts)} or None
+        return out
+
+    def reduceRegion(self, reducer, geometry, scale=500, maxPixels=None) -> _Computed:
+        return _Computed(self._engine, lambda: self._histograms(geometry))
+
+    def reduceRegions(self, collection, reducer, scale=500) -> _Computed:
+        def compute():
+            features = []
+            for feature in collection:
+                (histogram,) = self._histograms(feature["geometry"]).values()
+                features.append({"type": "Feature", "properties": {**feature["properties"], "histogram": histogram}})
+            return {"type": "FeatureCollection", "features": features}
+        return _Computed(self._engine, compute)
+
+    def getMapId(self, vis_params: dict) -> dict:
+        self._engine._round_trip()
+        map_id = hashlib.sha256(json.dumps([sorted(self._bands), vis_params]).encode()).hexdigest()[:16]
+        url = f"https://earthengine.invalid/v1/maps/{map_id}/tiles/{{z}}/{{x}}/{{y}}"
+        return {"mapid": map_id, "tile_fetcher": SimpleNamespace(url_format=url)}
+
+
+class _Collection:
+    def __init__(self, engine: "FakeEarthEngine", year=None):
+        self._engine = engine
+        self._year = year
+
+    def filterDate(self, start: str, end: str) -> "_Collection":
+        return _Collection(self._engine, int(start[:4]))
+
+    def filterBounds(self, geometry) -> "_Collection":
+        return self
+
+    def first(self) -> _Image:
+        year = self._year
+        return _Image(self._engine, {
+            f"LC_Type{t}": (lambda lon, lat, t=t: land_cover(lon, lat, year, t)) for t in range(1, 6)
+        })
+
+
+class FakeEarthEngine:
+    """
+    Just enough of the `ee` module for modis.py: MCD12Q1 collections, band arithmetic,
+    frequency-histogram reductions and map ids. Every getInfo() / getMapId() sleeps `latency`.
+    """
+
+    def __init__(self, latency: float = 0.0, max_cells: int = 4_000_000):
+        self.latency = latency
+        self.max_cells = max_cells
+        self._lock = threading.Lock()
+        self.round_trips = 0
+
+        engine = self
+        self.data = SimpleNamespace(_initialized=True)
+        self.Reducer = SimpleNamespace(frequencyHistogram=lambda: "frequencyHistogram")
+        self.Geometry = SimpleNamespace(Rectangle=lambda coords: tuple(float(c) for c in coords))
+        self.Image = _Image
+        self.ImageCollection = lambda name: _Collection(engine)
+        self.Feature = lambda geometry, properties: {"geometry": geometry, "properties": dict(properties)}
+        self.FeatureCollection = list
+        self.ServiceAccountCredentials = lambda *args, **kwargs: None
+        self.Initialize = lambda *args, **kwargs: None
+
+    def grid(self, bbox) -> Tuple[np.ndarray, np.ndarray]:
+        """Cell centres of the 500 m reduction grid over a lon/lat bbox."""
+        lon_min, lat_min, lon_max, lat_max = bbox
+        nx = max(1, math.ceil((lon_max - lon_min) * LC_CELLS_PER_DEGREE))
+        ny = max(1, math.ceil((lat_max - lat_min) * LC_CELLS_PER_DEGREE))
+        if nx * ny > self.max_cells:
+            raise RuntimeError(f"Too many pixels in the region ({nx * ny} > maxPixels)")
+        lons = lon_min + (np.arange(nx) + 0.5) * (lon_max - lon_min) / nx
+        lats = lat_min + (np.arange(ny) + 0.5) * (lat_max - lat_min) / ny
+        return np.meshgrid(lons, lats)
+
+    def _round_trip(self) -> None:
+        with self._lock:
+            self.round_trips += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def stats(self) -> dict:
+        return {"round_trips": self.round_trips}
+
+
+def install_fake_earth_engine(latency: float = 0.0) -> FakeEarthEngine:
+    """Point modis.py at a FakeEarthEngine (already 'initialized')."""
+    engine = FakeEarthEngine(latency)
+    modis.ee = engine
+    return engine
@@ -0,0 +1,267 @@
+"""
+Concurrent end-to-end load test. Starts the API on fake upstreams (bench.serve) in a
+separate process, seeds users and parcels, then keeps `--concurrency` clients busy for
+`--duration` seconds and reports p50/p90/p99 latency and throughput per scenario. From backend/:
+
+    python -m bench.load --concurrency 16 --duration 30
+    python -m bench.load --sh-latency 1.5 --parcels 500 --mix ndvi=1,tile=8
+    python -m bench.load --save load-base.json
+    python -m bench.load --compare load-base.json --tolerance 0.3   # exit 1 on regression
+    python -m bench.load --url http://staging:8000   # a running server with real upstreams
+
+Requests pick parcels from a fixed, seeded pool, so `--parcels` sets how much of the load
+the caches can absorb: a small pool is mostly hits, a large one mostly upstream work.
+"""
+import os
+import sys
+import math
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+import requests
+
+from bench import baseline
+
+
+INTERVAL = {"start": "2024-07-01", "end": "2024-07-30"}
+TILE_ZOOM = 13
+SCENARIOS = ("ndvi", "coords", "tile", "modis")
+
+
+def make_parcels(count: int, seed: int) -> List[Tuple[float, float, float, float]]:
+    """Field-sized bboxes (roughly 0.5 - 4 km across) scattered over Romania."""
+    rng = random.Random(seed)
+    parcels = []
+    for _ in range(count):
+        lon, lat = rng.uniform(21.0, 28.0), rng.uniform(44.0, 47.5)
+        w, h = rng.uniform(0.007, 0.05), rng.uniform(0.005, 0.035)
+        parcels.append((round(lon, 5), round(lat, 5), round(lon + w, 5), round(lat + h, 5)))
+    return parcels
+
+
+def tile_for(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, expected one of {SCENARIOS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Client:
+    """One simulated user: a keep-alive session issuing scenario requests."""
+
+    def __init__(self, base_url: str, parcels, users: int, seed: int):
+        self.base_url = base_url
+        self.parcels = parcels
+        self.users = users
+        self.rng = random.Random(seed)
+        self.http = requests.Session()
+        self.http.headers["Accept-Encoding"] = "gzip"
+
+    def request(self, scenario: str) -> requests.Response:
+        if scenario == "coords":
+            user = self.rng.randrange(self.users)
+            return self.http.get(
+                f"{self.base_url}/users/bench-{user}/coords/ndvi", headers={"Accept": "image/webp, image/png;q=0.9"}
+            )
+
+        bbox = self.rng.choice(self.parcels)
+        if scenario == "ndvi":
+            fmt = self.rng.choice(["png", "webp"])
+            return self.http.post(f"{self.base_url}/ndvi", json={"bbox": list(bbox), "format": fmt, **INTERVAL})
+        if scenario == "tile":
+            x, y = tile_for(self.rng.uniform(bbox[0], bbox[2]), self.rng.uniform(bbox[1], bbox[3]), TILE_ZOOM)
+            return self.http.get(f"{self.base_url}/ndvi/tiles/{TILE_ZOOM}/{x}/{y}.png", params=INTERVAL)
+        x1, y1, x2, y2 = bbox
+        return self.http.get(f"{self.base_url}/modis", params={"x1": x1, "y1": y1, "x2": x2, "y2": y2})
+
+
+def seed_users(base_url: str, parcels, users: int) -> None:
+    """bench-0 .. bench-{users-1}, each with one saved parcel (the one coords/ndvi renders)."""
+    http = requests.Session()
+    for i in range(users):
+        http.post(f"{base_url}/users", json={"username": f"bench-{i}"}).raise_for_status()
+        x1, y1, x2, y2 = parcels[i % len(parcels)]
+        response = http.post(f"{base_url}/users/bench-{i}/coords", json={"x1": x1, "y1": y1, "x2": x2, "y2": y2})
+        response.raise_for_status()
+
+
+def run_load(base_url: str, parcels, args) -> Tuple[Dict[str, list], float]:
+    """{scenario: [(seconds, status), ...]} recorded after warm-up, and the measured wall time."""
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    samples: Dict[str, list] = defaultdict(list)
+    lock = threading.Lock()
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    deadline = measure_from + args.duration
+
+    def worker(index: int) -> None:
+        client = Client(base_url, parcels, args.users, args.seed * 1000 + index)
+        local = []
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            scenario = client.rng.choices(names, weights)[0]
+            try:
+                response = client.request(scenario)
+                status = response.status_code
+            except requests.RequestException:
+                status = 0
+            done = time.perf_counter()
+            if now >= measure_from:
+                local.append((scenario, done - now, status))
+        with lock:
+            for scenario, seconds, status in local:
+                samples[scenario].append((seconds, status))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, max(time.perf_counter() - measure_from, 1e-9)
+
+
+def report(samples: Dict[str, list], wall: float) -> Dict[str, float]:
+    """Print the latency table; returns the numbers the baseline comparison uses."""
+    results = {}
+    print(f"\n{'scenario':<10} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = [(name, samples[name]) for name in SCENARIOS if samples.get(name)]
+    rows.append(("total", [s for _, group in rows for s in group]))
+    for name, group in rows:
+        seconds = np.array([s for s, _ in group])
+        statuses = Counter(status for _, status in group)
+        errors = sum(n for status, n in statuses.items() if status == 0 or status >= 400)
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+        print(
+            f"{name:<10} {len(group):>9} {errors:>7} {len(group) / wall:>8.1f} "
+            f"{p50 * 1000:>9.1f} {p90 * 1000:>9.1f} {p99 * 1000:>9.1f} {seconds.max() * 1000:>9.1f}"
+        )
+        if errors:
+            print(f"{'':<10} statuses: {dict(statuses)}")
+        results[f"{name}.p50"] = float(p50)
+        results[f"{name}.p99"] = float(p99)
+    # seconds per request across all clients, so that lower is better like the rest
+    results["total.inverse_throughput"] = wall / max(len(rows[-1][1]), 1)
+    return results
+
+
+def print_server_stats(base_url: str) -> None:
+    try:
+        caches = requests.get(f"{base_url}/cache/stats", timeout=10).json()
+        upstream = requests.get(f"{base_url}/bench/upstream", timeout=10)
+    except requests.RequestException:
+        return
+    ratios = ", ".join(
+        f"{name} {stats['hit_ratio']:.0%}" for name, stats in caches.items()
+        if isinstance(stats, dict) and "hit_ratio" in stats and stats.get("misses", 0) + stats.get("hits_memory", 0)
+    )
+    print(f"\ncache hit ratios: {ratios}")
+    if upstream.ok:
+        print(f"upstream calls: {upstream.json()}")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args) -> Tuple[subprocess.Popen, str, str]:
+    """bench.serve in a child process, so client threads do not share the server's GIL."""
+    port = free_port()
+    data_dir = tempfile.mkdtemp(prefix="geo-bench-")
+    log_path = os.path.join(data_dir, "server.log")
+    command = [
+        sys.executable, "-m", "bench.serve", "--port", str(port), "--data-dir", data_dir,
+        "--sh-latency", str(args.sh_latency), "--ee-latency", str(args.ee_latency),
+    ]
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok:
+                return server, base_url, log_path
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"Benchmark server did not start, see {log_path}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="load an already running server instead of starting one on fakes")
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before that")
+    parser.add_argument("--parcels", type=int, default=100, help="distinct bboxes requested")
+    parser.add_argument("--users", type=int, default=10, help="users with a saved parcel (coords scenario)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("ndvi=3,coords=2,tile=4,modis=1"),
+                        help="scenario weights, e.g. ndvi=3,coords=2,tile=4,modis=1")
+    parser.add_argument("--sh-latency", type=float, default=0.4, help="fake Sentinel Hub seconds per request batch")
+    parser.add_argument("--ee-latency", type=float, default=0.8, help="fake Earth Engine seconds per round trip")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown vs the baseline (0.3 = 30%%)")
+    args = parser.parse_args(argv)
+
+    server = None
+    base_url = args.url.rstrip("/") if args.url else None
+    if base_url is None:
+        server, base_url, log_path = start_server(args)
+        print(f"server {base_url} on fakes (Sentinel Hub {args.sh_latency}s, Earth Engine {args.ee_latency}s), log {log_path}")
+
+    try:
+        parcels = make_parcels(args.parcels, args.seed)
+        seed_users(base_url, parcels, args.users)
+        print(f"{args.concurrency} clients, {args.warmup:.0f}s warm-up + {args.duration:.0f}s, "
+              f"{len(parcels)} parcels, mix {args.mix}")
+        samples, wall = run_load(base_url, parcels, args)
+        if not any(samples.values()):
+            print("no requests completed")
+            return 1
+        results = report(samples, wall)
+        print_server_stats(base_url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    if args.save:
+        baseline.save(args.save, results)
+    if args.compare:
+        regressions = baseline.compare(args.compare, results, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
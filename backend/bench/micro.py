@@ -0,0 +1,114 @@
+"""
+Microbenchmarks for the CPU-bound NDVI render stages and the MODIS land-cover analysis,
+on synthetic data (see bench/fakes.py). From backend/:
+
+    python -m bench.micro                      # all benchmarks, 1024 x 1024 rasters
+    python -m bench.micro -k encode --size 2048
+    python -m bench.micro --save bench-base.json
+    python -m bench.micro --compare bench-base.json --tolerance 0.25   # exit 1 on regression
+
+Upstream latency is zero here, so generate_ndvi_png_bytes and the MODIS numbers are the
+client-side work plus the fakes' synthetic data, not network time.
+"""
+import sys
+import timeit
+import argparse
+import statistics
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+import modis
+import sentinel_process as sp
+from bench import baseline
+from bench.fakes import install_fake_earth_engine, install_fake_sentinelhub, synthetic_ndvi
+
+
+INTERVAL = ("2024-07-01", "2024-07-30")
+# around Cluj; 1 degree of longitude is ~76 km at this latitude
+ORIGIN = (23.5, 46.7)
+
+
+def _raster(size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """size x size synthetic NDVI at ~10 m per pixel."""
+    lon = ORIGIN[0] + np.arange(size) * (10 / 76_000)
+    lat = ORIGIN[1] + np.arange(size)[::-1] * (10 / 111_320)
+    return synthetic_ndvi(*np.meshgrid(lon, lat), INTERVAL)
+
+
+def benchmarks(size: int) -> List[Tuple[str, Callable[[], object]]]:
+    ndvi, mask = _raster(size)
+    indices = sp.classify_ndvi(ndvi, mask)
+    lut = sp.palette_lut("default")
+    rgba = sp.colorize_ndvi(ndvi, mask)
+    # a bbox that is size x size pixels at 10 m
+    bbox = (ORIGIN[0], ORIGIN[1], ORIGIN[0] + size * 10 / 76_000, ORIGIN[1] + size * 10 / 111_320)
+    parcels = [(ORIGIN[0] + i * 0.05, ORIGIN[1], ORIGIN[0] + i * 0.05 + 0.04, ORIGIN[1] + 0.03) for i in range(50)]
+    region = [ORIGIN[0], ORIGIN[1], ORIGIN[0] + 1.0, ORIGIN[1] + 1.0]
+
+    out = [
+        (f"classify_ndvi[{size}]", lambda: sp.classify_ndvi(ndvi, mask)),
+        (f"colorize_ndvi[{size}]", lambda: sp.colorize_ndvi(ndvi, mask)),
+    ]
+    for fmt in sp.IMAGE_FORMATS:
+        out.append((f"encode_indexed_{fmt}[{size}]", lambda fmt=fmt: sp.encode_indexed(indices, lut, fmt)))
+    out += [
+        # upstream render mode: RGBA from Sentinel Hub, palette recovered with np.unique
+        (f"encode_image_rgba_png[{size}]", lambda: sp.encode_image(rgba, "png")),
+        (f"render_ndvi_image_png[{size}]", lambda: sp.render_ndvi_image(ndvi, mask, "default", "png")),
+        (f"generate_ndvi_png_bytes_local[{size}]",
+         lambda: sp.generate_ndvi_png_bytes(bbox, INTERVAL, 10, mode="local")),
+        (f"generate_ndvi_png_bytes_upstream[{size}]",
+         lambda: sp.generate_ndvi_png_bytes(bbox, INTERVAL, 10, mode="upstream")),
+        ("analyze_land_cover[1deg]", lambda: modis.MODISAnalyzer(region).analyze_land_cover(2024, 2)),
+        ("analyze_land_cover_batch[50]", lambda: modis.analyze_land_cover_batch(parcels, 2024, 2)),
+        ("analyze_land_cover_change[1deg,5y]",
+         lambda: modis.analyze_land_cover_change(region, list(range(2019, 2024)), 2019, 2023, 2)),
+    ]
+    return out
+
+
+def measure(fn: Callable[[], object], repeat: int, min_time: float) -> Tuple[float, float]:
+    """(best, median) seconds per call over `repeat` rounds of at least `min_time` each."""
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return min(runs), statistics.median(runs)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024, help="raster side in pixels")
+    parser.add_argument("-k", dest="keyword", default="", help="only benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    install_fake_sentinelhub(latency=0.0)
+    install_fake_earth_engine(latency=0.0)
+
+    results = {}
+    print(f"{'benchmark':<44} {'best ms':>10} {'median ms':>10}")
+    for name, fn in benchmarks(args.size):
+        if args.keyword not in name:
+            continue
+        best, median = measure(fn, args.repeat, args.min_time)
+        results[name] = best
+        print(f"{name:<44} {best * 1000:>10.3f} {median * 1000:>10.3f}")
+
+    if args.save:
+        baseline.save(args.save, results)
+    if args.compare:
+        regressions = baseline.compare(args.compare, results, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+Run the API on the fake Sentinel Hub and Earth Engine backends (bench/fakes.py), with a
+throwaway SQLite database and cache directory. From backend/:
+
+    python -m bench.serve --port 8000 --sh-latency 0.4 --ee-latency 0.8
+
+bench.load starts one of these per run; it is also handy for frontend work without credentials.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import importlib
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--sh-latency", type=float, default=0.4, help="seconds per Sentinel Hub request batch")
+    parser.add_argument("--ee-latency", type=float, default=0.8, help="seconds per Earth Engine round trip")
+    parser.add_argument("--data-dir", help="database and cache directory (default: a new temporary one)")
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="geo-bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(data_dir, 'bench.sqlite')}")
+    os.environ.setdefault("CACHE_DIR", os.path.join(data_dir, "cache"))
+    os.environ.setdefault("MODIS_BACKEND", "ee")
+
+    import uvicorn
+    from bench.fakes import install_fake_earth_engine, install_fake_sentinelhub
+
+    api = importlib.import_module("main")
+    sentinelhub = install_fake_sentinelhub(args.sh_latency)
+    earth_engine = install_fake_earth_engine(args.ee_latency)
+    # upstream call counts for the load report
+    api.app.add_api_route(
+        "/bench/upstream",
+        lambda: {"sentinelhub": sentinelhub.stats(), "earth_engine": earth_engine.stats()},
+        methods=["GET"],
+        include_in_schema=False,
+    )
+
+    uvicorn.run(api.app, host=args.host, port=args.port, log_level=args.log_level)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+logger = logging.getLogger("geo-app.cache")
+
+
+def make_cache_key(*parts) -> str:
+    """Build a stable content-addressed key (sha256 hex) from JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """
+    Two-tier bytes cache: an in-memory LRU in front of a size-capped directory on disk.
+    Both tiers honour the same TTL; the disk tier evicts least recently used files
+    once `max_disk_bytes` is exceeded. Safe to share between worker threads.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_items: int = 128,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        ttl_seconds: float = 6 * 3600,
+    ):
+        self.name = name
+        self.max_items = max_items
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._memory_bytes = 0
+        # key -> (size, last access time)
+        self._disk_index: Dict[str, Tuple[int, float]] = {}
+        self._disk_bytes = 0
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.disk_dir = disk_dir
+        if disk_dir:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+                self._scan_disk()
+            except OSError:
+                logger.exception("Cache %s: disk tier disabled, cannot use %s", name, disk_dir)
+                self.disk_dir = None
+
+    # --- public API ---
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return value
+                self._drop_memory(key)
+
+        value = self._read_disk(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._put_memory(key, value, now)
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, value, now)
+        self._write_disk(key, value, now)
+
+    def contains(self, key: str) -> bool:
+        """True if `key` is cached and not expired; reads no data and leaves the hit counters alone."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                return True
+            if key not in self._disk_index:
+                return False
+        try:
+            return now - os.path.getmtime(self._path(key)) <= self.ttl_seconds
+        except OSError:
+            return False
+
+    def get_json(self, key: str):
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, key: str, value) -> None:
+        self.set(key, json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            keys = list(self._disk_index)
+        for key in keys:
+            self._remove_disk(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            hits = self.hits_memory + self.hits_disk
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_ratio": (hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # --- memory tier (caller holds the lock) ---
+    def _put_memory(self, key: str, value: bytes, now: float) -> None:
+        if len(value) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (now, value)
+        self._memory_bytes += len(value)
+        while self._memory and (
+            len(self._memory) > self.max_items or self._memory_bytes > self.max_memory_bytes
+        ):
+            old_key = next(iter(self._memory))
+            self._drop_memory(old_key)
+            self.evictions += 1
+
+    def _drop_memory(self, key: str) -> None:
+        _, value = self._memory.pop(key)
+        self._memory_bytes -= len(value)
+
+    # --- disk tier ---
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _scan_disk(self) -> None:
+        now = time.time()
+        for sub in os.listdir(self.disk_dir):
+            sub_dir = os.path.join(self.disk_dir, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for fname in os.listdir(sub_dir):
+                path = os.path.join(sub_dir, fname)
+                if fname.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+                st = os.stat(path)
+                if now - st.st_mtime > self.ttl_seconds:
+                    os.remove(path)
+                    continue
+                self._disk_index[fname] = (st.st_size, st.st_atime)
+                self._disk_bytes += st.st_size
+
+    def _read_disk(self, key: str, now: float) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        with self._lock:
+            if key not in self._disk_index:
+                return None
+        path = self._path(key)
+        try:
+            if now - os.path.getmtime(path) > self.ttl_seconds:
+                self._remove_disk(key)
+                return None
+            with open(path, "rb") as f:
+                value = f.read()
+        except OSError:
+            self._remove_disk(key)
+            return None
+        with self._lock:
+            if key in self._disk_index:
+                self._disk_index[key] = (len(value), now)
+        return value
+
+    def _write_disk(self, key: str, value: bytes, now: float) -> None:
+        if not self.disk_dir or len(value) > self.max_disk_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Cache %s: failed writing %s", self.name, path)
+            return
+
+        with self._lock:
+            previous = self._disk_index.get(key)
+            if previous:
+                self._disk_bytes -= previous[0]
+            self._disk_index[key] = (len(value), now)
+            self._disk_bytes += len(value)
+            victims = []
+            if self._disk_bytes > self.max_disk_bytes:
+                for old_key, _ in sorted(self._disk_index.items(), key=lambda kv: kv[1][1]):
+                    if self._disk_bytes <= self.max_disk_bytes:
+                        break
+                    if old_key == key:
+                        continue
+                    self._disk_bytes -= self._disk_index.pop(old_key)[0]
+                    victims.append(old_key)
+                    self.evictions += 1
+        for old_key in victims:
+            self._unlink(old_key)
+
+    def _remove_disk(self, key: str) -> None:
+        with self._lock:
+            entry = self._disk_index.pop(key, None)
+            if entry:
+                self._disk_bytes -= entry[0]
+        self._unlink(key)
+
+    def _unlink(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
@@ -0,0 +1,309 @@
+import math
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sentinelhub import CRS, BBox, bbox_to_dimensions
+
+from cache import TieredCache, make_cache_key
+from sentinel_process import pack_ndvi, unpack_ndvi
+
+
+logger = logging.getLogger("geo-app.chunks")
+
+METERS_PER_DEGREE = 111_320.0
+
+Bbox = Tuple[float, float, float, float]
+Interval = Tuple[str, str]
+ChunkId = Tuple[int, int]
+# fetch_many([(chunk bbox, interval), ...], (width, height)) -> [(ndvi, mask), ...]
+FetchMany = Callable[[List[Tuple[Bbox, Interval]], Tuple[int, int]], List[Tuple[np.ndarray, np.ndarray]]]
+
+
+class NDVIChunkStore:
+    """
+    Raw NDVI kept as fixed, globally aligned chunks per (resolution, time interval).
+    The grid is regular in lon/lat with its origin at (-180, 90); latitude steps are
+    `resolution` meters, longitude steps are stretched by 1/cos(ref_lat) so pixels are
+    about square around the area the app serves. A requested bbox is assembled from
+    cached chunks and only the missing chunks go upstream, in one concurrent batch,
+    so overlapping parcels share pixels. The assembled window is then resampled onto the
+    bbox's own pixel grid (bbox_to_dimensions at its real latitude), so a read has the
+    size and extent of a direct fetch.
+
+    The grids of resolutions r and r/k are nested (same origin, k x k fine pixels per
+    coarse pixel), so a missing coarse chunk whose k x k finer chunks are all cached
+    is derived locally by block-averaging them (a pyramid level) instead of fetched.
+
+    Chunks are large next to a field-sized parcel, so a bbox whose missing chunks hold
+    more than `max_overfetch` times its own pixels is not worth chunking (see `worth_it`).
+    """
+
+    def __init__(
+        self,
+        cache: TieredCache,
+        fetch_many: FetchMany,
+        chunk_px: int = 512,
+        ref_lat: float = 45.0,
+        max_chunks: int = 64,
+        key_salt: str = "",
+        pyramid_max_factor: int = 4,
+        max_overfetch: float = 4.0,
+    ):
+        self.cache = cache
+        self.fetch_many = fetch_many
+        self.chunk_px = chunk_px
+        self.ref_lat = ref_lat
+        self.max_chunks = max_chunks
+        self.key_salt = key_salt
+        self.pyramid_max_factor = pyramid_max_factor
+        self.max_overfetch = max_overfetch
+
+        self._lock = threading.Lock()
+        self.chunks_hit = 0
+        self.chunks_derived = 0
+        self.chunks_fetched = 0
+
+    # --- grid geometry ---
+    def pixel_size(self, resolution: int) -> Tuple[float, float]:
+        """(lon_step, lat_step) in degrees per pixel."""
+        lat_step = resolution / METERS_PER_DEGREE
+        return lat_step / math.cos(math.radians(self.ref_lat)), lat_step
+
+    def pixel_window(self, bbox: Bbox, resolution: int) -> Tuple[int, int, int, int]:
+        """Smallest grid window (col0, col1, row0, row1) covering the bbox; rows count from the north."""
+        lon_step, lat_step = self.pixel_size(resolution)
+        lon_min, lat_min, lon_max, lat_max = bbox
+        col0 = math.floor((lon_min + 180.0) / lon_step + 1e-9)
+        col1 = max(col0 + 1, math.ceil((lon_max + 180.0) / lon_step - 1e-9))
+        row0 = math.floor((90.0 - lat_max) / lat_step + 1e-9)
+        row1 = max(row0 + 1, math.ceil((90.0 - lat_min) / lat_step - 1e-9))
+        return col0, col1, row0, row1
+
+    def window_bbox(self, window: Tuple[int, int, int, int], resolution: int) -> Bbox:
+        lon_step, lat_step = self.pixel_size(resolution)
+        col0, col1, row0, row1 = window
+        return (
+            -180.0 + col0 * lon_step,
+            90.0 - row1 * lat_step,
+            -180.0 + col1 * lon_step,
+            90.0 - row0 * lat_step,
+        )
+
+    def output_size(self, bbox: Bbox, resolution: int) -> Tuple[int, int]:
+        """(width, height) a direct fetch of bbox returns."""
+        return bbox_to_dimensions(BBox(bbox=bbox, crs=CRS.WGS84), resolution=resolution)
+
+    def chunk_bbox(self, chunk: ChunkId, resolution: int) -> Bbox:
+        i, j = chunk
+        p = self.chunk_px
+        return self.window_bbox((i * p, (i + 1) * p, j * p, (j + 1) * p), resolution)
+
+    def chunks_for(self, bbox: Bbox, resolution: int) -> List[ChunkId]:
+        col0, col1, row0, row1 = self.pixel_window(bbox, resolution)
+        p = self.chunk_px
+        return [
+            (i, j)
+            for j in range(row0 // p, (row1 - 1) // p + 1)
+            for i in range(col0 // p, (col1 - 1) // p + 1)
+        ]
+
+    def supports(self, bbox: Bbox, resolution: int) -> bool:
+        """False for bboxes too large for chunking or whose chunks leave the valid lon/lat range."""
+        chunks = self.chunks_for(bbox, resolution)
+        if len(chunks) > self.max_chunks:
+            return False
+        # chunks run west->east inside north->south rows
+        west, _, _, north = self.chunk_bbox(chunks[0], resolution)
+        _, south, east, _ = self.chunk_bbox(chunks[-1], resolution)
+        return west >= -180.0 and east <= 180.0 and south >= -90.0 and north <= 90.0
+
+    def worth_it(self, bbox: Bbox, intervals: List[Interval], resolution: int) -> bool:
+        """
+        True when reading bbox through the store fetches at most `max_overfetch` times the
+        pixels a direct fetch would; cached and derivable chunks are free, so warm areas
+        (at this or a finer level) always qualify.
+        """
+        if not self.supports(bbox, resolution):
+            return False
+        width, height = self.output_size(bbox, resolution)
+        requested = width * height * len(intervals)
+        missing = sum(len(self.missing_chunks(bbox, interval, resolution)) for interval in intervals)
+        return missing * self.chunk_px * self.chunk_px <= self.max_overfetch * requested
+
+    def missing_chunks(self, bbox: Bbox, interval: Interval, resolution: int) -> List[ChunkId]:
+        """
+        Chunks under bbox a read would fetch upstream: neither cached at this resolution nor
+        derivable from cached finer chunks (no data is read).
+        """
+        return [
+            chunk for chunk in self.chunks_for(bbox, resolution)
+            if not self.cache.contains(self._key(resolution, interval, chunk))
+            and not self._derivable(resolution, interval, chunk)
+        ]
+
+    # --- storage ---
+    def _key(self, resolution: int, interval: Interval, chunk: ChunkId) -> str:
+        return make_cache_key("ndvi-chunk", self.key_salt, self.chunk_px, self.ref_lat, resolution, interval, chunk)
+
+    def _load(self, resolution: int, interval: Interval, chunk: ChunkId) -> Optional[np.ndarray]:
+        """Cached chunk (NaN = no data) or None when not cached; the empty marker b"" means all NaN."""
+        data = self.cache.get(self._key(resolution, interval, chunk))
+        if data is None:
+            return None
+        if not data:
+            return np.full((self.chunk_px, self.chunk_px), np.nan, dtype=np.float32)
+        return unpack_ndvi(data)[0]
+
+    def _store(self, resolution: int, interval: Interval, chunk: ChunkId, ndvi: np.ndarray, mask: np.ndarray) -> None:
+        data = pack_ndvi(ndvi, mask) if mask.any() else b""
+        self.cache.set(self._key(resolution, interval, chunk), data)
+
+    # --- pyramid ---
+    def _finer_resolutions(self, resolution: int) -> List[int]:
+        """Finer resolutions nested in `resolution`'s grid, closest (cheapest to derive from) first."""
+        return [
+            resolution // k
+            for k in range(2, self.pyramid_max_factor + 1)
+            if resolution % k == 0
+        ]
+
+    def _derivable(self, resolution: int, interval: Interval, chunk: ChunkId) -> bool:
+        """True when some finer level has all k x k chunks under `chunk` cached (what _derive needs)."""
+        i, j = chunk
+        for fine_resolution in self._finer_resolutions(resolution):
+            k = resolution // fine_resolution
+            if all(
+                self.cache.contains(self._key(fine_resolution, interval, (i * k + a, j * k + b)))
+                for b in range(k) for a in range(k)
+            ):
+                return True
+        return False
+
+    def _derive(self, resolution: int, interval: Interval, chunk: ChunkId) -> Optional[np.ndarray]:
+        """Coarse chunk block-averaged from cached finer chunks, or None if no finer level is complete."""
+        for fine_resolution in self._finer_resolutions(resolution):
+            k = resolution // fine_resolution
+            mosaic = self._fine_mosaic(fine_resolution, interval, chunk, k)
+            if mosaic is not None:
+                return block_mean(mosaic, k)
+        return None
+
+    def _fine_mosaic(
+        self, fine_resolution: int, interval: Interval, chunk: ChunkId, k: int
+    ) -> Optional[np.ndarray]:
+        """The k x k finer chunks under a coarse chunk as one array, or None if any is missing."""
+        i, j = chunk
+        p = self.chunk_px
+        mosaic = np.empty((k * p, k * p), dtype=np.float32)
+        for b in range(k):
+            for a in range(k):
+                fine = self._load(fine_resolution, interval, (i * k + a, j * k + b))
+                if fine is None:
+                    return None
+                mosaic[b * p:(b + 1) * p, a * p:(a + 1) * p] = fine
+        return mosaic
+
+    # --- reads ---
+    def read(self, bbox: Bbox, interval: Interval, resolution: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.read_many(bbox, [interval], resolution)[0]
+
+    def read_many(
+        self, bbox: Bbox, intervals: List[Interval], resolution: int
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (ndvi, mask) for `bbox` at its direct-fetch size, one per interval.
+        All chunks missing across the intervals are fetched in a single batch.
+        """
+        chunks = self.chunks_for(bbox, resolution)
+        loaded: Dict[Tuple[Interval, ChunkId], np.ndarray] = {}
+        missing: List[Tuple[Interval, ChunkId]] = []
+        for interval in intervals:
+            for chunk in chunks:
+                arr = self._load(resolution, interval, chunk)
+                if arr is None:
+                    missing.append((interval, chunk))
+                else:
+                    loaded[(interval, chunk)] = arr
+
+        derived = 0
+        if missing and self.pyramid_max_factor > 1:
+            still_missing = []
+            for interval, chunk in missing:
+                arr = self._derive(resolution, interval, chunk)
+                if arr is None:
+                    still_missing.append((interval, chunk))
+                    continue
+                mask = np.isfinite(arr)
+                self._store(resolution, interval, chunk, arr, mask)
+                loaded[(interval, chunk)] = arr
+                derived += 1
+            missing = still_missing
+
+        if missing:
+            logger.info("Fetching %d of %d NDVI chunks at %s m", len(missing), len(intervals) * len(chunks), resolution)
+            fetched = self.fetch_many(
+                [(self.chunk_bbox(chunk, resolution), interval) for interval, chunk in missing],
+                (self.chunk_px, self.chunk_px),
+            )
+            for (interval, chunk), (ndvi, mask) in zip(missing, fetched):
+                self._store(resolution, interval, chunk, ndvi, mask)
+                loaded[(interval, chunk)] = np.where(mask, ndvi, np.nan).astype(np.float32)
+
+        with self._lock:
+            self.chunks_hit += len(intervals) * len(chunks) - len(missing) - derived
+            self.chunks_derived += derived
+            self.chunks_fetched += len(missing)
+
+        window = self.pixel_window(bbox, resolution)
+        rows, cols = self._sample_indices(bbox, window, resolution)
+        out = []
+        for interval in intervals:
+            ndvi = self._assemble(window, chunks, interval, loaded)[np.ix_(rows, cols)]
+            out.append((ndvi, np.isfinite(ndvi)))
+        return out
+
+    def _sample_indices(self, bbox: Bbox, window, resolution: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Window rows / columns under the centres of the bbox's output pixels (nearest neighbour)."""
+        lon_step, lat_step = self.pixel_size(resolution)
+        col0, col1, row0, row1 = window
+        lon_min, lat_min, lon_max, lat_max = bbox
+        width, height = self.output_size(bbox, resolution)
+        lons = lon_min + (np.arange(width) + 0.5) * ((lon_max - lon_min) / width)
+        lats = lat_max - (np.arange(height) + 0.5) * ((lat_max - lat_min) / height)
+        cols = np.floor((lons + 180.0) / lon_step).astype(np.int64) - col0
+        rows = np.floor((90.0 - lats) / lat_step).astype(np.int64) - row0
+        return np.clip(rows, 0, row1 - row0 - 1), np.clip(cols, 0, col1 - col0 - 1)
+
+    def _assemble(self, window, chunks, interval, loaded) -> np.ndarray:
+        col0, col1, row0, row1 = window
+        p = self.chunk_px
+        out = np.full((row1 - row0, col1 - col0), np.nan, dtype=np.float32)
+        for chunk in chunks:
+            i, j = chunk
+            c_a, c_b = max(col0, i * p), min(col1, (i + 1) * p)
+            r_a, r_b = max(row0, j * p), min(row1, (j + 1) * p)
+            out[r_a - row0:r_b - row0, c_a - col0:c_b - col0] = loaded[(interval, chunk)][
+                r_a - j * p:r_b - j * p, c_a - i * p:c_b - i * p
+            ]
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "chunks_hit": self.chunks_hit,
+                "chunks_derived": self.chunks_derived,
+                "chunks_fetched": self.chunks_fetched,
+            }
+
+
+def block_mean(arr: np.ndarray, k: int) -> np.ndarray:
+    """Mean of the valid (finite) values in each k x k block; NaN where a block has none."""
+    h, w = arr.shape
+    blocks = arr.reshape(h // k, k, w // k, k)
+    valid = np.isfinite(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0.0).sum(axis=(1, 3), dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).astype(np.float32)
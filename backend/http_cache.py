@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+from typing import Optional
+
+from fastapi.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def etag_for(key: str) -> str:
+    """Strong ETag for a response fully determined by a make_cache_key key."""
+    return f'"{key[:32]}"'
+
+
+def content_etag(content: bytes) -> str:
+    """Strong ETag for a response whose bytes may change under the same request."""
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check with the weak comparison RFC 9110 prescribes for it."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+def not_modified(headers: dict) -> Response:
+    """304 carrying the validators and caching headers the full response would have had."""
+    return Response(status_code=304, headers=headers)
+
+
+class JSONCompressionMiddleware:
+    """
+    Gzip single-message JSON responses for clients that accept it. Images are already
+    compressed and SSE / streamed exports must not be buffered, so everything else
+    passes through untouched.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, compresslevel: int = 6):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+
+        held: Optional[Message] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal held
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if headers.get("content-type", "").startswith("application/json") and "content-encoding" not in headers:
+                    held = message
+                    return
+            elif message["type"] == "http.response.body" and held is not None:
+                start, held = held, None
+                body = message.get("body", b"")
+                if not message.get("more_body", False) and len(body) >= self.minimum_size:
+                    body = gzip.compress(body, compresslevel=self.compresslevel, mtime=0)
+                    headers = MutableHeaders(raw=start["headers"])
+                    headers["Content-Encoding"] = "gzip"
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+                await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
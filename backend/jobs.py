@@ -0,0 +1,226 @@
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from cache import TieredCache, make_cache_key
+
+
+logger = logging.getLogger("geo-app.jobs")
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+TERMINAL = (DONE, FAILED, CANCELLED)
+
+# report(progress in [0, 1], message)
+Report = Callable[[float, str], None]
+# fn(report) -> (result bytes, media type)
+JobFn = Callable[[Report], Tuple[bytes, str]]
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when `max_pending` jobs are already queued or running."""
+
+
+class Job:
+    __slots__ = (
+        "id", "kind", "params", "status", "progress", "message", "error", "media_type",
+        "created_at", "started_at", "finished_at", "version", "future", "waiters",
+    )
+
+    def __init__(self, kind: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = "queued"
+        self.error: Optional[str] = None
+        self.media_type: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # bumped on every change, so watchers only emit real updates
+        self.version = 0
+        self.future: Optional[Future] = None
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "error": self.error,
+            "media_type": self.media_type,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    In-process background jobs on a bounded worker pool. Jobs keep running when the
+    client that submitted them goes away; results (and the final job record) go to a
+    TieredCache, so they can be fetched later, also after the job left memory.
+    At most `max_pending` jobs are queued or running at a time; submit raises QueueFull beyond that.
+    """
+
+    def __init__(self, store: TieredCache, max_workers: int = 2, max_jobs: int = 1000, max_pending: int = 100):
+        self.store = store
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # queued + running
+        self._pending = 0
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    # --- public API ---
+    def submit(self, kind: str, params: dict, fn: JobFn) -> dict:
+        job = Job(kind, params)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"{self._pending} jobs already queued or running")
+            self._pending += 1
+            self._jobs[job.id] = job
+            self._evict()
+            self.submitted += 1
+            job.future = self._executor.submit(self._run, job, fn)
+            return job.to_dict()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        return self.store.get_json(make_cache_key("job", job_id))
+
+    def result(self, job_id: str) -> Optional[Tuple[bytes, str]]:
+        info = self.get(job_id)
+        if info is None or info["status"] != DONE:
+            return None
+        data = self.store.get(make_cache_key("job-result", job_id))
+        return None if data is None else (data, info["media_type"])
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not started yet."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED or not job.future.cancel():
+                return False
+            self._pending -= 1
+        self._update(job, status=CANCELLED, message="cancelled", finished_at=time.time())
+        self._persist(job)
+        return True
+
+    async def watch(self, job_id: str, heartbeat: float = 15.0) -> AsyncIterator[Optional[dict]]:
+        """
+        Job snapshots on every change until the job ends; None every `heartbeat` seconds
+        without a change (keep-alive). Ends immediately for unknown ids.
+        """
+        loop = asyncio.get_running_loop()
+        seen = -1
+        while True:
+            event = asyncio.Event()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job.waiters.append((loop, event))
+                    snapshot, version = job.to_dict(), job.version
+            if job is None:
+                stored = self.store.get_json(make_cache_key("job", job_id))
+                if stored is not None:
+                    yield stored
+                return
+
+            try:
+                if version != seen:
+                    seen = version
+                    yield snapshot
+                if snapshot["status"] in TERMINAL:
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+            finally:
+                with self._lock:
+                    if (loop, event) in job.waiters:
+                        job.waiters.remove((loop, event))
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_status: Dict[str, int] = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "pending": self._pending,
+                "in_memory": by_status,
+            }
+
+    # --- internals ---
+    def _run(self, job: Job, fn: JobFn) -> None:
+        self._update(job, status=RUNNING, message="running", started_at=time.time())
+
+        def report(progress: float, message: str) -> None:
+            self._update(job, progress=min(max(progress, 0.0), 1.0), message=message)
+
+        try:
+            data, media_type = fn(report)
+            self.store.set(make_cache_key("job-result", job.id), data)
+            self._update(job, status=DONE, progress=1.0, message="done", media_type=media_type, finished_at=time.time())
+            with self._lock:
+                self.completed += 1
+                self._pending -= 1
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.kind)
+            detail = getattr(e, "detail", None) or str(e)
+            self._update(job, status=FAILED, message="failed", error=str(detail), finished_at=time.time())
+            with self._lock:
+                self.failed += 1
+                self._pending -= 1
+        self._persist(job)
+
+    def _update(self, job: Job, **changes) -> None:
+        with self._lock:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.version += 1
+            waiters = list(job.waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # the watcher's event loop is gone
+                pass
+
+    def _persist(self, job: Job) -> None:
+        with self._lock:
+            record = job.to_dict()
+        self.store.set_json(make_cache_key("job", job.id), record)
+
+    def _evict(self) -> None:
+        """Drop the oldest finished jobs from memory (caller holds the lock); their records stay in the store."""
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [jid for jid, job in self._jobs.items() if job.status in TERMINAL]:
+            if len(self._jobs) <= self.max_jobs:
+                break
+            del self._jobs[job_id]
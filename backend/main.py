@@ -1,22 +1,80 @@
 # backend/main.py
+import io
 import os
 import re
+import json
+import math
+import base64
+import hashlib
 import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
-from typing import List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, Depends, Query, Body
+from fastapi import FastAPI, HTTPException, Depends, Query, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlmodel import SQLModel, Field, create_engine, Session, select, func
+from sqlalchemy import Index, and_, insert, literal, text
 from passlib.context import CryptContext
 from datetime import datetime
 # local module (must exist)
-from sentinel_process import generate_ndvi_png_bytes
+from sentinel_process import (
+    get_sh_client,
+    generate_ndvi_png_bytes,
+    fetch_ndvi_array,
+    fetch_ndvi_series,
+    fetch_ndvi_tile,
+    fetch_ndvi_rasters,
+    render_ndvi_image,
+    render_ndvi_png,
+    pack_ndvi,
+    unpack_ndvi,
+    EVALSCRIPT_NDVI,
+    EVALSCRIPT_NDVI_RAW,
+    NDVI_RENDER_MODE,
+    NDVI_BREAKS,
+    PALETTES,
+    IMAGE_FORMATS,
+)
+from cache import TieredCache, make_cache_key
+from singleflight import SingleFlight
+from ndvi_stats import compute_ndvi_stats
+import tiles
+from chunk_store import NDVIChunkStore
+import parcel_io
+from jobs import JobQueue, QueueFull, TERMINAL as JOB_TERMINAL
+from prewarm import Prewarmer, bbox_pixels, estimate_processing_units
+from http_cache import IMMUTABLE, JSONCompressionMiddleware, content_etag, etag_for, etag_matches, not_modified
+from metrics import REGISTRY, MetricsMiddleware, stage
+from profiling import ProfileStore, ProfilingMiddleware
+from admission import (
+    AdmissionController,
+    AdmissionRejected,
+    RENDER_BYTES_PER_PIXEL,
+    RGBA_RENDER_BYTES_PER_PIXEL,
+    SERIES_BYTES_PER_PIXEL,
+)
+import anyio
+from spatial_index import ParcelIndexCache, ensure_spatial_index, pg_intersecting_ids, pg_nearest_ids, box_distance_km
 from fastapi import status
 import numpy as np
-from modis import MODISAnalyzer, main as modis_main
+from modis import (
+    MODISAnalyzer,
+    analyze_land_cover_batch as modis_land_cover_batch,
+    analyze_land_cover_change as modis_land_cover_change,
+    ensure_initialized as modis_ensure_initialized,
+    get_global_tile_url as modis_global_tile_url,
+    get_legend as modis_legend,
+)
+from modis_local import (
+    LocalMODISAnalyzer,
+    analyze_land_cover_batch as local_land_cover_batch,
+    analyze_land_cover_change as local_land_cover_change,
+)
 
 
 
@@ -37,10 +95,175 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # the browser hides non-safelisted response headers from scripts unless listed here
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(JSONCompressionMiddleware, minimum_size=int(os.getenv("JSON_GZIP_MIN_BYTES", "1024")))
+# outermost, so request latency includes compression
+app.add_middleware(MetricsMiddleware)
+
+# --- Opt-in request profiling ---
+# requests with "X-Profile: $PROFILE_TOKEN", plus a random PROFILE_SAMPLE_RATE share of all requests
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+if PROFILE_TOKEN or PROFILE_SAMPLE_RATE > 0:
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=ProfileStore(
+            os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "geo-app-profiles")),
+            keep_slowest=int(os.getenv("PROFILE_KEEP_SLOWEST", "5")),
+        ),
+        token=PROFILE_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0,
+    )
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# --- Spatial queries over saved coordinates ---
+# GiST index on PostgreSQL (set at startup), otherwise an in-process R-tree per user
+pg_spatial_index = False
+parcel_indexes = ParcelIndexCache(max_users=int(os.getenv("PARCEL_INDEX_MAX_USERS", "256")))
+MAX_VIEWPORT_PARCELS = int(os.getenv("MAX_VIEWPORT_PARCELS", "5000"))
+# rows per keyset page when listing / streaming a user's coordinates
+COORD_PAGE_SIZE = int(os.getenv("COORD_PAGE_SIZE", "1000"))
+# bulk parcel import
+IMPORT_MAX_MB = int(os.getenv("IMPORT_MAX_MB", "50"))
+IMPORT_BATCH_ROWS = int(os.getenv("IMPORT_BATCH_ROWS", "5000"))
+
+# --- NDVI render cache ---
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "geo-app-cache"))
+NDVI_CACHE_TTL = float(os.getenv("NDVI_CACHE_TTL", str(6 * 3600)))
+
+ndvi_cache = TieredCache(
+    "ndvi",
+    max_items=int(os.getenv("NDVI_CACHE_MEMORY_ITEMS", "128")),
+    max_memory_bytes=int(os.getenv("NDVI_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+    disk_dir=os.path.join(CACHE_DIR, "ndvi"),
+    max_disk_bytes=int(os.getenv("NDVI_CACHE_DISK_MB", "512")) * 1024 * 1024,
+    ttl_seconds=NDVI_CACHE_TTL,
+)
+# raw NDVI arrays, so one upstream fetch serves every palette/legend
+ndvi_raw_cache = TieredCache(
+    "ndvi-raw",
+    max_items=int(os.getenv("NDVI_RAW_CACHE_MEMORY_ITEMS", "32")),
+    max_memory_bytes=int(os.getenv("NDVI_RAW_CACHE_MEMORY_MB", "256")) * 1024 * 1024,
+    disk_dir=os.path.join(CACHE_DIR, "ndvi-raw"),
+    max_disk_bytes=int(os.getenv("NDVI_RAW_CACHE_DISK_MB", "2048")) * 1024 * 1024,
+    ttl_seconds=NDVI_CACHE_TTL,
+)
+# raw NDVI per web-mercator tile; palette and parcel clipping are applied per request
+ndvi_tile_cache = TieredCache(
+    "ndvi-tiles",
+    max_items=int(os.getenv("NDVI_TILE_CACHE_MEMORY_ITEMS", "2048")),
+    max_memory_bytes=int(os.getenv("NDVI_TILE_CACHE_MEMORY_MB", "128")) * 1024 * 1024,
+    disk_dir=os.path.join(CACHE_DIR, "ndvi-tiles"),
+    max_disk_bytes=int(os.getenv("NDVI_TILE_CACHE_DISK_MB", "1024")) * 1024 * 1024,
+    ttl_seconds=NDVI_CACHE_TTL,
+)
+# grid-aligned raw NDVI chunks shared between overlapping parcels
+NDVI_CHUNK_STORE = os.getenv("NDVI_CHUNK_STORE", "1") == "1"
+ndvi_chunk_cache = TieredCache(
+    "ndvi-chunks",
+    max_items=int(os.getenv("NDVI_CHUNK_CACHE_MEMORY_ITEMS", "256")),
+    max_memory_bytes=int(os.getenv("NDVI_CHUNK_CACHE_MEMORY_MB", "256")) * 1024 * 1024,
+    disk_dir=os.path.join(CACHE_DIR, "ndvi-chunks"),
+    max_disk_bytes=int(os.getenv("NDVI_CHUNK_CACHE_DISK_MB", "4096")) * 1024 * 1024,
+    ttl_seconds=NDVI_CACHE_TTL,
+)
+# below this zoom Sentinel Hub rejects the resolution (~1.2 km/px at z7)
+TILE_MIN_ZOOM = int(os.getenv("NDVI_TILE_MIN_ZOOM", "7"))
+TILE_MAX_ZOOM = int(os.getenv("NDVI_TILE_MAX_ZOOM", "18"))
+EVALSCRIPT_NDVI_HASH = hashlib.sha256(EVALSCRIPT_NDVI.encode("utf-8")).hexdigest()[:16]
+EVALSCRIPT_NDVI_RAW_HASH = hashlib.sha256(EVALSCRIPT_NDVI_RAW.encode("utf-8")).hexdigest()[:16]
+
+# --- Upstream request coalescing ---
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "120"))
+
+# --- HTTP caching ---
+# intervals that ended this many days ago no longer receive new Sentinel-2 scenes
+NDVI_SETTLE_DAYS = int(os.getenv("NDVI_SETTLE_DAYS", "3"))
+NDVI_RECENT_MAX_AGE = int(os.getenv("NDVI_RECENT_MAX_AGE", "3600"))
+
+ndvi_flights = SingleFlight("ndvi", max_workers=int(os.getenv("NDVI_UPSTREAM_WORKERS", "8")))
+NDVI_SERIES_WORKERS = int(os.getenv("NDVI_SERIES_WORKERS", "8"))
+MAX_SERIES_STEPS = int(os.getenv("MAX_SERIES_STEPS", "60"))
+MAX_BBOX_SPAN_DEG = float(os.getenv("MAX_BBOX_SPAN_DEG", "5.0"))
+ndvi_chunk_store = NDVIChunkStore(
+    ndvi_chunk_cache,
+    lambda items, size: fetch_ndvi_rasters(items, size, max_threads=NDVI_SERIES_WORKERS),
+    chunk_px=int(os.getenv("NDVI_CHUNK_PX", "512")),
+    ref_lat=float(os.getenv("NDVI_CHUNK_REF_LAT", "45.0")),
+    max_chunks=int(os.getenv("NDVI_CHUNK_MAX_CHUNKS", "64")),
+    key_salt=EVALSCRIPT_NDVI_RAW_HASH,
+    pyramid_max_factor=int(os.getenv("NDVI_PYRAMID_MAX_FACTOR", "4")),
+    max_overfetch=float(os.getenv("NDVI_CHUNK_MAX_OVERFETCH", "4")),
+)
+ndvi_raw_flights = SingleFlight("ndvi-raw", max_workers=int(os.getenv("NDVI_UPSTREAM_WORKERS", "8")))
+modis_flights = SingleFlight("modis", max_workers=int(os.getenv("MODIS_UPSTREAM_WORKERS", "4")))
+# the tile URL depends only on (year, lc_type), so every bbox shares one getMapId call
+modis_tile_flights = SingleFlight("modis-tiles", max_workers=2)
+modis_ee_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MODIS_UPSTREAM_WORKERS", "4")), thread_name_prefix="modis-ee"
+)
+
+# --- Admission control ---
+# cold NDVI renders are admitted against a budget of estimated peak memory, so a few 1 m
+# renders of a 5 degree bbox cannot take the container down; small requests go first
+render_admission = AdmissionController(
+    "ndvi-render",
+    capacity_bytes=int(os.getenv("NDVI_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024,
+    interactive_bytes=int(os.getenv("NDVI_INTERACTIVE_MB", "64")) * 1024 * 1024,
+    max_queue=int(os.getenv("NDVI_ADMISSION_QUEUE", "64")),
+    max_queued_per_client=int(os.getenv("NDVI_ADMISSION_QUEUE_PER_CLIENT", "16")),
+    timeout=float(os.getenv("NDVI_ADMISSION_TIMEOUT", "30")),
+    starvation_seconds=float(os.getenv("NDVI_ADMISSION_STARVATION_SECONDS", "10")),
+)
+
+# --- MODIS result cache ---
+# "ee" = Google Earth Engine, "local" = MCD12Q1 rasters under MODIS_LOCAL_DIR (no network)
+MODIS_BACKEND = os.getenv("MODIS_BACKEND", "ee")
+MODIS_YEAR = 2024
+MODIS_LC_TYPE = 2
+MODIS_MAX_BATCH = int(os.getenv("MODIS_MAX_BATCH", "200"))
+# MCD12Q1 starts in 2001; LC_Type1..5 are the five classification schemes
+MODIS_FIRST_YEAR = 2001
+MODIS_LC_TYPES = (1, 2, 3, 4, 5)
+# land-cover histograms for a past year do not change
+modis_stats_cache = TieredCache(
+    "modis-stats",
+    max_items=int(os.getenv("MODIS_CACHE_MEMORY_ITEMS", "512")),
+    max_memory_bytes=8 * 1024 * 1024,
+    disk_dir=os.path.join(CACHE_DIR, "modis-stats"),
+    max_disk_bytes=64 * 1024 * 1024,
+    ttl_seconds=float(os.getenv("MODIS_CACHE_TTL", str(7 * 24 * 3600))),
+)
+# Earth Engine map ids carry a token that expires, keep them in memory only and briefly
+modis_tile_cache = TieredCache(
+    "modis-tiles",
+    max_items=32,
+    max_memory_bytes=1024 * 1024,
+    ttl_seconds=float(os.getenv("MODIS_TILE_URL_TTL", "3600")),
+)
+
+# --- Background jobs ---
+# results and final job records, kept for later retrieval
+job_store = TieredCache(
+    "jobs",
+    max_items=64,
+    max_memory_bytes=64 * 1024 * 1024,
+    disk_dir=os.path.join(CACHE_DIR, "jobs"),
+    max_disk_bytes=int(os.getenv("JOB_STORE_DISK_MB", "1024")) * 1024 * 1024,
+    ttl_seconds=float(os.getenv("JOB_RESULT_TTL", str(24 * 3600))),
+)
+job_queue = JobQueue(
+    job_store,
+    max_workers=int(os.getenv("JOB_WORKERS", "2")),
+    max_jobs=int(os.getenv("JOB_MAX_IN_MEMORY", "1000")),
+    max_pending=int(os.getenv("JOB_MAX_PENDING", "100")),
+)
+JOB_KINDS = ("ndvi", "stats", "timeseries")
+
 # --- DB Models ---
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -57,6 +280,9 @@ class Coordinate(SQLModel, table=True):
     y2: float
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+    # keyset pagination over one user's rows: WHERE user_id = ? AND id > ? ORDER BY id
+    __table_args__ = (Index("ix_coordinate_user_id_id", "user_id", "id"),)
+
 
 # --- Pydantic (request/response) models ---
 class UserCreate(BaseModel):
@@ -87,6 +313,9 @@ class CoordRead(BaseModel):
     y2: float
     created_at: datetime
 
+class CoordNearest(CoordRead):
+    distance_km: float
+
 
 # --- Utilities ---
 def hash_password(password: str) -> str:
@@ -100,6 +329,9 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def create_db_and_tables():
     try:
         SQLModel.metadata.create_all(engine)
+        # create_all skips indexes of tables that already exist
+        for index in Coordinate.__table__.indexes:
+            index.create(engine, checkfirst=True)
         logger.info("Database tables created successfully")
     except Exception as e:
         logger.exception("Error creating database tables")
@@ -113,7 +345,19 @@ def get_session():
 # --- Startup ---
 @app.on_event("startup")
 def on_startup():
+    global pg_spatial_index
     create_db_and_tables()
+    pg_spatial_index = ensure_spatial_index(engine)
+    try:
+        get_sh_client().warm()
+    except Exception:
+        logger.warning("Sentinel Hub session not initialised at startup; retrying on first request", exc_info=True)
+    ndvi_prewarmer.start()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    ndvi_prewarmer.stop()
 
 
 # --- Health check endpoint ---
@@ -124,6 +368,12 @@ def read_root():
 
 @app.get("/health")
 def health_check():
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception:
+        logger.exception("Health check: database unreachable")
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "database": "unreachable"})
     return {"status": "healthy", "database": "connected"}
 
 
@@ -175,14 +425,19 @@ def get_user(username: str, session: Session = Depends(get_session)):
 @app.post("/users/{username}/coords", response_model=CoordCreate, status_code=201)
 def add_coord_for_user(username: str, coord: CoordCreate, session: Session = Depends(get_session)):
     try:
-        user = session.exec(select(User).where(User.username == username)).first()
-        if not user:
+        # INSERT ... SELECT: resolves the user and inserts in one statement
+        inserted = session.exec(
+            insert(Coordinate).from_select(
+                ["user_id", "x1", "y1", "x2", "y2", "created_at"],
+                select(
+                    User.id, literal(coord.x1), literal(coord.y1), literal(coord.x2), literal(coord.y2),
+                    literal(datetime.utcnow()),
+                ).where(User.username == username),
+            )
+        )
+        if inserted.rowcount == 0:
             raise HTTPException(status_code=404, detail="User not found")
-
-        db_coord = Coordinate(user_id=user.id, x1=coord.x1, y1=coord.y1, x2=coord.x2, y2=coord.y2)
-        session.add(db_coord)
         session.commit()
-        session.refresh(db_coord)
         logger.info(f"Added coordinate for user {username}: {coord}")
         return coord
 
@@ -193,30 +448,322 @@ def add_coord_for_user(username: str, coord: CoordCreate, session: Session = Dep
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+def _user_coords(
+    session: Session, username: str, *conditions, order_by=None, limit: Optional[int] = None
+) -> Tuple[int, List[Coordinate]]:
+    """
+    (user id, the user's coordinates matching `conditions`) in a single outer-joined query;
+    404 when the user does not exist.
+    """
+    stmt = (
+        select(User.id, Coordinate)
+        .outerjoin(Coordinate, and_(Coordinate.user_id == User.id, *conditions))
+        .where(User.username == username)
+    )
+    if order_by is not None:
+        stmt = stmt.order_by(order_by)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    rows = session.exec(stmt).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="User not found")
+    return rows[0][0], [coord for _, coord in rows if coord is not None]
+
+
+COORD_COLUMNS = (Coordinate.id, Coordinate.x1, Coordinate.y1, Coordinate.x2, Coordinate.y2, Coordinate.created_at)
+
+
+def _coord_page(session: Session, username: str, after_id: int, limit: int) -> Tuple[int, list]:
+    """
+    (user id, next `limit` coordinate rows with id > after_id) in a single query: the outer
+    join keeps the user row even when the page is empty, so a missing user is still a 404.
+    """
+    rows = session.exec(
+        select(User.id, *COORD_COLUMNS)
+        .outerjoin(Coordinate, and_(Coordinate.user_id == User.id, Coordinate.id > after_id))
+        .where(User.username == username)
+        .order_by(Coordinate.id)
+        .limit(limit)
+    ).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="User not found")
+    return rows[0][0], [row[1:] for row in rows if row[1] is not None]
+
+
+def _coord_json(row) -> str:
+    coord_id, x1, y1, x2, y2, created_at = row
+    return json.dumps(
+        {"id": coord_id, "x1": x1, "y1": y1, "x2": x2, "y2": y2, "created_at": created_at.isoformat()},
+        separators=(",", ":"),
+    )
+
+
+def _coord_pages(user_id: int, first_page: list, page_size: int):
+    """Keyset pages of a user's coordinate rows, starting with an already fetched first page."""
+    page = first_page
+    # the request session is closed once the response starts, later pages use their own
+    with Session(engine) as session:
+        while page:
+            yield page
+            if len(page) < page_size:
+                break
+            page = session.exec(
+                select(*COORD_COLUMNS)
+                .where(Coordinate.user_id == user_id, Coordinate.id > page[-1][0])
+                .order_by(Coordinate.id)
+                .limit(page_size)
+            ).all()
+
+
+def _stream_coords(user_id: int, first_page: list, page_size: int):
+    """JSON array of all the user's coordinates, one keyset page in memory at a time."""
+    yield "["
+    sep = ""
+    for page in _coord_pages(user_id, first_page, page_size):
+        yield sep + ",".join(_coord_json(row) for row in page)
+        sep = ","
+    yield "]"
+
+
 @app.get("/users/{username}/coords", response_model=List[CoordRead])
-def list_coords_for_user(username: str, session: Session = Depends(get_session)):
+def list_coords_for_user(
+    username: str,
+    after_id: int = Query(0, ge=0, description="Keyset cursor: only coordinates with a larger id"),
+    limit: Optional[int] = Query(None, ge=1, le=COORD_PAGE_SIZE, description="Page size; omit to stream all"),
+    session: Session = Depends(get_session)
+):
+    """
+    Coordinates of a user in id order. Without `limit` the whole history is streamed;
+    with `limit` one page is returned and `X-Next-Cursor` holds the `after_id` of the next one.
+    """
     try:
-        user = session.exec(select(User).where(User.username == username)).first()
-        if not user:
+        page_size = limit or COORD_PAGE_SIZE
+        user_id, page = _coord_page(session, username, after_id, page_size)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error listing coordinates")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    if limit is not None:
+        headers = {"X-Next-Cursor": str(page[-1][0])} if len(page) == limit else {}
+        body = "[" + ",".join(_coord_json(row) for row in page) + "]"
+        return Response(content=body, media_type="application/json", headers=headers)
+    return StreamingResponse(_stream_coords(user_id, page, page_size), media_type="application/json")
+
+
+def _bulk_insert_coords(session: Session, user_id: int, boxes: np.ndarray) -> None:
+    """
+    Insert all rows in the session's transaction: COPY on PostgreSQL, batched executemany
+    elsewhere. The caller commits.
+    """
+    created_at = datetime.utcnow()
+    if engine.dialect.name == "postgresql":
+        cursor = session.connection().connection.cursor()
+        stamp = created_at.isoformat()
+        for start in range(0, len(boxes), IMPORT_BATCH_ROWS):
+            buf = io.StringIO("".join(
+                f"{user_id},{x1!r},{y1!r},{x2!r},{y2!r},{stamp}\n"
+                for x1, y1, x2, y2 in boxes[start:start + IMPORT_BATCH_ROWS].tolist()
+            ))
+            cursor.copy_expert("COPY coordinate (user_id, x1, y1, x2, y2, created_at) FROM STDIN WITH (FORMAT csv)", buf)
+        return
+
+    for start in range(0, len(boxes), IMPORT_BATCH_ROWS):
+        session.exec(insert(Coordinate), params=[
+            {"user_id": user_id, "x1": x1, "y1": y1, "x2": x2, "y2": y2, "created_at": created_at}
+            for x1, y1, x2, y2 in boxes[start:start + IMPORT_BATCH_ROWS].tolist()
+        ])
+
+
+async def _read_import_body(request: Request) -> bytes:
+    """Upload body, rejected with 413 from Content-Length or as soon as more than IMPORT_MAX_MB has arrived."""
+    max_bytes = IMPORT_MAX_MB * 1024 * 1024
+    too_large = HTTPException(status_code=413, detail=f"Import file larger than {IMPORT_MAX_MB} MB")
+    try:
+        declared = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if declared > max_bytes:
+        raise too_large
+
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@app.post("/users/{username}/coords/import")
+async def import_coords(
+    username: str,
+    request: Request,
+    format: Optional[str] = Query(None, description="csv or geojson; defaults to the Content-Type"),
+    strict: bool = Query(False, description="Reject the whole file if any row is invalid"),
+    session: Session = Depends(get_session)
+):
+    """
+    Bulk-insert parcels from a CSV (header x1,y1,x2,y2) or a GeoJSON FeatureCollection
+    (one bbox per feature), in one transaction. Invalid rows are skipped and reported,
+    or fail the request with strict=true.
+    """
+    data = await _read_import_body(request)
+    content_type = request.headers.get("content-type", "")
+    fmt = format or ("csv" if "csv" in content_type else "geojson")
+    if fmt not in ("csv", "geojson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'geojson'")
+
+    try:
+        boxes = parcel_io.parse_csv(data) if fmt == "csv" else parcel_io.parse_geojson(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse {fmt}: {str(e)}")
+    valid, errors = parcel_io.validate_boxes(boxes)
+    if strict and errors:
+        raise HTTPException(status_code=400, detail={"message": "Invalid rows", "errors": errors})
+
+    def insert_all():
+        user_id = session.exec(select(User.id).where(User.username == username)).first()
+        if user_id is None:
             raise HTTPException(status_code=404, detail="User not found")
+        try:
+            _bulk_insert_coords(session, user_id, boxes[valid])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    try:
+        await run_in_threadpool(insert_all)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error importing coordinates")
+        raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+
+    logger.info("Imported %d coordinates for user %s (%d skipped)", int(valid.sum()), username, int((~valid).sum()))
+    return {"inserted": int(valid.sum()), "skipped": int((~valid).sum()), "errors": errors}
+
+
+@app.get("/users/{username}/coords/export")
+def export_coords(
+    username: str,
+    format: str = Query("geojson", description="csv or geojson"),
+    session: Session = Depends(get_session)
+):
+    """All parcels of a user as a streamed CSV or GeoJSON download, in id order."""
+    if format not in ("csv", "geojson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'geojson'")
+    user_id, page = _coord_page(session, username, 0, COORD_PAGE_SIZE)
+    pages = _coord_pages(user_id, page, COORD_PAGE_SIZE)
+    if format == "csv":
+        body, media_type = parcel_io.csv_chunks(pages), "text/csv"
+    else:
+        body, media_type = parcel_io.geojson_chunks(pages), "application/geo+json"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{username}-parcels.{format}"'},
+    )
+
+
+def _parcel_tree(session: Session, username: str):
+    """
+    The user's R-tree; its version (row count, max id) comes from one query outer-joined to
+    the user row, so a missing user is a 404 without a separate lookup.
+    """
+    row = session.exec(
+        select(User.id, func.count(Coordinate.id), func.max(Coordinate.id))
+        .outerjoin(Coordinate, Coordinate.user_id == User.id)
+        .where(User.username == username)
+        .group_by(User.id)
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_id, version = row[0], tuple(row[1:])
+
+    def load():
+        rows = session.exec(
+            select(Coordinate.id, Coordinate.x1, Coordinate.y1, Coordinate.x2, Coordinate.y2)
+            .where(Coordinate.user_id == user_id)
+        ).all()
+        return [r[0] for r in rows], np.array([r[1:] for r in rows], dtype=np.float64)
+
+    return parcel_indexes.get(user_id, version, load)
+
+
+def _coords_by_ids(session: Session, ids: List[int]) -> List[Coordinate]:
+    if not ids:
+        return []
+    by_id = {c.id: c for c in session.exec(select(Coordinate).where(Coordinate.id.in_(ids))).all()}
+    return [by_id[i] for i in ids if i in by_id]
 
-        coords = session.exec(select(Coordinate).where(Coordinate.user_id == user.id)).all()
-        result = [
-            CoordRead(
-                id=c.id,
-                x1=c.x1,
-                y1=c.y1,
-                x2=c.x2,
-                y2=c.y2,
-                created_at=c.created_at
+
+def _coord_read(c: Coordinate) -> CoordRead:
+    return CoordRead(id=c.id, x1=c.x1, y1=c.y1, x2=c.x2, y2=c.y2, created_at=c.created_at)
+
+
+@app.get("/users/{username}/coords/within", response_model=List[CoordRead])
+def coords_within_bbox(
+    username: str,
+    x1: float = Query(..., description="Longitude minimum"),
+    y1: float = Query(..., description="Latitude minimum"),
+    x2: float = Query(..., description="Longitude maximum"),
+    y2: float = Query(..., description="Latitude maximum"),
+    limit: int = Query(1000, ge=1, le=MAX_VIEWPORT_PARCELS),
+    session: Session = Depends(get_session)
+):
+    """
+    Saved parcels intersecting a bbox (e.g. the visible map viewport), ordered by id.
+    """
+    try:
+        lon_min, lon_max = sorted([x1, x2])
+        lat_min, lat_max = sorted([y1, y2])
+        bbox = (lon_min, lat_min, lon_max, lat_max)
+        if pg_spatial_index:
+            ids = pg_intersecting_ids(session, username, bbox, limit)
+            if ids is None:
+                raise HTTPException(status_code=404, detail="User not found")
+        else:
+            ids = sorted(int(i) for i in _parcel_tree(session, username).intersecting(bbox))[:limit]
+        return [_coord_read(c) for c in _coords_by_ids(session, ids)]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error querying coordinates by bbox")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.get("/users/{username}/coords/nearest", response_model=List[CoordNearest])
+def coords_nearest(
+    username: str,
+    lon: float = Query(..., ge=-180, le=180),
+    lat: float = Query(..., ge=-90, le=90),
+    k: int = Query(10, ge=1, le=100),
+    session: Session = Depends(get_session)
+):
+    """
+    The k saved parcels closest to a point, nearest first, with the distance in km (0 = inside).
+    """
+    try:
+        if pg_spatial_index:
+            ids = pg_nearest_ids(session, username, lon, lat, k)
+            if ids is None:
+                raise HTTPException(status_code=404, detail="User not found")
+        else:
+            ids = [i for i, _ in _parcel_tree(session, username).nearest(lon, lat, k)]
+        return [
+            CoordNearest(
+                **_coord_read(c).model_dump(), distance_km=box_distance_km((c.x1, c.y1, c.x2, c.y2), lon, lat)
             )
-            for c in coords
+            for c in _coords_by_ids(session, ids)
         ]
-        return result
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception("Error listing coordinates")
+        logger.exception("Error querying nearest coordinates")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
@@ -277,20 +824,13 @@ def delete_coord(username: str, coord_id: int, session: Session = Depends(get_se
     Șterge o coordonată specifică a unui user după id.
     """
     try:
-        # verifică dacă user-ul există
-        user = session.exec(select(User).where(User.username == username)).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # verifică dacă coordonata există și aparține user-ului
-        coord = session.exec(
-            select(Coordinate).where(Coordinate.id == coord_id, Coordinate.user_id == user.id)
-        ).first()
-        if not coord:
+        # verifică într-o singură interogare că user-ul există și că coordonata îi aparține
+        _, coords = _user_coords(session, username, Coordinate.id == coord_id)
+        if not coords:
             raise HTTPException(status_code=404, detail="Coordinate not found")
 
         # șterge coordonata
-        session.delete(coord)
+        session.delete(coords[0])
         session.commit()
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -316,20 +856,458 @@ def _validate_and_order_bbox(bbox: Tuple[float, float, float, float]) -> Tuple[f
     lon_min, lon_max = sorted([x1, x2])
     lat_min, lat_max = sorted([y1, y2])
 
-    # reject extremely large bbox (safety)
+    # reject extremely large bbox (safety); rasters above the upstream size limit are sub-tiled
     max_span_deg = max(lon_max - lon_min, lat_max - lat_min)
-    if max_span_deg > 5.0:  # arbitrary safety cap (5 degrees)
+    if max_span_deg > MAX_BBOX_SPAN_DEG:
         raise HTTPException(status_code=400, detail="Requested bbox too large. Please request a smaller area.")
 
     return (lon_min, lat_min, lon_max, lat_max)
 
 
+def _bbox_key(bbox: Tuple[float, float, float, float]) -> Tuple[float, ...]:
+    # ~0.1 m precision, so float noise from the client does not split cache entries
+    return tuple(round(v, 6) for v in bbox)
+
+
+def _renders_locally(palette: str) -> bool:
+    return NDVI_RENDER_MODE == "local" or palette != "default"
+
+
+def _ndvi_png_key(
+    bbox: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str],
+    resolution: int,
+    palette: str = "default",
+    image_format: str = "png",
+) -> str:
+    if _renders_locally(palette):
+        return make_cache_key(
+            "ndvi-png", _bbox_key(bbox), time_interval, resolution, EVALSCRIPT_NDVI_RAW_HASH, palette, image_format
+        )
+    return make_cache_key("ndvi-png", _bbox_key(bbox), time_interval, resolution, EVALSCRIPT_NDVI_HASH, image_format)
+
+
+def _ndvi_raw_key(bbox: Tuple[float, float, float, float], time_interval: Tuple[str, str], resolution: int) -> str:
+    return make_cache_key("ndvi-raw", _bbox_key(bbox), time_interval, resolution, EVALSCRIPT_NDVI_RAW_HASH)
+
+
+def _uses_chunk_store(
+    bbox: Tuple[float, float, float, float], intervals: List[Tuple[str, str]], resolution: int
+) -> bool:
+    """Chunked reads only where they do not fetch far more than the bbox itself (small parcels go direct)."""
+    return NDVI_CHUNK_STORE and ndvi_chunk_store.worth_it(bbox, intervals, resolution)
+
+
+def _fetch_ndvi_raw(
+    bbox: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str],
+    resolution: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Raw NDVI from the chunk store when the bbox fits it, otherwise one direct (tiled) fetch."""
+    if _uses_chunk_store(bbox, [time_interval], resolution):
+        return ndvi_chunk_store.read(bbox, time_interval, resolution)
+    return fetch_ndvi_array(bbox, time_interval, resolution)
+
+
+def _get_ndvi_array(
+    bbox: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str],
+    resolution: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Raw NDVI (ndvi, mask) for a normalized bbox; cached and coalesced across palettes."""
+    key = _ndvi_raw_key(bbox, time_interval, resolution)
+    data = ndvi_raw_cache.get(key)
+    if data is not None:
+        return unpack_ndvi(data)
+
+    def fetch() -> bytes:
+        with stage("ndvi_raw_fetch"):
+            packed = pack_ndvi(*_fetch_ndvi_raw(bbox, time_interval, resolution))
+        ndvi_raw_cache.set(key, packed)
+        return packed
+
+    return unpack_ndvi(ndvi_raw_flights.do(key, fetch, timeout=UPSTREAM_TIMEOUT))
+
+
+def _render_ndvi_png(
+    bbox: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str],
+    resolution: int,
+    palette: str = "default",
+    image_format: str = "png",
+) -> bytes:
+    """
+    Cached front for the NDVI image render (PNG unless `image_format` says otherwise).
+    `bbox` must already be normalized by _validate_and_order_bbox.
+    """
+    key = _ndvi_png_key(bbox, time_interval, resolution, palette, image_format)
+    png_bytes = ndvi_cache.get(key)
+    if png_bytes is not None:
+        return png_bytes
+
+    with stage("ndvi_render"):
+        if _renders_locally(palette):
+            ndvi, mask = _get_ndvi_array(bbox, time_interval, resolution)
+            png_bytes = render_ndvi_image(ndvi, mask, palette, image_format)
+        else:
+            png_bytes = generate_ndvi_png_bytes(
+                bbox_wgs84=bbox,
+                time_interval=time_interval,
+                resolution=resolution,
+                mode="upstream",
+                image_format=image_format,
+            )
+    ndvi_cache.set(key, png_bytes)
+    return png_bytes
+
+
+def _render_cost(
+    bbox: Tuple[float, float, float, float], resolution: int, steps: int = 1, rgba: bool = False
+) -> int:
+    """Estimated peak bytes of a cold render of bbox (or a time series of `steps` intervals)."""
+    width, height = bbox_pixels(bbox, resolution)
+    per_pixel = RGBA_RENDER_BYTES_PER_PIXEL if rgba else RENDER_BYTES_PER_PIXEL
+    return width * height * (per_pixel + SERIES_BYTES_PER_PIXEL * (steps - 1))
+
+
+def _check_render_cost(cost: int) -> None:
+    if cost > render_admission.capacity_bytes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Request would need about {cost >> 20} MB to render. "
+                   "Please use a coarser resolution or a smaller area.",
+        )
+
+
+def _client_id(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+async def _admitted(flights: SingleFlight, key: str, fn: Callable[[], Any], cost: int, client: str) -> Any:
+    """
+    flights.do_async(key, fn) once `cost` bytes are admitted by render_admission. Once fn
+    has started the reservation is held until it returns, even if this caller stops waiting;
+    a caller leaving before that gives it back and the flight fails with 503 rather than
+    running unreserved. Joining a call already in flight costs nothing extra.
+    """
+    try:
+        if flights.in_flight(key):
+            # the flight fails with AdmissionRejected if its owner gave the reservation back
+            return await flights.do_async(key, fn, timeout=UPSTREAM_TIMEOUT)
+        _check_render_cost(cost)
+        ticket = await render_admission.acquire_async(cost, client)
+        try:
+            return await flights.do_async(key, lambda: ticket.run(fn), timeout=UPSTREAM_TIMEOUT)
+        finally:
+            ticket.detach()
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _run_admitted(cost: int, client: str, fn: Callable[[], Any]) -> Any:
+    """Blocking, for background work (jobs, pre-warming): waits its turn as bulk, never rejected."""
+    return render_admission.acquire(cost, client, timeout=None).run(fn)
+
+
+async def _render_ndvi_png_shared(
+    bbox: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str],
+    resolution: int,
+    palette: str = "default",
+    image_format: str = "png",
+    client: str = "unknown",
+) -> bytes:
+    """
+    _render_ndvi_png behind single-flight: identical concurrent requests share one
+    upstream call, and waiting does not hold a threadpool thread. Cold renders go
+    through admission control.
+    """
+    key = _ndvi_png_key(bbox, time_interval, resolution, palette, image_format)
+
+    def render() -> bytes:
+        return _render_ndvi_png(bbox, time_interval, resolution, palette, image_format)
+
+    if ndvi_cache.contains(key):
+        return await ndvi_flights.do_async(key, render, timeout=UPSTREAM_TIMEOUT)
+    cost = _render_cost(bbox, resolution, rgba=not _renders_locally(palette))
+    return await _admitted(ndvi_flights, key, render, cost, client)
+
+
+def _validate_palette(palette: str) -> str:
+    if palette not in PALETTES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown palette. Available: {', '.join(sorted(PALETTES))}"
+        )
+    return palette
+
+
+def _accept_quality(accept: str) -> dict:
+    """Accept header -> {media range: q}."""
+    quality = {}
+    for part in accept.split(","):
+        media, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media:
+            quality[media.strip().lower()] = q
+    return quality
+
+
+def _image_format(requested: Optional[str], accept: Optional[str]) -> str:
+    """
+    Output encoding for an NDVI image: the explicit `format` if given, else WebP (lossless)
+    when the Accept header names image/webp at least as strongly as PNG, else PNG.
+    """
+    if requested:
+        if requested not in IMAGE_FORMATS:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown format. Available: {', '.join(IMAGE_FORMATS)}"
+            )
+        return requested
+    quality = _accept_quality(accept or "")
+    webp = quality.get("image/webp", 0.0)
+    png = quality.get("image/png", quality.get("image/*", quality.get("*/*", 0.0)))
+    return "webp" if webp > 0 and webp >= png else "png"
+
+
+def _ndvi_cache_headers(key: str, time_interval: Tuple[str, str], content: Optional[bytes] = None) -> dict:
+    """
+    Validators for an NDVI image named by its cache key. Images of settled intervals never
+    change, so the key is their ETag. Recent ones may gain scenes under the same key, so
+    their ETag hashes the rendered bytes (none before rendering) and browsers and the CDN
+    revalidate them hourly.
+    """
+    settled = date.fromisoformat(time_interval[1]) < date.today() - timedelta(days=NDVI_SETTLE_DAYS)
+    headers = {
+        "Cache-Control": IMMUTABLE if settled else f"public, max-age={NDVI_RECENT_MAX_AGE}",
+        # the encoding may follow the Accept header, so shared caches must key on it
+        "Vary": "Accept",
+    }
+    if settled:
+        headers["ETag"] = etag_for(key)
+    elif content is not None:
+        headers["ETag"] = content_etag(content)
+    return headers
+
+
+def _ndvi_not_modified(request: Request, key: str, time_interval: Tuple[str, str]) -> Optional[Response]:
+    """304 before any rendering, for settled intervals whose ETag is known up front."""
+    cache_headers = _ndvi_cache_headers(key, time_interval)
+    if "ETag" in cache_headers and etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+        return not_modified(cache_headers)
+    return None
+
+
+def _ndvi_image_response(
+    request: Request, content: bytes, image_format: str, key: str, time_interval: Tuple[str, str]
+) -> Response:
+    """The rendered image, or a 304 when the client's copy still has the same ETag."""
+    cache_headers = _ndvi_cache_headers(key, time_interval, content)
+    if etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+        return not_modified(cache_headers)
+    return _image_response(content, image_format, cache_headers)
+
+
+def _image_response(content: bytes, image_format: str, headers: Optional[dict] = None) -> Response:
+    return Response(content=content, media_type=IMAGE_FORMATS[image_format], headers=headers or {"Vary": "Accept"})
+
+
+@app.get("/ndvi/palettes")
+def ndvi_palettes():
+    """Legend for every palette: NDVI class bounds and their colour."""
+    bounds = [None] + [round(float(b), 4) for b in NDVI_BREAKS] + [None]
+    return {
+        name: [
+            {"min": bounds[i], "max": bounds[i + 1], "color": "#%02x%02x%02x" % tuple(int(c) for c in rgb)}
+            for i, rgb in enumerate(colors)
+        ]
+        for name, colors in PALETTES.items()
+    }
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "ndvi": ndvi_cache.stats(),
+        "ndvi_raw": ndvi_raw_cache.stats(),
+        "ndvi_tiles": ndvi_tile_cache.stats(),
+        "ndvi_chunks": {**ndvi_chunk_cache.stats(), **ndvi_chunk_store.stats()},
+        "ndvi_flights": ndvi_flights.stats(),
+        "ndvi_raw_flights": ndvi_raw_flights.stats(),
+        "modis_stats": modis_stats_cache.stats(),
+        "modis_tiles": modis_tile_cache.stats(),
+        "modis_flights": modis_flights.stats(),
+        "parcel_indexes": parcel_indexes.stats(),
+        "jobs": {**job_store.stats(), **job_queue.stats()},
+        "modis_tile_flights": modis_tile_flights.stats(),
+        "prewarm": ndvi_prewarmer.stats(),
+        "admission": render_admission.stats(),
+    }
+
+
+# --- Prometheus metrics ---
+# stage latencies and upstream counters are recorded where they happen (metrics.stage);
+# the gauges below read the existing counters at scrape time, so they cost nothing in between
+_METRIC_CACHES = (
+    ndvi_cache, ndvi_raw_cache, ndvi_tile_cache, ndvi_chunk_cache, modis_stats_cache, modis_tile_cache, job_store
+)
+_METRIC_FLIGHTS = (ndvi_flights, ndvi_raw_flights, modis_flights, modis_tile_flights)
+
+
+def _cache_lookups():
+    for cache in _METRIC_CACHES:
+        stats = cache.stats()
+        yield {"cache": cache.name, "result": "hit_memory"}, stats["hits_memory"]
+        yield {"cache": cache.name, "result": "hit_disk"}, stats["hits_disk"]
+        yield {"cache": cache.name, "result": "miss"}, stats["misses"]
+
+
+def _cache_bytes():
+    for cache in _METRIC_CACHES:
+        stats = cache.stats()
+        yield {"cache": cache.name, "tier": "memory"}, stats["memory_bytes"]
+        yield {"cache": cache.name, "tier": "disk"}, stats["disk_bytes"]
+
+
+def _queue_depths():
+    for flights in _METRIC_FLIGHTS:
+        yield {"pool": f"{flights.name}-flight"}, flights.stats()["queued"]
+    yield {"pool": "jobs"}, job_queue.stats()["in_memory"].get("queued", 0)
+    yield {"pool": "modis-ee"}, modis_ee_pool._work_queue.qsize()
+    # the threadpool behind sync endpoints and run_in_threadpool
+    yield {"pool": "anyio"}, anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+
+def _threads_busy():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    yield {"pool": "anyio"}, limiter.borrowed_tokens
+    for flights in _METRIC_FLIGHTS:
+        yield {"pool": f"{flights.name}-flight"}, flights.stats()["in_flight"]
+
+
+def _db_pool():
+    pool = engine.pool
+    for state, method in (("checked_out", "checkedout"), ("idle", "checkedin"), ("overflow", "overflow")):
+        if hasattr(pool, method):
+            # QueuePool.overflow() is negative while fewer than pool_size connections exist
+            yield {"state": state}, max(getattr(pool, method)(), 0)
+
+
+REGISTRY.callback("geo_cache_lookups_total", "Cache lookups by result.", "counter", _cache_lookups)
+REGISTRY.callback(
+    "geo_cache_hit_ratio", "Share of cache lookups served from memory or disk.", "gauge",
+    lambda: (({"cache": c.name}, c.stats()["hit_ratio"]) for c in _METRIC_CACHES),
+)
+REGISTRY.callback("geo_cache_bytes", "Bytes held per cache tier.", "gauge", _cache_bytes)
+REGISTRY.callback(
+    "geo_singleflight_coalesced_total", "Calls that joined an identical call already in flight.", "counter",
+    lambda: (({"group": f.name}, f.stats()["coalesced"]) for f in _METRIC_FLIGHTS),
+)
+REGISTRY.callback(
+    "geo_ndvi_chunks_total", "NDVI chunks assembled, by source.", "counter",
+    lambda: (({"source": k.removeprefix("chunks_")}, v) for k, v in ndvi_chunk_store.stats().items()),
+)
+REGISTRY.callback("geo_threadpool_queue_depth", "Tasks waiting for a worker thread.", "gauge", _queue_depths)
+REGISTRY.callback("geo_threadpool_busy", "Worker threads (or flights) currently running.", "gauge", _threads_busy)
+REGISTRY.callback("geo_db_pool_connections", "Database connection pool usage.", "gauge", _db_pool)
+REGISTRY.callback(
+    "geo_admission_bytes", "Estimated render memory admitted, and the budget.", "gauge",
+    lambda: (({"state": k.removesuffix("_bytes")}, v) for k, v in render_admission.stats().items()
+             if k.endswith("_bytes")),
+)
+REGISTRY.callback(
+    "geo_admission_requests_total", "Admission decisions by outcome.", "counter",
+    lambda: (({"outcome": k}, v) for k, v in render_admission.stats().items()
+             if k in ("admitted", "waited", "rejected_client", "rejected_saturated", "timed_out")),
+)
+
+
+@app.get("/metrics", response_class=Response)
+async def metrics():
+    """Prometheus text exposition; runs on the event loop so the anyio limiter can be read."""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# --- NDVI pre-warming ---
+# the raw NDVI behind GET /users/{username}/coords/ndvi: last 31 days at 60 m. Every locally
+# coloured render of it (any palette, PNG or WebP) is then an encode without an upstream call.
+PREWARM_RESOLUTION = 60
+
+
+def _prewarm_parcels() -> List[Tuple[float, float, float, float]]:
+    """Every saved parcel, newest first, normalized; parcels the NDVI endpoints would reject are left out."""
+    with Session(engine) as session:
+        rows = session.exec(
+            select(Coordinate.x1, Coordinate.y1, Coordinate.x2, Coordinate.y2).order_by(Coordinate.id.desc())
+        ).all()
+    parcels = []
+    for row in rows:
+        try:
+            parcels.append(_validate_and_order_bbox(tuple(row)))
+        except HTTPException:
+            continue
+    return parcels
+
+
+def _prewarm_is_warm(bbox: Tuple[float, float, float, float]) -> bool:
+    return ndvi_raw_cache.contains(_ndvi_raw_key(bbox, _time_interval(None, None), PREWARM_RESOLUTION))
+
+
+def _prewarm_footprint(bbox: Tuple[float, float, float, float]) -> dict:
+    """Upstream pieces a cold raw NDVI fetch of bbox needs, with their estimated processing units."""
+    time_interval = _time_interval(None, None)
+    if _uses_chunk_store(bbox, [time_interval], PREWARM_RESOLUTION):
+        chunk_pu = estimate_processing_units(ndvi_chunk_store.chunk_px, ndvi_chunk_store.chunk_px)
+        return {
+            ("chunk", chunk): chunk_pu
+            for chunk in ndvi_chunk_store.missing_chunks(bbox, time_interval, PREWARM_RESOLUTION)
+        }
+    width, height = bbox_pixels(bbox, PREWARM_RESOLUTION)
+    return {("raw", _bbox_key(bbox)): estimate_processing_units(width, height)}
+
+
+def _prewarm_one(bbox: Tuple[float, float, float, float]) -> None:
+    time_interval = _time_interval(None, None)
+    cost = _render_cost(bbox, PREWARM_RESOLUTION)
+    _run_admitted(cost, "prewarm", lambda: _get_ndvi_array(bbox, time_interval, PREWARM_RESOLUTION))
+
+
+# Runs in every worker process that starts the app: with several workers enable it in one only.
+ndvi_prewarmer = Prewarmer(
+    list_parcels=_prewarm_parcels,
+    parcel_key=_bbox_key,
+    is_warm=_prewarm_is_warm,
+    footprint=_prewarm_footprint,
+    warm=_prewarm_one,
+    pu_budget=float(os.getenv("PREWARM_PU_BUDGET", "200")),
+    concurrency=int(os.getenv("PREWARM_CONCURRENCY", "2")),
+    interval_seconds=float(os.getenv("PREWARM_INTERVAL_SECONDS", "0")),
+)
+
+
+def _latest_coord_for_user(session: Session, username: str) -> Coordinate:
+    with stage("db_latest_coord"):
+        _, coords = _user_coords(session, username, order_by=Coordinate.id.desc(), limit=1)
+    if not coords:
+        raise HTTPException(status_code=404, detail="No coordinates found")
+    return coords[0]
+
+
 @app.get("/users/{username}/coords/ndvi", response_class=Response)
-def get_latest_coords_ndvi(
+async def get_latest_coords_ndvi(
     username: str,
+    request: Request,
     start: Optional[str] = Query(None, description="ISO date string yyyy-mm-dd"),
     end: Optional[str]   = Query(None, description="ISO date string yyyy-mm-dd"),
     resolution: int = Query(60, ge=1, le=120),
+    palette: str = Query("default", description="NDVI colour palette, see /ndvi/palettes"),
+    image_format: Optional[str] = Query(None, alias="format", description="png, webp or webp-lossy; default from Accept"),
     session: Session = Depends(get_session)
 ):
     """
@@ -337,17 +1315,12 @@ def get_latest_coords_ndvi(
     Query params:
       - start, end (ISO date strings). If omitted, defaults to last 31 days (end=today, start=end-31).
       - resolution (meters): default 60
+      - palette: default "default"
+      - format: png | webp | webp-lossy; if omitted, WebP when the Accept header prefers it
     """
-    user = session.exec(select(User).where(User.username == username)).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    coord = session.exec(
-        select(Coordinate).where(Coordinate.user_id == user.id).order_by(Coordinate.id.desc())
-    ).first()
-
-    if not coord:
-        raise HTTPException(status_code=404, detail="No coordinates found")
+    _validate_palette(palette)
+    image_format = _image_format(image_format, request.headers.get("accept"))
+    coord = await run_in_threadpool(_latest_coord_for_user, session, username)
 
     bbox = (coord.x1, coord.y1, coord.x2, coord.y2)
     try:
@@ -370,21 +1343,69 @@ def get_latest_coords_ndvi(
         logger.exception("Invalid date parameters")
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
 
+    key = _ndvi_png_key(bbox, time_interval, resolution, palette, image_format)
+    cached = _ndvi_not_modified(request, key, time_interval)
+    if cached is not None:
+        return cached
+
     try:
-        png_bytes = generate_ndvi_png_bytes(
-            bbox_wgs84=bbox,
-            time_interval=time_interval,
-            resolution=resolution,
+        png_bytes = await _render_ndvi_png_shared(
+            bbox, time_interval, resolution, palette, image_format, _client_id(request)
         )
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.exception("Error generating NDVI PNG")
         raise HTTPException(status_code=500, detail=f"NDVI generation failed: {str(e)}")
 
-    return Response(content=png_bytes, media_type="image/png")
+    return _ndvi_image_response(request, png_bytes, image_format, key, time_interval)
+
+
+def _parse_ndvi_payload(payload: dict) -> Tuple[Tuple[float, float, float, float], Tuple[str, str], int]:
+    """Common body of the bbox NDVI endpoints -> (bbox, time_interval, resolution)."""
+    bbox_raw = payload.get("bbox")
+    if not isinstance(bbox_raw, list) or len(bbox_raw) != 4:
+        raise HTTPException(status_code=400, detail="Payload must include bbox: [x1,y1,x2,y2]")
+    try:
+        bbox = tuple(map(float, bbox_raw))
+    except (TypeError, ValueError):
+        bbox = (math.nan,)
+    if not all(map(math.isfinite, bbox)):
+        raise HTTPException(status_code=400, detail="bbox values must be numbers")
+    bbox = _validate_and_order_bbox(bbox)
+
+    try:
+        resolution = int(payload.get("resolution", 60))
+    except (TypeError, ValueError):
+        resolution = 0
+    if not 1 <= resolution <= 120:
+        raise HTTPException(status_code=400, detail="resolution must be an integer between 1 and 120 meters")
+    try:
+        time_interval = _time_interval(payload.get("start"), payload.get("end"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+    if time_interval[0] > time_interval[1]:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return bbox, time_interval, resolution
+
+
+def _time_interval(start: Optional[str], end: Optional[str]) -> Tuple[str, str]:
+    """ISO start/end with the usual defaults: end=today, start=end-31 days."""
+    if end:
+        end_date = date.fromisoformat(end)
+    else:
+        end_date = date.today()
+    if start:
+        start_date = date.fromisoformat(start)
+    else:
+        start_date = end_date - timedelta(days=31)
+    return (start_date.isoformat(), end_date.isoformat())
 
 
 @app.post("/ndvi", response_class=Response)
-def ndvi_for_bbox(payload: dict = Body(...)):
+async def ndvi_for_bbox(request: Request, payload: dict = Body(...)):
     """
     Generate NDVI PNG for a provided bbox without saving anything.
     Body example:
@@ -392,37 +1413,287 @@ def ndvi_for_bbox(payload: dict = Body(...)):
         "bbox": [x1,y1,x2,y2],
         "start": "2024-07-01",    # optional
         "end": "2024-07-30",      # optional
-        "resolution": 60          # optional
+        "resolution": 60,         # optional
+        "palette": "default",     # optional, see /ndvi/palettes
+        "format": "webp"          # optional, png | webp | webp-lossy; default from Accept
       }
     """
     try:
-        bbox_raw = payload.get("bbox")
-        if not bbox_raw or len(bbox_raw) != 4:
-            raise HTTPException(status_code=400, detail="Payload must include bbox: [x1,y1,x2,y2]")
-        bbox = tuple(map(float, bbox_raw))
-        bbox = _validate_and_order_bbox(bbox)
+        bbox, time_interval, resolution = _parse_ndvi_payload(payload)
+        palette = _validate_palette(payload.get("palette", "default"))
+        image_format = _image_format(payload.get("format"), request.headers.get("accept"))
+        key = _ndvi_png_key(bbox, time_interval, resolution, palette, image_format)
+        cached = _ndvi_not_modified(request, key, time_interval)
+        if cached is not None:
+            return cached
+
+        png_bytes = await _render_ndvi_png_shared(
+            bbox, time_interval, resolution, palette, image_format, _client_id(request)
+        )
+        return _ndvi_image_response(request, png_bytes, image_format, key, time_interval)
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.exception("Error in /ndvi")
+        raise HTTPException(status_code=500, detail=f"NDVI generation failed: {str(e)}")
 
-        resolution = int(payload.get("resolution", 60))
-        end = payload.get("end")
-        start = payload.get("start")
 
-        if end:
-            end_date = date.fromisoformat(end)
+def _ndvi_stats(
+    bbox: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str],
+    resolution: int,
+) -> dict:
+    # same raw array (cache + single-flight) as the local PNG render
+    ndvi, mask = _get_ndvi_array(bbox, time_interval, resolution)
+    stats = compute_ndvi_stats(ndvi, mask)
+    stats.update(bbox=list(bbox), time_interval=list(time_interval), resolution=resolution)
+    return stats
+
+
+def _split_time_range(start_date: date, end_date: date, step: str) -> List[Tuple[str, str]]:
+    """Consecutive, non-overlapping [start, end] sub-intervals; "monthly" follows calendar months."""
+    intervals = []
+    current = start_date
+    while current <= end_date:
+        if step == "weekly":
+            nxt = current + timedelta(days=7)
         else:
-            end_date = date.today()
-        if start:
-            start_date = date.fromisoformat(start)
+            nxt = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        intervals.append((current.isoformat(), min(nxt - timedelta(days=1), end_date).isoformat()))
+        current = nxt
+    return intervals
+
+
+def _ndvi_timeseries(
+    bbox: Tuple[float, float, float, float],
+    intervals: List[Tuple[str, str]],
+    resolution: int,
+    include_png: bool,
+    palette: str,
+    progress: Optional[Callable[[float, str], None]] = None,
+) -> List[dict]:
+    report = progress or (lambda fraction, message: None)
+    arrays = {}
+    missing = []
+    for interval in intervals:
+        data = ndvi_raw_cache.get(_ndvi_raw_key(bbox, interval, resolution))
+        if data is not None:
+            arrays[interval] = unpack_ndvi(data)
         else:
-            start_date = end_date - timedelta(days=31)
-        time_interval = (start_date.isoformat(), end_date.isoformat())
+            missing.append(interval)
+
+    if missing:
+        report(0.05, f"fetching {len(missing)} of {len(intervals)} intervals")
+        if _uses_chunk_store(bbox, missing, resolution):
+            fetched = ndvi_chunk_store.read_many(bbox, missing, resolution)
+        else:
+            fetched = fetch_ndvi_series(bbox, missing, resolution, max_threads=NDVI_SERIES_WORKERS)
+        for interval, (ndvi, mask) in zip(missing, fetched):
+            ndvi_raw_cache.set(_ndvi_raw_key(bbox, interval, resolution), pack_ndvi(ndvi, mask))
+            arrays[interval] = (ndvi, mask)
+
+    series = []
+    for i, interval in enumerate(intervals):
+        report(0.7 + 0.3 * i / len(intervals), f"summarizing {interval[0]}..{interval[1]}")
+        ndvi, mask = arrays[interval]
+        item = {"start": interval[0], "end": interval[1], "stats": compute_ndvi_stats(ndvi, mask)}
+        if include_png:
+            png_key = _ndvi_png_key(bbox, interval, resolution, palette)
+            png_bytes = ndvi_cache.get(png_key)
+            if png_bytes is None:
+                png_bytes = render_ndvi_png(ndvi, mask, palette)
+                ndvi_cache.set(png_key, png_bytes)
+            item["png_base64"] = base64.b64encode(png_bytes).decode("ascii")
+        series.append(item)
+    return series
+
+
+def _parse_timeseries_payload(payload: dict):
+    """Body of /ndvi/timeseries -> (bbox, intervals, resolution, step, include_png, palette)."""
+    bbox, time_interval, resolution = _parse_ndvi_payload(payload)
+    step = payload.get("step", "monthly")
+    if step not in ("weekly", "monthly"):
+        raise HTTPException(status_code=400, detail="step must be 'weekly' or 'monthly'")
+    include_png = bool(payload.get("include_png", False))
+    palette = _validate_palette(payload.get("palette", "default"))
+
+    start_date, end_date = (date.fromisoformat(d) for d in time_interval)
+    intervals = _split_time_range(start_date, end_date, step)
+    if len(intervals) > MAX_SERIES_STEPS:
+        raise HTTPException(
+            status_code=400, detail=f"Too many steps ({len(intervals)}). Maximum is {MAX_SERIES_STEPS}."
+        )
+    return bbox, intervals, resolution, step, include_png, palette
 
-        png_bytes = generate_ndvi_png_bytes(bbox_wgs84=bbox, time_interval=time_interval, resolution=resolution)
-        return Response(content=png_bytes, media_type="image/png")
+
+@app.post("/ndvi/timeseries")
+async def ndvi_timeseries_for_bbox(request: Request, payload: dict = Body(...)):
+    """
+    NDVI summary per week or month over a date range, for season curves.
+    Sub-intervals missing from the cache are fetched concurrently in one batch.
+    Body example:
+      {
+        "bbox": [x1,y1,x2,y2],
+        "start": "2024-03-01",
+        "end": "2024-10-31",
+        "step": "monthly",        # optional, "weekly" or "monthly"
+        "resolution": 60,         # optional
+        "include_png": false,     # optional, adds base64 PNG per step
+        "palette": "default"      # optional, used with include_png
+      }
+    """
+    try:
+        bbox, intervals, resolution, step, include_png, palette = _parse_timeseries_payload(payload)
+        key = make_cache_key("ndvi-series", _bbox_key(bbox), intervals, resolution, include_png, palette)
+        series = await _admitted(
+            ndvi_flights,
+            key,
+            lambda: _ndvi_timeseries(bbox, intervals, resolution, include_png, palette),
+            _render_cost(bbox, resolution, steps=len(intervals)),
+            _client_id(request),
+        )
+        return {"bbox": list(bbox), "resolution": resolution, "step": step, "series": series}
     except HTTPException:
         raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        logger.exception("Error in /ndvi")
-        raise HTTPException(status_code=500, detail=f"NDVI generation failed: {str(e)}")
+        logger.exception("Error in /ndvi/timeseries")
+        raise HTTPException(status_code=500, detail=f"NDVI time series failed: {str(e)}")
+
+
+def _raw_ndvi_tile_key(z: int, x: int, y: int, time_interval: Tuple[str, str]) -> str:
+    return make_cache_key("ndvi-tile", z, x, y, time_interval, EVALSCRIPT_NDVI_RAW_HASH)
+
+
+def _raw_ndvi_tile(z: int, x: int, y: int, time_interval: Tuple[str, str]) -> Optional[bytes]:
+    """Packed raw NDVI for a tile, or None when the tile holds no data (cached as such)."""
+    key = _raw_ndvi_tile_key(z, x, y, time_interval)
+    data = ndvi_tile_cache.get(key)
+    if data is None:
+        ndvi, mask = fetch_ndvi_tile(tiles.tile_bounds_3857(z, x, y), time_interval, tiles.TILE_SIZE)
+        data = pack_ndvi(ndvi, mask) if mask.any() else b""
+        ndvi_tile_cache.set(key, data)
+    return data or None
+
+
+def _render_ndvi_tile(
+    z: int,
+    x: int,
+    y: int,
+    time_interval: Tuple[str, str],
+    palette: str,
+    clip_bbox: Optional[Tuple[float, float, float, float]],
+    image_format: str = "png",
+) -> bytes:
+    data = _raw_ndvi_tile(z, x, y, time_interval)
+    if data is None:
+        return tiles.transparent_tile(image_format)
+    ndvi, mask = unpack_ndvi(data)
+    if clip_bbox is not None:
+        mask &= tiles.clip_mask(z, x, y, clip_bbox)
+    return render_ndvi_image(ndvi, mask, palette, image_format)
+
+
+def _tile_format(ext: str, requested: Optional[str]) -> str:
+    """Encoding of a tile: the URL extension names the container, `format` may only pick lossy WebP."""
+    if ext not in ("png", "webp"):
+        raise HTTPException(status_code=404, detail="Tiles are served as .png or .webp")
+    image_format = _image_format(requested, None) if requested else ext
+    if image_format.split("-")[0] != ext:
+        raise HTTPException(status_code=400, detail=f"format '{image_format}' does not match the .{ext} tile URL")
+    return image_format
+
+
+@app.get("/ndvi/tiles/{z}/{x}/{y}.{ext}", response_class=Response)
+async def ndvi_tile(
+    z: int,
+    x: int,
+    y: int,
+    ext: str,
+    request: Request,
+    start: Optional[str] = Query(None, description="ISO date string yyyy-mm-dd"),
+    end: Optional[str] = Query(None, description="ISO date string yyyy-mm-dd"),
+    palette: str = Query("default", description="NDVI colour palette, see /ndvi/palettes"),
+    bbox: Optional[str] = Query(None, description="Optional clip bbox 'x1,y1,x2,y2' (lon/lat)"),
+    image_format: Optional[str] = Query(None, alias="format", description="webp-lossy on a .webp URL; defaults to the extension"),
+):
+    """
+    256x256 NDVI XYZ tile (web mercator) for Leaflet tile layers, as /{z}/{x}/{y}.png or .webp.
+    Tiles outside Sentinel-2 coverage, the clip bbox or the supported zoom range
+    are returned as a transparent tile without any upstream request.
+    """
+    if not tiles.is_valid_tile(z, x, y):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates")
+    _validate_palette(palette)
+    image_format = _tile_format(ext, image_format)
+    try:
+        time_interval = _time_interval(start, end)
+        clip_bbox = None
+        if bbox:
+            clip_bbox = _validate_and_order_bbox(tuple(map(float, bbox.split(","))))
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid date or bbox parameters")
+
+    if z < TILE_MIN_ZOOM or z > TILE_MAX_ZOOM or tiles.outside_coverage(z, x, y, clip_bbox):
+        return _image_response(tiles.transparent_tile(image_format), image_format)
+
+    key = make_cache_key(
+        "ndvi-tile-png", z, x, y, time_interval, palette, clip_bbox and _bbox_key(clip_bbox), image_format
+    )
+    cached = _ndvi_not_modified(request, key, time_interval)
+    if cached is not None:
+        return cached
+
+    def render() -> bytes:
+        return _render_ndvi_tile(z, x, y, time_interval, palette, clip_bbox, image_format)
+
+    try:
+        if ndvi_tile_cache.contains(_raw_ndvi_tile_key(z, x, y, time_interval)):
+            png_bytes = await ndvi_flights.do_async(key, render, timeout=UPSTREAM_TIMEOUT)
+        else:
+            png_bytes = await _admitted(
+                ndvi_flights, key, render, tiles.TILE_SIZE * tiles.TILE_SIZE * RENDER_BYTES_PER_PIXEL,
+                _client_id(request),
+            )
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.exception("Error rendering NDVI tile")
+        raise HTTPException(status_code=500, detail=f"NDVI tile failed: {str(e)}")
+    return _ndvi_image_response(request, png_bytes, image_format, key, time_interval)
+
+
+@app.post("/ndvi/stats")
+async def ndvi_stats_for_bbox(request: Request, payload: dict = Body(...)):
+    """
+    NDVI zonal statistics for a bbox: mean, median, p10/p90, std, valid-pixel
+    fraction and a histogram over the palette classes.
+    Body: same as POST /ndvi (bbox, start, end, resolution).
+    """
+    try:
+        bbox, time_interval, resolution = _parse_ndvi_payload(payload)
+        key = make_cache_key("ndvi-stats", _bbox_key(bbox), time_interval, resolution)
+
+        def compute() -> dict:
+            return _ndvi_stats(bbox, time_interval, resolution)
+
+        if ndvi_raw_cache.contains(_ndvi_raw_key(bbox, time_interval, resolution)):
+            return await ndvi_flights.do_async(key, compute, timeout=UPSTREAM_TIMEOUT)
+        return await _admitted(ndvi_flights, key, compute, _render_cost(bbox, resolution), _client_id(request))
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.exception("Error in /ndvi/stats")
+        raise HTTPException(status_code=500, detail=f"NDVI statistics failed: {str(e)}")
     
 
 
@@ -430,8 +1701,408 @@ def ndvi_for_bbox(payload: dict = Body(...)):
 
 
 
+# --- Background NDVI jobs ---
+
+def _job_fn(kind: str, payload: dict):
+    """Validate a job payload up front (errors are 400s at submit time) and return its runner."""
+    if kind == "ndvi":
+        bbox, time_interval, resolution = _parse_ndvi_payload(payload)
+        palette = _validate_palette(payload.get("palette", "default"))
+        image_format = _image_format(payload.get("format", "png"), None)
+        cost = _render_cost(bbox, resolution, rgba=not _renders_locally(palette))
+        _check_render_cost(cost)
+
+        def run(report):
+            report(0.1, "rendering NDVI")
+            key = _ndvi_png_key(bbox, time_interval, resolution, palette, image_format)
+            png_bytes = _run_admitted(cost, "jobs", lambda: ndvi_flights.do(
+                key, lambda: _render_ndvi_png(bbox, time_interval, resolution, palette, image_format)
+            ))
+            return png_bytes, IMAGE_FORMATS[image_format]
+
+    elif kind == "stats":
+        bbox, time_interval, resolution = _parse_ndvi_payload(payload)
+        cost = _render_cost(bbox, resolution)
+        _check_render_cost(cost)
+
+        def run(report):
+            report(0.1, "computing NDVI statistics")
+            key = make_cache_key("ndvi-stats", _bbox_key(bbox), time_interval, resolution)
+            stats = _run_admitted(cost, "jobs", lambda: ndvi_flights.do(
+                key, lambda: _ndvi_stats(bbox, time_interval, resolution)
+            ))
+            return json.dumps(stats).encode("utf-8"), "application/json"
+
+    elif kind == "timeseries":
+        bbox, intervals, resolution, step, include_png, palette = _parse_timeseries_payload(payload)
+        cost = _render_cost(bbox, resolution, steps=len(intervals))
+        _check_render_cost(cost)
+
+        def run(report):
+            series = _run_admitted(cost, "jobs", lambda: _ndvi_timeseries(
+                bbox, intervals, resolution, include_png, palette, progress=report
+            ))
+            body = {"bbox": list(bbox), "resolution": resolution, "step": step, "series": series}
+            return json.dumps(body).encode("utf-8"), "application/json"
+
+    else:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(JOB_KINDS)}")
+    return run
+
+
+@app.post("/jobs", status_code=202)
+def submit_job(payload: dict = Body(...)):
+    """
+    Queue an NDVI job and return at once with its id; follow it on /jobs/{id}/events.
+    Body example:
+      {"kind": "timeseries", "payload": {...same body as POST /ndvi/timeseries...}}
+    kind: "ndvi" (PNG), "stats" or "timeseries" (JSON).
+    """
+    kind = payload.get("kind")
+    params = payload.get("payload") or {}
+    if not isinstance(params, dict):
+        raise HTTPException(status_code=400, detail="payload must be an object")
+    run = _job_fn(kind, params)
+    try:
+        job = job_queue.submit(kind, params, run)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Job queue is full ({e}), try again later")
+    return {**job, "events_url": f"/jobs/{job['id']}/events", "result_url": f"/jobs/{job['id']}/result"}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: a `progress` event per change, then one `done`, `failed` or `cancelled` event."""
+    if job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream():
+        async for snapshot in job_queue.watch(job_id):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+                continue
+            event = snapshot["status"] if snapshot["status"] in JOB_TERMINAL else "progress"
+            yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    result = job_queue.result(job_id)
+    if result is None:
+        raise HTTPException(status_code=410, detail="Job result expired")
+    data, media_type = result
+    return Response(content=data, media_type=media_type)
+
+
+@app.delete("/jobs/{job_id}", status_code=status.HTTP_204_NO_CONTENT)
+def cancel_job(job_id: str):
+    """Cancel a job that is still queued; running jobs finish."""
+    if job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job already started")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+def _modis_stats_key(bbox: Tuple[float, float, float, float], year: int, lc_type: int) -> str:
+    return make_cache_key("modis-stats", MODIS_BACKEND, _bbox_key(bbox), year, lc_type)
+
+
+def _modis_land_cover(bbox: Tuple[float, float, float, float], year: int, lc_type: int) -> Optional[dict]:
+    key = _modis_stats_key(bbox, year, lc_type)
+    stats = modis_stats_cache.get_json(key)
+    if stats is None:
+        if MODIS_BACKEND == "local":
+            stats = LocalMODISAnalyzer(bbox).analyze_land_cover(year=year, lc_type=lc_type)
+        else:
+            stats = MODISAnalyzer(bbox).analyze_land_cover(year=year, lc_type=lc_type)
+        if stats:
+            modis_stats_cache.set_json(key, stats)
+    return stats
+
+
+def _modis_land_cover_many(
+    bboxes: List[Tuple[float, float, float, float]], year: int, lc_type: int
+) -> List[Optional[dict]]:
+    """Cached stats where available; all the rest in one batched reduction."""
+    keys = [_modis_stats_key(bbox, year, lc_type) for bbox in bboxes]
+    results = [modis_stats_cache.get_json(key) for key in keys]
+    missing = [i for i, stats in enumerate(results) if stats is None]
+    if not missing:
+        return results
+
+    batch = modis_land_cover_batch if MODIS_BACKEND != "local" else local_land_cover_batch
+    computed = batch([bboxes[i] for i in missing], year=year, lc_type=lc_type)
+    for i, stats in zip(missing, computed):
+        results[i] = stats
+        if stats:
+            modis_stats_cache.set_json(keys[i], stats)
+    return results
+
+
+def _modis_tile_url(year: int, lc_type: int) -> str:
+    key = make_cache_key("modis-tile-url", year, lc_type)
+    tile_url = modis_tile_cache.get_json(key)
+    if tile_url is None:
+        tile_url = modis_global_tile_url(year=year, lc_type=lc_type)
+        modis_tile_cache.set_json(key, tile_url)
+    return tile_url
+
+
+def _modis_analysis(
+    bbox: Tuple[float, float, float, float], year: int = MODIS_YEAR, lc_type: int = MODIS_LC_TYPE
+) -> dict:
+    """
+    Land-cover stats plus the map layer. On a cold cache the histogram (getInfo) and
+    the map id (getMapId) are requested concurrently, so a miss costs one round trip.
+    The local backend has no map layer, so `tile_url` is None there.
+    """
+    if MODIS_BACKEND == "local":
+        stats = _modis_land_cover(bbox, year, lc_type)
+        if not stats:
+            raise HTTPException(status_code=404, detail="No local MODIS land-cover data for the specified region")
+        return {"bbox": list(bbox), "analysis": stats, "tile_url": None, "legend": modis_legend()}
+
+    if not modis_ensure_initialized():
+        raise HTTPException(status_code=500, detail="MODIS analysis failed - Earth Engine is not available")
+
+    stats_future = modis_ee_pool.submit(_modis_land_cover, bbox, year, lc_type)
+    try:
+        tile_url = modis_tile_flights.do(
+            make_cache_key("modis-tile-url", year, lc_type),
+            lambda: _modis_tile_url(year, lc_type),
+            timeout=UPSTREAM_TIMEOUT,
+        )
+        stats = stats_future.result()
+    except TimeoutError:
+        raise
+    except Exception:
+        logger.exception("MODIS analysis failed for %s", bbox)
+        stats = None
+
+    if not stats:
+        raise HTTPException(
+            status_code=500, 
+            detail="MODIS analysis failed - could not retrieve data for the specified region"
+        )
+
+    return {
+        "bbox": list(bbox),
+        "analysis": stats,
+        "tile_url": tile_url,
+        "legend": modis_legend()
+    }
+
+
+def _modis_batch(
+    bboxes: List[Tuple[float, float, float, float]], year: int = MODIS_YEAR, lc_type: int = MODIS_LC_TYPE
+) -> dict:
+    """Per-parcel land-cover stats for many bboxes; parcels without data get `analysis: null`."""
+    if MODIS_BACKEND == "local":
+        stats_list, tile_url = _modis_land_cover_many(bboxes, year, lc_type), None
+    else:
+        if not modis_ensure_initialized():
+            raise HTTPException(status_code=500, detail="MODIS analysis failed - Earth Engine is not available")
+        stats_future = modis_ee_pool.submit(_modis_land_cover_many, bboxes, year, lc_type)
+        tile_url = modis_tile_flights.do(
+            make_cache_key("modis-tile-url", year, lc_type),
+            lambda: _modis_tile_url(year, lc_type),
+            timeout=UPSTREAM_TIMEOUT,
+        )
+        stats_list = stats_future.result()
+
+    return {
+        "parcels": [{"bbox": list(bbox), "analysis": stats} for bbox, stats in zip(bboxes, stats_list)],
+        "tile_url": tile_url,
+        "legend": modis_legend()
+    }
+
+
+def _modis_change(
+    bbox: Tuple[float, float, float, float], years: List[int], from_year: int, to_year: int, lc_type: int
+) -> dict:
+    key = make_cache_key("modis-change", MODIS_BACKEND, _bbox_key(bbox), years, from_year, to_year, lc_type)
+    result = modis_stats_cache.get_json(key)
+    if result is not None:
+        return result
+
+    if MODIS_BACKEND == "local":
+        try:
+            change = local_land_cover_change(bbox, years, from_year, to_year, lc_type=lc_type)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    else:
+        if not modis_ensure_initialized():
+            raise HTTPException(status_code=500, detail="MODIS analysis failed - Earth Engine is not available")
+        change = modis_land_cover_change(bbox, years, from_year, to_year, lc_type=lc_type)
+    if change is None:
+        raise HTTPException(status_code=404, detail="No MODIS land-cover data for the specified region")
+
+    result = {"bbox": list(bbox), "lc_type": lc_type, **change, "legend": modis_legend(lc_type)}
+    modis_stats_cache.set_json(key, result)
+    return result
+
+
+def _modis_cache_headers(key: str, tile_url: Optional[str] = None) -> dict:
+    """
+    Validators for a MODIS JSON answer named by its request key. Past-year land cover is
+    fixed, but Earth Engine tile URLs expire, so responses carrying one are revalidated on every use.
+    """
+    return {
+        "ETag": etag_for(make_cache_key("modis-response", MODIS_BACKEND, key, tile_url)),
+        "Cache-Control": "no-cache" if tile_url else f"public, max-age={int(modis_stats_cache.ttl_seconds)}",
+    }
+
+
+@app.get("/modis/change")
+async def modis_land_cover_change_endpoint(
+    request: Request,
+    x1: float = Query(..., description="Longitude minimum"),
+    y1: float = Query(..., description="Latitude minimum"),
+    x2: float = Query(..., description="Longitude maximum"),
+    y2: float = Query(..., description="Latitude maximum"),
+    start_year: int = Query(..., description="First year of the range"),
+    end_year: int = Query(MODIS_YEAR, description="Last year of the range"),
+    from_year: Optional[int] = Query(None, description="Transition source year, defaults to start_year"),
+    to_year: Optional[int] = Query(None, description="Transition target year, defaults to end_year"),
+    lc_type: int = Query(MODIS_LC_TYPE, description="MCD12Q1 classification scheme (LC_Type1..5)"),
+):
+    """
+    Class shares per year over [start_year, end_year] and the from_year -> to_year
+    class transition matrix (rows = from class, columns = to class, in pixels).
+    """
+    bbox = _validate_and_order_bbox((x1, y1, x2, y2))
+    if lc_type not in MODIS_LC_TYPES:
+        raise HTTPException(status_code=400, detail=f"lc_type must be one of {list(MODIS_LC_TYPES)}")
+    if not MODIS_FIRST_YEAR <= start_year <= end_year <= MODIS_YEAR:
+        raise HTTPException(
+            status_code=400, detail=f"Years must satisfy {MODIS_FIRST_YEAR} <= start_year <= end_year <= {MODIS_YEAR}"
+        )
+    from_year = start_year if from_year is None else from_year
+    to_year = end_year if to_year is None else to_year
+    if not (start_year <= from_year <= end_year and start_year <= to_year <= end_year):
+        raise HTTPException(status_code=400, detail="from_year and to_year must lie within the year range")
+    years = list(range(start_year, end_year + 1))
+    key = make_cache_key("modis-change", _bbox_key(bbox), years, from_year, to_year, lc_type)
+    cache_headers = _modis_cache_headers(key)
+    if etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+        return not_modified(cache_headers)
+
+    try:
+        result = await modis_flights.do_async(
+            key,
+            lambda: _modis_change(bbox, years, from_year, to_year, lc_type),
+            timeout=UPSTREAM_TIMEOUT,
+        )
+        return JSONResponse(result, headers=cache_headers)
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.exception("Error in /modis/change")
+        raise HTTPException(status_code=500, detail=f"MODIS change analysis failed: {str(e)}")
+
+
+def _coords_for_user(session: Session, username: str) -> List[Coordinate]:
+    return _user_coords(session, username, order_by=Coordinate.id)[1]
+
+
+@app.post("/modis/batch")
+async def modis_batch_analysis(payload: dict = Body(...), session: Session = Depends(get_session)):
+    """
+    Land-cover stats for many parcels in one upstream call (one reduceRegions on Earth Engine).
+    Body example:
+      {"bboxes": [[x1,y1,x2,y2], ...]}   or   {"username": "ana"}   # all saved parcels
+    With a username, saved parcels the analysis cannot take (e.g. too large) are reported
+    in place with `analysis: null` and an `error`; explicit bboxes must all be valid.
+    """
+    coord_ids: List[Optional[int]] = []
+    if payload.get("username"):
+        coords = await run_in_threadpool(_coords_for_user, session, payload["username"])
+        raw_bboxes = [(c.x1, c.y1, c.x2, c.y2) for c in coords]
+        coord_ids = [c.id for c in coords]
+    else:
+        raw_bboxes = payload.get("bboxes")
+        if not isinstance(raw_bboxes, list):
+            raise HTTPException(status_code=400, detail="Provide 'bboxes' as a list of [x1,y1,x2,y2] or a 'username'")
+
+    if len(raw_bboxes) > MODIS_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MODIS_MAX_BATCH} parcels per batch")
+    bboxes = []
+    rejected: Dict[int, str] = {}
+    for i, raw in enumerate(raw_bboxes):
+        if not isinstance(raw, (list, tuple)) or len(raw) != 4:
+            raise HTTPException(status_code=400, detail="Each bbox must be [x1,y1,x2,y2]")
+        try:
+            bbox = tuple(map(float, raw))
+        except (TypeError, ValueError):
+            bbox = (math.nan,)
+        if not all(map(math.isfinite, bbox)):
+            raise HTTPException(status_code=400, detail="bbox values must be numbers")
+        try:
+            bboxes.append(_validate_and_order_bbox(bbox))
+        except HTTPException as e:
+            if not coord_ids:
+                raise
+            rejected[i] = e.detail
+    if not bboxes:
+        result = {"parcels": [], "tile_url": None, "legend": modis_legend()}
+        return _modis_batch_with_coords(result, coord_ids, raw_bboxes, rejected)
+
+    try:
+        result = await modis_flights.do_async(
+            make_cache_key("modis-batch", [_bbox_key(b) for b in bboxes]),
+            lambda: _modis_batch(bboxes),
+            timeout=UPSTREAM_TIMEOUT,
+        )
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.exception("Error in /modis/batch")
+        raise HTTPException(status_code=500, detail=f"MODIS batch analysis failed: {str(e)}")
+
+    return _modis_batch_with_coords(result, coord_ids, raw_bboxes, rejected)
+
+
+def _modis_batch_with_coords(
+    result: dict, coord_ids: List[Optional[int]], raw_bboxes: list, rejected: Dict[int, str]
+) -> dict:
+    """Saved-parcel batches: tag each entry with its coord id and put the rejected parcels back in order."""
+    if not coord_ids:
+        return result
+    analysed = iter(result["parcels"])
+    parcels = []
+    for i, cid in enumerate(coord_ids):
+        if i in rejected:
+            parcels.append({"coord_id": cid, "bbox": list(raw_bboxes[i]), "analysis": None, "error": rejected[i]})
+        else:
+            parcels.append({"coord_id": cid, **next(analysed)})
+    return {**result, "parcels": parcels}
+
+
 @app.get("/modis")
-def get_modis_analysis(
+async def get_modis_analysis(
+    request: Request,
     x1: float = Query(..., description="Longitude minimum"),
     y1: float = Query(..., description="Latitude minimum"),
     x2: float = Query(..., description="Longitude maximum"),
@@ -450,21 +2121,20 @@ def get_modis_analysis(
     lat_min, lat_max = sorted([y1, y2])
     
     bbox = (lon_min, lat_min, lon_max, lat_max)
+    key = make_cache_key("modis", _bbox_key(bbox), MODIS_YEAR, MODIS_LC_TYPE)
+
+    # the tile URL is part of the validator, so a client holding an expired map token gets a
+    # fresh body; with no live URL cached here there is nothing to validate against
+    tile_url = None
+    if MODIS_BACKEND != "local":
+        tile_url = modis_tile_cache.get_json(make_cache_key("modis-tile-url", MODIS_YEAR, MODIS_LC_TYPE))
+    if MODIS_BACKEND == "local" or tile_url is not None:
+        cache_headers = _modis_cache_headers(key, tile_url)
+        if etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+            return not_modified(cache_headers)
 
-    analyzer, stats = modis_main(bbox=bbox)
-    if analyzer is None or stats is None:
-        raise HTTPException(
-            status_code=500, 
-            detail="MODIS analysis failed - could not retrieve data for the specified region"
-        )
-    
-    tile_url = analyzer.get_tile_url(year=2024, lc_type=2)
-    legend = analyzer.get_legend()
-    
-
-    return {
-        "bbox": [lon_min, lat_min, lon_max, lat_max],
-        "analysis": stats,
-        "tile_url": tile_url,
-        "legend": legend
-    }
+    try:
+        result = await modis_flights.do_async(key, lambda: _modis_analysis(bbox), timeout=UPSTREAM_TIMEOUT)
+        return JSONResponse(result, headers=_modis_cache_headers(key, result["tile_url"]))
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
@@ -1,6 +1,249 @@
 import os
 from dotenv import load_dotenv
 import ee
+import numpy as np
+
+from metrics import stage
+
+
+LC_COLORS = {
+    0: "#0B43D2",   # Water
+    1: '#086a10',   # Evergreen Needleleaf Forests
+    2: '#54a708',   # Evergreen Broadleaf Forests
+    3: '#78d203',   # Deciduous Needleleaf Forests
+    4: '#009900',   # Deciduous Broadleaf Forests
+    5: '#c6b044',   # Mixed Forests
+    6: '#dcd159',   # Closed Shrublands
+    7: '#dade48',   # Open Shrublands
+    8: '#fbff13',   # Woody Savannas
+    9: '#b6ff05',   # Savannas
+    10: '#27ff87',  # Grasslands
+    11: '#c24f44',  # Permanent Wetlands
+    12: "#f8cd0a",  # Croplands
+    13: "#a5a6a6",  # Urban and Built-up Lands
+    14: '#69fff8',  # Cropland/Natural Vegetation Mosaics
+    15: "#98d6ff",  # Permanent Snow and Ice
+    16: "#000000"   # Barren
+}
+LC_NAMES = {
+    0: 'Water bodies',
+    1: 'Evergreen Needleleaf Forests',
+    2: 'Evergreen Broadleaf Forests',
+    3: 'Deciduous Needleleaf Forests',
+    4: 'Deciduous Broadleaf Forests',
+    5: 'Mixed Forests',
+    6: 'Closed Shrublands',
+    7: 'Open Shrublands',
+    8: 'Woody Savannas',
+    9: 'Savannas',
+    10: 'Grasslands',
+    11: 'Permanent Wetlands',
+    12: 'Croplands',
+    13: 'Urban and Built-up Lands',
+    14: 'Cropland/Natural Vegetation Mosaics',
+    15: 'Permanent Snow and Ice',
+    16: 'Unclassified'
+}
+# MCD12Q1 class names per classification scheme (LC_Type1..5); LC_NAMES / LC_COLORS are the
+# LC_Type2 table the map tiles and legend use. 255 (unclassified) is in none of them.
+LC_SCHEME_NAMES = {
+    1: {
+        1: 'Evergreen Needleleaf Forests',
+        2: 'Evergreen Broadleaf Forests',
+        3: 'Deciduous Needleleaf Forests',
+        4: 'Deciduous Broadleaf Forests',
+        5: 'Mixed Forests',
+        6: 'Closed Shrublands',
+        7: 'Open Shrublands',
+        8: 'Woody Savannas',
+        9: 'Savannas',
+        10: 'Grasslands',
+        11: 'Permanent Wetlands',
+        12: 'Croplands',
+        13: 'Urban and Built-up Lands',
+        14: 'Cropland/Natural Vegetation Mosaics',
+        15: 'Permanent Snow and Ice',
+        16: 'Barren',
+        17: 'Water Bodies',
+    },
+    2: LC_NAMES,
+    3: {
+        0: 'Water Bodies',
+        1: 'Grasslands',
+        2: 'Shrublands',
+        3: 'Broadleaf Croplands',
+        4: 'Savannas',
+        5: 'Evergreen Broadleaf Forests',
+        6: 'Deciduous Broadleaf Forests',
+        7: 'Evergreen Needleleaf Forests',
+        8: 'Deciduous Needleleaf Forests',
+        9: 'Non-Vegetated Lands',
+        10: 'Urban and Built-up Lands',
+    },
+    4: {
+        0: 'Water Bodies',
+        1: 'Evergreen Needleleaf Vegetation',
+        2: 'Evergreen Broadleaf Vegetation',
+        3: 'Deciduous Needleleaf Vegetation',
+        4: 'Deciduous Broadleaf Vegetation',
+        5: 'Annual Broadleaf Vegetation',
+        6: 'Annual Grass Vegetation',
+        7: 'Non-Vegetated Lands',
+        8: 'Urban and Built-up Lands',
+    },
+    5: {
+        0: 'Water Bodies',
+        1: 'Evergreen Needleleaf Trees',
+        2: 'Evergreen Broadleaf Trees',
+        3: 'Deciduous Needleleaf Trees',
+        4: 'Deciduous Broadleaf Trees',
+        5: 'Shrub',
+        6: 'Grass',
+        7: 'Cereal Croplands',
+        8: 'Broadleaf Croplands',
+        9: 'Urban and Built-up Lands',
+        10: 'Permanent Snow and Ice',
+        11: 'Barren',
+    },
+}
+
+
+def class_names(lc_type=2):
+    """{class id: name} of an MCD12Q1 classification scheme."""
+    return LC_SCHEME_NAMES[lc_type]
+
+
+def n_classes(lc_type=2):
+    """Class ids of the scheme are below this; transitions are encoded as from * n_classes + to."""
+    return max(LC_SCHEME_NAMES[lc_type]) + 1
+
+
+def get_modis_image(year=2024, lc_type=2):
+    """Global MCD12Q1 land-cover band for one year (not clipped to any region)."""
+    collection = ee.ImageCollection('MODIS/061/MCD12Q1')
+    start_date = f'{year}-01-01'
+    end_date = f'{year}-12-31'
+    return collection.filterDate(start_date, end_date).first().select(f'LC_Type{lc_type}')
+
+
+def get_global_tile_url(year=2024, lc_type=2):
+    """
+    XYZ tile URL template for the land-cover layer. Does not depend on any bbox,
+    so it can be cached per (year, lc_type).
+    """
+    vis_params = {
+        'min': 0,
+        'max': 16,
+        'palette': list(LC_COLORS.values())
+    }
+    with stage("ee_getmapid"):
+        map_id_dict = get_modis_image(year, lc_type).getMapId(vis_params)
+    return map_id_dict["tile_fetcher"].url_format
+
+
+def get_legend(lc_type=2):
+    """Returnează un dict simplu pentru legendă (clasă → culoare); colours exist only for LC_Type2"""
+    if lc_type != 2:
+        return {}
+    return {LC_NAMES[class_id]: color for class_id, color in LC_COLORS.items() if class_id in LC_NAMES}
+
+
+def histogram_to_stats(lc_hist, pixel_area_km2=0.25, lc_type=2):
+    """{class id: pixel count} -> {class name: {pixels, percentage, area_km2}}"""
+    names = class_names(lc_type)
+    stats = {}
+    total_pixels = sum(lc_hist.values())
+    if not total_pixels:
+        return None
+
+    for lc_class, pixel_count in lc_hist.items():
+        lc_class = int(lc_class)
+        if lc_class in names:
+            percentage = (pixel_count / total_pixels) * 100
+            stats[names[lc_class]] = {
+                'pixels': pixel_count,
+                'percentage': percentage,
+                'area_km2': (pixel_count * pixel_area_km2)
+            }
+    return stats
+
+
+def analyze_land_cover_batch(bboxes, year=2024, lc_type=2):
+    """
+    Land-cover stats for many bboxes with a single reduceRegions call (one getInfo round
+    trip). Returns one stats dict per bbox, in order; None where there is no data.
+    """
+    features = [
+        ee.Feature(ee.Geometry.Rectangle(list(bbox)), {'idx': i})
+        for i, bbox in enumerate(bboxes)
+    ]
+    reduced = get_modis_image(year, lc_type).reduceRegions(
+        collection=ee.FeatureCollection(features),
+        reducer=ee.Reducer.frequencyHistogram(),
+        scale=500,
+    )
+    results = [None] * len(bboxes)
+    with stage("ee_getinfo"):
+        features = reduced.getInfo()['features']
+    for feature in features:
+        props = feature['properties']
+        lc_hist = props.get('histogram')
+        if lc_hist:
+            results[int(props['idx'])] = histogram_to_stats(lc_hist, lc_type=lc_type)
+    return results
+
+
+def transition_summary(matrix, from_year, to_year, lc_type=2):
+    """
+    n_classes x n_classes pixel counts (rows = from, cols = to, indexed by class id) ->
+    JSON-friendly summary over the scheme's classes, in id order.
+    """
+    names = class_names(lc_type)
+    ids = sorted(names)
+    matrix = np.asarray(matrix, dtype=np.int64)[np.ix_(ids, ids)]
+    total = int(matrix.sum())
+    unchanged = int(np.trace(matrix))
+    return {
+        'from_year': from_year,
+        'to_year': to_year,
+        'classes': [names[c] for c in ids],
+        'matrix': matrix.tolist(),
+        'pixels': total,
+        'changed_pixels': total - unchanged,
+        'changed_fraction': ((total - unchanged) / total) if total else 0.0,
+    }
+
+
+def analyze_land_cover_change(bbox, years, from_year, to_year, lc_type=2):
+    """
+    Per-year class stats for `years` plus the from_year -> to_year transition matrix, from a
+    single reduceRegion over one stacked image (one band per year and a transition band
+    holding from * n_classes + to).
+    """
+    n = n_classes(lc_type)
+    geometry = ee.Geometry.Rectangle(list(bbox))
+    year_bands = {year: get_modis_image(year, lc_type).rename(f'y{year}') for year in years}
+    src, dst = year_bands[from_year], year_bands[to_year]
+    transition = (
+        src.multiply(n).add(dst)
+        .updateMask(src.lt(n).And(dst.lt(n)))
+        .rename('transition')
+    )
+    with stage("ee_getinfo"):
+        histograms = ee.Image.cat(list(year_bands.values()) + [transition]).reduceRegion(
+            reducer=ee.Reducer.frequencyHistogram(),
+            geometry=geometry,
+            scale=500,
+            maxPixels=1e9
+        ).getInfo()
+
+    codes = np.zeros(n * n, dtype=np.int64)
+    for code, pixel_count in (histograms.get('transition') or {}).items():
+        codes[int(float(code))] += int(pixel_count)
+    return {
+        'years': {year: histogram_to_stats(histograms.get(f'y{year}') or {}, lc_type=lc_type) for year in years},
+        'transition': transition_summary(codes.reshape(n, n), from_year, to_year, lc_type),
+    }
 
 
 class MODISAnalyzer:
@@ -8,44 +251,8 @@ class MODISAnalyzer:
         self.bbox = bbox
         self.geometry = ee.Geometry.Rectangle(bbox)
 
-        self.lc_colors = {
-            0: "#0B43D2",   # Water
-            1: '#086a10',   # Evergreen Needleleaf Forests
-            2: '#54a708',   # Evergreen Broadleaf Forests
-            3: '#78d203',   # Deciduous Needleleaf Forests
-            4: '#009900',   # Deciduous Broadleaf Forests
-            5: '#c6b044',   # Mixed Forests
-            6: '#dcd159',   # Closed Shrublands
-            7: '#dade48',   # Open Shrublands
-            8: '#fbff13',   # Woody Savannas
-            9: '#b6ff05',   # Savannas
-            10: '#27ff87',  # Grasslands
-            11: '#c24f44',  # Permanent Wetlands
-            12: "#f8cd0a",  # Croplands
-            13: "#a5a6a6",  # Urban and Built-up Lands
-            14: '#69fff8',  # Cropland/Natural Vegetation Mosaics
-            15: "#98d6ff",  # Permanent Snow and Ice
-            16: "#000000"   # Barren
-        }
-        self.lc_names = {
-            0: 'Water bodies',
-            1: 'Evergreen Needleleaf Forests',
-            2: 'Evergreen Broadleaf Forests',
-            3: 'Deciduous Needleleaf Forests',
-            4: 'Deciduous Broadleaf Forests',
-            5: 'Mixed Forests',
-            6: 'Closed Shrublands',
-            7: 'Open Shrublands',
-            8: 'Woody Savannas',
-            9: 'Savannas',
-            10: 'Grasslands',
-            11: 'Permanent Wetlands',
-            12: 'Croplands',
-            13: 'Urban and Built-up Lands',
-            14: 'Cropland/Natural Vegetation Mosaics',
-            15: 'Permanent Snow and Ice',
-            16: 'Unclassified'
-        }
+        self.lc_colors = LC_COLORS
+        self.lc_names = LC_NAMES
 
     def get_modis_data(self, year=2024,lc_type=2):
         collection = ee.ImageCollection('MODIS/061/MCD12Q1')
@@ -58,8 +265,8 @@ class MODISAnalyzer:
         lc_band = f'LC_Type{lc_type}'
         return modis_image.select(lc_band).clip(self.geometry)
     
-    def analyze_land_cover(self, year=2024):
-        modis_image = self.get_modis_data(year)
+    def analyze_land_cover(self, year=2024, lc_type=2):
+        modis_image = self.get_modis_data(year, lc_type)
         histogram = modis_image.reduceRegion(
             reducer=ee.Reducer.frequencyHistogram(),
             geometry=self.geometry,
@@ -67,25 +274,14 @@ class MODISAnalyzer:
             maxPixels=1e9
         )
         
-        lc_hist = histogram.getInfo()[f'LC_Type2']
+        with stage("ee_getinfo"):
+            lc_hist = histogram.getInfo()[f'LC_Type{lc_type}']
 
         if lc_hist is None:
             print("Nu există date pentru zona specificată.")
             return None
         
-        stats = {}
-        total_pixels = sum(lc_hist.values())
-
-        for lc_class, pixel_count in lc_hist.items():
-            lc_class = int(lc_class)
-            if lc_class in self.lc_names:
-                percentage = (pixel_count / total_pixels) * 100
-                stats[self.lc_names[lc_class]] = {
-                    'pixels': pixel_count,
-                    'percentage': percentage,
-                    'area_km2': (pixel_count * 0.25)
-                }
-        return stats
+        return histogram_to_stats(lc_hist, lc_type=lc_type)
     
 
     def _create_legend_html(self):
@@ -116,16 +312,12 @@ class MODISAnalyzer:
             'max': 16,
             'palette': list(self.lc_colors.values())
         }
-        map_id_dict = modis_image.getMapId(vis_params)
+        with stage("ee_getmapid"):
+            map_id_dict = modis_image.getMapId(vis_params)
         return map_id_dict["tile_fetcher"].url_format
     
     def get_legend(self):
-        """Returnează un dict simplu pentru legendă (clasă → culoare)"""
-        legend = {}
-        for class_id, color in self.lc_colors.items():
-            if class_id in self.lc_names:
-                legend[self.lc_names[class_id]] = color
-        return legend
+        return get_legend()
 
 def authenticate_earth_engine():
     load_dotenv()
@@ -136,14 +328,22 @@ def authenticate_earth_engine():
     credentials = ee.ServiceAccountCredentials(None, credentials_path)
     ee.Initialize(credentials, project=project_id)
 
+def ensure_initialized():
+    """Authenticate Earth Engine once per process; returns False if it is not available."""
+    if ee.data._initialized:
+        return True
+    try:
+        authenticate_earth_engine()
+        print("Earth Engine authenticated successfully.")
+        return True
+    except Exception as e:
+        print(f"Eroare la inițializarea GEE: {e}")
+        return False
+
+
 def main(bbox=None):
-    if not ee.data._initialized:
-        try:
-            authenticate_earth_engine()
-            print("Earth Engine authenticated successfully.")
-        except Exception as e:
-            print(f"Eroare la inițializarea GEE: {e}")
-            return None, None
+    if not ensure_initialized():
+        return None, None
 
     if bbox is None:
         print("Nu s-a furnizat nicio bounding box.")
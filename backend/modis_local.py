@@ -0,0 +1,173 @@
+import os
+import json
+import math
+import logging
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+
+from modis import LC_NAMES, get_legend, histogram_to_stats, n_classes, transition_summary
+
+
+logger = logging.getLogger("geo-app.modis-local")
+
+MODIS_LOCAL_DIR = os.getenv("MODIS_LOCAL_DIR", "/data/modis")
+# MCD12Q1 marks unclassified / fill pixels with 255
+DEFAULT_NODATA = 255
+KM_PER_DEGREE = 111.32
+
+Bbox = Tuple[float, float, float, float]
+
+
+class LocalRaster:
+    """
+    One yearly MCD12Q1 land-cover band stored on disk in EPSG:4326, either as a GeoTIFF or as
+    an .npy array with a JSON sidecar: {"lon_min", "lat_max", "lon_step", "lat_step", "nodata"}.
+    Only the pixels under the requested bbox are read (memory map / rasterio window).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.is_tiff = path.endswith((".tif", ".tiff"))
+        if self.is_tiff:
+            import rasterio
+
+            with rasterio.open(path) as src:
+                t = src.transform
+                self.lon_min, self.lat_max = t.c, t.f
+                self.lon_step, self.lat_step = t.a, -t.e
+                self.height, self.width = src.height, src.width
+                self.nodata = DEFAULT_NODATA if src.nodata is None else int(src.nodata)
+            self._array = None
+        else:
+            with open(os.path.splitext(path)[0] + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.lon_min, self.lat_max = float(meta["lon_min"]), float(meta["lat_max"])
+            self.lon_step, self.lat_step = float(meta["lon_step"]), float(meta["lat_step"])
+            self.nodata = int(meta.get("nodata", DEFAULT_NODATA))
+            self._array = np.load(path, mmap_mode="r")
+            self.height, self.width = self._array.shape
+
+    def window(self, bbox: Bbox) -> Optional[Tuple[int, int, int, int]]:
+        """(row0, row1, col0, col1) of the pixels whose centres fall in the bbox, or None if empty."""
+        lon_min, lat_min, lon_max, lat_max = bbox
+        col0 = max(0, math.ceil((lon_min - self.lon_min) / self.lon_step - 0.5))
+        col1 = min(self.width, math.floor((lon_max - self.lon_min) / self.lon_step - 0.5) + 1)
+        row0 = max(0, math.ceil((self.lat_max - lat_max) / self.lat_step - 0.5))
+        row1 = min(self.height, math.floor((self.lat_max - lat_min) / self.lat_step - 0.5) + 1)
+        if col0 >= col1 or row0 >= row1:
+            return None
+        return row0, row1, col0, col1
+
+    def open(self):
+        """Context manager giving the dataset handle `read` needs (None for .npy)."""
+        if not self.is_tiff:
+            return nullcontext()
+        import rasterio
+
+        return rasterio.open(self.path)
+
+    def read(self, window: Tuple[int, int, int, int], src=None) -> np.ndarray:
+        row0, row1, col0, col1 = window
+        if not self.is_tiff:
+            return np.asarray(self._array[row0:row1, col0:col1])
+        from rasterio.windows import Window
+
+        return src.read(1, window=Window(col0, row0, col1 - col0, row1 - row0))
+
+    def pixel_area_km2(self, lat: float) -> float:
+        return (self.lon_step * KM_PER_DEGREE * math.cos(math.radians(lat))) * (self.lat_step * KM_PER_DEGREE)
+
+
+@lru_cache(maxsize=32)
+def open_raster(data_dir: str, year: int, lc_type: int) -> Optional[LocalRaster]:
+    """Raster for (year, lc_type) under data_dir, e.g. MCD12Q1_2024_LC_Type2.tif / .npy."""
+    stem = os.path.join(data_dir, f"MCD12Q1_{year}_LC_Type{lc_type}")
+    for ext in (".npy", ".tif", ".tiff"):
+        if os.path.exists(stem + ext):
+            return LocalRaster(stem + ext)
+    return None
+
+
+class LocalMODISAnalyzer:
+    """Drop-in replacement for MODISAnalyzer that works on local rasters, without Earth Engine."""
+
+    def __init__(self, bbox, data_dir: Optional[str] = None):
+        self.bbox = bbox
+        self.data_dir = data_dir or MODIS_LOCAL_DIR
+        self.lc_names = LC_NAMES
+
+    def analyze_land_cover(self, year=2024, lc_type=2):
+        return analyze_land_cover_batch([self.bbox], year, lc_type, self.data_dir)[0]
+
+    def get_legend(self):
+        return get_legend()
+
+
+def analyze_land_cover_batch(bboxes, year=2024, lc_type=2, data_dir: Optional[str] = None):
+    """Stats for many bboxes from one opened raster; one stats dict (or None) per bbox, in order."""
+    raster = open_raster(data_dir or MODIS_LOCAL_DIR, year, lc_type)
+    if raster is None:
+        logger.warning("No local MCD12Q1 raster for %s LC_Type%s in %s", year, lc_type, data_dir or MODIS_LOCAL_DIR)
+        return [None] * len(bboxes)
+
+    results = []
+    with raster.open() as src:
+        for bbox in bboxes:
+            window = raster.window(tuple(bbox))
+            if window is None:
+                results.append(None)
+                continue
+            centre_lat = (bbox[1] + bbox[3]) / 2.0
+            results.append(histogram_to_stats(
+                _class_histogram(raster.read(window, src), raster.nodata),
+                pixel_area_km2=raster.pixel_area_km2(centre_lat),
+                lc_type=lc_type,
+            ))
+    return results
+
+
+def _class_histogram(values: np.ndarray, nodata: int) -> dict:
+    counts = np.bincount(values.ravel(), minlength=256)
+    counts[nodata] = 0
+    return {int(c): int(counts[c]) for c in np.flatnonzero(counts)}
+
+
+def analyze_land_cover_change(bbox, years, from_year, to_year, lc_type=2, data_dir: Optional[str] = None):
+    """
+    Local counterpart of modis.analyze_land_cover_change. The yearly rasters must share one
+    grid; the transition matrix is a single bincount over from * n_classes + to codes.
+    """
+    data_dir = data_dir or MODIS_LOCAL_DIR
+    rasters = {year: open_raster(data_dir, year, lc_type) for year in years}
+    missing = [year for year, raster in rasters.items() if raster is None]
+    if missing:
+        raise FileNotFoundError(f"No local MCD12Q1 LC_Type{lc_type} raster for {missing} in {data_dir}")
+
+    reference = rasters[years[0]]
+    window = reference.window(tuple(bbox))
+    if window is None:
+        return None
+    values = {}
+    for year, raster in rasters.items():
+        if raster.window(tuple(bbox)) != window:
+            raise ValueError(f"MCD12Q1 raster for {year} is not on the same grid as {years[0]}")
+        with raster.open() as src:
+            values[year] = raster.read(window, src)
+
+    pixel_area = reference.pixel_area_km2((bbox[1] + bbox[3]) / 2.0)
+    n = n_classes(lc_type)
+    src, dst = values[from_year].astype(np.int64), values[to_year].astype(np.int64)
+    valid = (src < n) & (dst < n)
+    codes = np.bincount(src[valid] * n + dst[valid], minlength=n * n)
+    return {
+        'years': {
+            year: histogram_to_stats(
+                _class_histogram(values[year], reference.nodata), pixel_area_km2=pixel_area, lc_type=lc_type
+            )
+            for year in years
+        },
+        'transition': transition_summary(codes.reshape(n, n), from_year, to_year, lc_type),
+    }
@@ -0,0 +1,88 @@
+from typing import Optional
+
+import numpy as np
+
+from sentinel_process import NDVI_BREAKS
+
+
+# Fine NDVI histogram used for the quantiles: 2000 bins over [-1, 1] -> 0.001 resolution
+QUANTILE_BINS = 2000
+# Rows processed per step; keeps temporaries at O(ROW_BLOCK * width) for any raster size
+ROW_BLOCK = 512
+
+
+def _quantile(cumulative: np.ndarray, total: int, q: float) -> float:
+    idx = int(np.searchsorted(cumulative, q * total, side="left"))
+    idx = min(idx, QUANTILE_BINS - 1)
+    # bin centre
+    return -1.0 + (idx + 0.5) * (2.0 / QUANTILE_BINS)
+
+
+def compute_ndvi_stats(ndvi: np.ndarray, mask: np.ndarray, row_block: int = ROW_BLOCK) -> dict:
+    """
+    Zonal statistics over the valid pixels of an NDVI array.
+    Streams over row blocks, so extra memory stays bounded by `row_block` rows
+    regardless of raster size. Quantiles come from a 0.001-wide histogram.
+    """
+    h, w = ndvi.shape
+    n_classes = len(NDVI_BREAKS) + 1
+    class_counts = np.zeros(n_classes, dtype=np.int64)
+    fine_counts = np.zeros(QUANTILE_BINS, dtype=np.int64)
+    count = 0
+    total = 0.0
+    total_sq = 0.0
+    vmin: Optional[float] = None
+    vmax: Optional[float] = None
+
+    for row in range(0, h, row_block):
+        rows = slice(row, row + row_block)
+        values = ndvi[rows][mask[rows]].astype(np.float64)
+        if values.size == 0:
+            continue
+        count += values.size
+        total += float(values.sum())
+        total_sq += float(np.dot(values, values))
+        block_min, block_max = float(values.min()), float(values.max())
+        vmin = block_min if vmin is None else min(vmin, block_min)
+        vmax = block_max if vmax is None else max(vmax, block_max)
+
+        class_counts += np.bincount(np.digitize(values, NDVI_BREAKS), minlength=n_classes)
+        fine = ((np.clip(values, -1.0, 1.0) + 1.0) * (QUANTILE_BINS / 2.0)).astype(np.int64)
+        fine_counts += np.bincount(np.minimum(fine, QUANTILE_BINS - 1), minlength=QUANTILE_BINS)
+
+    pixels = h * w
+    bounds = [None] + [round(float(b), 4) for b in NDVI_BREAKS] + [None]
+    histogram = [
+        {
+            "min": bounds[i],
+            "max": bounds[i + 1],
+            "count": int(class_counts[i]),
+            "fraction": (int(class_counts[i]) / count) if count else 0.0,
+        }
+        for i in range(n_classes)
+    ]
+
+    result = {
+        "pixels": pixels,
+        "valid_pixels": count,
+        "valid_fraction": (count / pixels) if pixels else 0.0,
+        "mean": None,
+        "median": None,
+        "p10": None,
+        "p90": None,
+        "std": None,
+        "min": vmin,
+        "max": vmax,
+        "histogram": histogram,
+    }
+    if count:
+        mean = total / count
+        cumulative = np.cumsum(fine_counts)
+        result.update(
+            mean=mean,
+            std=float(np.sqrt(max(total_sq / count - mean * mean, 0.0))),
+            median=_quantile(cumulative, count, 0.5),
+            p10=_quantile(cumulative, count, 0.1),
+            p90=_quantile(cumulative, count, 0.9),
+        )
+    return result
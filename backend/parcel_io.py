@@ -0,0 +1,151 @@
+import io
+import csv
+import json
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+
+# accepted CSV headers for the four bbox columns, first match wins
+CSV_COLUMN_ALIASES = (
+    ("x1", "y1", "x2", "y2"),
+    ("lon_min", "lat_min", "lon_max", "lat_max"),
+    ("minx", "miny", "maxx", "maxy"),
+)
+MAX_REPORTED_ERRORS = 100
+
+
+def parse_csv(data: bytes) -> np.ndarray:
+    """(n, 4) float array of x1, y1, x2, y2 from a CSV with a header row; unparsable cells become NaN."""
+    reader = csv.reader(io.StringIO(data.decode("utf-8-sig")))
+    header = [h.strip().lower() for h in next(reader, [])]
+    for names in CSV_COLUMN_ALIASES:
+        if all(name in header for name in names):
+            cols = [header.index(name) for name in names]
+            break
+    else:
+        raise ValueError(f"CSV header must contain one of {[','.join(n) for n in CSV_COLUMN_ALIASES]}")
+
+    cells = [[row[c] if c < len(row) else "" for c in cols] for row in reader if row]
+    if not cells:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.genfromtxt(
+        io.StringIO("\n".join(",".join(cell.strip() for cell in row) for row in cells)),
+        delimiter=",", dtype=np.float64, ndmin=2,
+    )
+
+
+def _geometry_bbox(geometry: dict) -> List[float]:
+    coords = np.asarray(_flatten(geometry.get("coordinates", [])), dtype=np.float64).reshape(-1, 2)
+    if not len(coords):
+        return [np.nan] * 4
+    return [coords[:, 0].min(), coords[:, 1].min(), coords[:, 0].max(), coords[:, 1].max()]
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _flatten(nested) -> list:
+    if not isinstance(nested, list):
+        raise ValueError("coordinates must be nested arrays of [lon, lat] positions")
+    if nested and all(_is_number(v) for v in nested):
+        if len(nested) < 2:
+            raise ValueError("a position needs a longitude and a latitude")
+        return list(nested[:2])
+    return [v for part in nested for v in _flatten(part)]
+
+
+def _feature_bbox(feature) -> List[float]:
+    if not isinstance(feature, dict):
+        raise ValueError("must be a GeoJSON Feature object")
+    bbox = feature.get("bbox")
+    if isinstance(bbox, list) and len(bbox) == 4 and all(_is_number(v) for v in bbox):
+        return bbox
+    geometry = feature.get("geometry")
+    if not geometry:
+        return [np.nan] * 4
+    if not isinstance(geometry, dict):
+        raise ValueError("geometry must be a GeoJSON geometry object")
+    return _geometry_bbox(geometry)
+
+
+def parse_geojson(data: bytes) -> np.ndarray:
+    """
+    (n, 4) array of parcel bboxes, one per feature: the feature `bbox` member or its geometry
+    extent. Valid JSON that is not Feature / FeatureCollection shaped raises ValueError.
+    """
+    doc = json.loads(data)
+    if not isinstance(doc, dict):
+        raise ValueError("GeoJSON must be a Feature or FeatureCollection object")
+    if doc.get("type") == "FeatureCollection":
+        features = doc.get("features", [])
+        if not isinstance(features, list):
+            raise ValueError("FeatureCollection features must be an array")
+    elif doc.get("type") == "Feature":
+        features = [doc]
+    else:
+        raise ValueError("GeoJSON must be a Feature or FeatureCollection")
+
+    boxes = []
+    for i, feature in enumerate(features):
+        try:
+            boxes.append(_feature_bbox(feature))
+        except ValueError as e:
+            raise ValueError(f"feature {i + 1}: {e}")
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def validate_boxes(boxes: np.ndarray) -> Tuple[np.ndarray, List[dict]]:
+    """Vectorized checks; returns (valid row mask, up to MAX_REPORTED_ERRORS {row, reason} dicts)."""
+    finite = np.isfinite(boxes).all(axis=1)
+    with np.errstate(invalid="ignore"):
+        lon_ok = (np.abs(boxes[:, [0, 2]]) <= 180).all(axis=1)
+        lat_ok = (np.abs(boxes[:, [1, 3]]) <= 90).all(axis=1)
+    valid = finite & lon_ok & lat_ok
+
+    errors = []
+    for row in np.flatnonzero(~valid)[:MAX_REPORTED_ERRORS]:
+        if not finite[row]:
+            reason = "missing or non-numeric coordinate"
+        elif not lon_ok[row]:
+            reason = "longitude out of range [-180,180]"
+        else:
+            reason = "latitude out of range [-90,90]"
+        errors.append({"row": int(row) + 1, "reason": reason})
+    return valid, errors
+
+
+def csv_chunks(pages: Iterable[list]) -> Iterable[str]:
+    yield "id,x1,y1,x2,y2,created_at\n"
+    for page in pages:
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerows((coord_id, x1, y1, x2, y2, created_at.isoformat())
+                         for coord_id, x1, y1, x2, y2, created_at in page)
+        yield buf.getvalue()
+
+
+def geojson_chunks(pages: Iterable[list]) -> Iterable[str]:
+    yield '{"type":"FeatureCollection","features":['
+    sep = ""
+    for page in pages:
+        if page:
+            yield sep + ",".join(json.dumps(_feature(row), separators=(",", ":")) for row in page)
+            sep = ","
+    yield "]}"
+
+
+def _feature(row) -> dict:
+    coord_id, x1, y1, x2, y2, created_at = row
+    lon_min, lon_max = sorted((x1, x2))
+    lat_min, lat_max = sorted((y1, y2))
+    return {
+        "type": "Feature",
+        "id": coord_id,
+        "bbox": [lon_min, lat_min, lon_max, lat_max],
+        "properties": {"id": coord_id, "created_at": created_at.isoformat()},
+        "geometry": {"type": "Polygon", "coordinates": [[
+            [lon_min, lat_min], [lon_max, lat_min], [lon_max, lat_max], [lon_min, lat_max], [lon_min, lat_min],
+        ]]},
+    }
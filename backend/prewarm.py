@@ -0,0 +1,179 @@
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+logger = logging.getLogger("geo-app.prewarm")
+
+METERS_PER_DEGREE = 111_320.0
+# Sentinel Hub bills 1 PU per 512 x 512 px at 3 input bands and 8/16-bit output; FLOAT32 output doubles it
+PU_REFERENCE_PIXELS = 512 * 512
+PU_MINIMUM = 0.005
+
+Bbox = Tuple[float, float, float, float]
+
+
+def estimate_processing_units(width: int, height: int, bands: int = 2, float32: bool = True) -> float:
+    """Approximate Sentinel Hub processing units for one Process API request."""
+    pu = (width * height / PU_REFERENCE_PIXELS) * max(bands / 3.0, 1.0 / 3.0) * (2.0 if float32 else 1.0)
+    return max(pu, PU_MINIMUM)
+
+
+def bbox_pixels(bbox: Bbox, resolution: int) -> Tuple[int, int]:
+    """(width, height) of a lon/lat bbox at `resolution` meters per pixel."""
+    lon_min, lat_min, lon_max, lat_max = bbox
+    mid_lat = math.radians((lat_min + lat_max) / 2.0)
+    width = (lon_max - lon_min) * METERS_PER_DEGREE * math.cos(mid_lat) / resolution
+    height = (lat_max - lat_min) * METERS_PER_DEGREE / resolution
+    return max(1, math.ceil(width)), max(1, math.ceil(height))
+
+
+class Prewarmer:
+    """
+    Periodically renders saved parcels ahead of time so interactive opens are cache hits.
+
+    Each run lists parcels (most relevant first), drops exact duplicates and the ones whose
+    render is already cached, then spends a processing-unit budget greedily. `footprint(bbox)`
+    maps a parcel to the upstream pieces it needs and their PU cost; pieces shared by
+    overlapping parcels are paid for once. Selected parcels run in waves so that no two
+    parcels in the same wave fetch a shared piece, with at most `concurrency` at a time.
+    """
+
+    def __init__(
+        self,
+        list_parcels: Callable[[], List[Bbox]],
+        parcel_key: Callable[[Bbox], Hashable],
+        is_warm: Callable[[Bbox], bool],
+        footprint: Callable[[Bbox], Dict[Hashable, float]],
+        warm: Callable[[Bbox], None],
+        pu_budget: float = 100.0,
+        concurrency: int = 2,
+        interval_seconds: float = 6 * 3600,
+    ):
+        self.list_parcels = list_parcels
+        self.parcel_key = parcel_key
+        self.is_warm = is_warm
+        self.footprint = footprint
+        self.warm = warm
+        self.pu_budget = pu_budget
+        self.concurrency = concurrency
+        self.interval_seconds = interval_seconds
+
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_run: Optional[dict] = None
+        self.runs = 0
+
+    # --- scheduling ---
+    def start(self) -> None:
+        if self.interval_seconds <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="ndvi-prewarm", daemon=True)
+        self._thread.start()
+        logger.info("NDVI pre-warming every %.0fs, budget %.1f PU", self.interval_seconds, self.pu_budget)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("NDVI pre-warm run failed")
+            self._stop.wait(self.interval_seconds)
+
+    # --- one run ---
+    def plan(self, parcels: List[Bbox]) -> Tuple[List[List[Bbox]], dict]:
+        """(waves of parcels to warm, planning counters) for one run."""
+        seen = set()
+        planned: Dict[Hashable, float] = {}
+        waves: List[Tuple[set, List[Bbox]]] = []
+        counts = {"parcels": len(parcels), "duplicates": 0, "already_warm": 0, "over_budget": 0, "pu_planned": 0.0}
+
+        for bbox in parcels:
+            key = self.parcel_key(bbox)
+            if key in seen:
+                counts["duplicates"] += 1
+                continue
+            seen.add(key)
+            if self.is_warm(bbox):
+                counts["already_warm"] += 1
+                continue
+
+            pieces = self.footprint(bbox)
+            cost = sum(pu for piece, pu in pieces.items() if piece not in planned)
+            if counts["pu_planned"] + cost > self.pu_budget:
+                counts["over_budget"] += 1
+                continue
+            planned.update(pieces)
+            counts["pu_planned"] += cost
+
+            for claimed, members in waves:
+                if claimed.isdisjoint(pieces):
+                    claimed.update(pieces)
+                    members.append(bbox)
+                    break
+            else:
+                waves.append((set(pieces), [bbox]))
+
+        return [members for _, members in waves], counts
+
+    def run_once(self) -> dict:
+        """Plan and warm once; concurrent calls are skipped while a run is in progress."""
+        if not self._run_lock.acquire(blocking=False):
+            return {"skipped": "run already in progress"}
+        try:
+            started = time.time()
+            waves, summary = self.plan(self.list_parcels())
+            warmed = failed = 0
+            with ThreadPoolExecutor(max_workers=max(1, self.concurrency), thread_name_prefix="prewarm") as pool:
+                for wave in waves:
+                    if self._stop.is_set():
+                        break
+                    for bbox, error in zip(wave, pool.map(self._warm_one, wave)):
+                        if error is None:
+                            warmed += 1
+                        else:
+                            failed += 1
+                            logger.warning("Pre-warm failed for %s: %s", bbox, error)
+
+            summary.update(
+                warmed=warmed,
+                failed=failed,
+                waves=len(waves),
+                pu_planned=round(summary["pu_planned"], 3),
+                started_at=started,
+                seconds=round(time.time() - started, 3),
+            )
+            self.last_run = summary
+            self.runs += 1
+            logger.info("NDVI pre-warm: %s", summary)
+            return summary
+        finally:
+            self._run_lock.release()
+
+    def _warm_one(self, bbox: Bbox) -> Optional[str]:
+        try:
+            self.warm(bbox)
+            return None
+        except Exception as e:
+            return str(e)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.interval_seconds > 0,
+            "interval_seconds": self.interval_seconds,
+            "pu_budget": self.pu_budget,
+            "concurrency": self.concurrency,
+            "runs": self.runs,
+            "last_run": self.last_run,
+        }
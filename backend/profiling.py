@@ -0,0 +1,200 @@
+import os
+import re
+import sys
+import json
+import time
+import hmac
+import heapq
+import random
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+logger = logging.getLogger("geo-app.profiling")
+
+# request bodies up to this size are recorded with the profile (NDVI bboxes come in POST bodies)
+MAX_RECORDED_BODY = 4096
+
+_SECRET_FIELDS = re.compile(r"pass|token|secret", re.IGNORECASE)
+
+# leaf frames of threads that are parked, not working
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+
+class StackSampler:
+    """
+    Sampling profiler over every busy thread of the process. One request's work spans
+    the event loop, the anyio threadpool and the single-flight workers, so sampling a
+    single thread would miss most of it. Produces folded stacks
+    ("thread;file:function;... count"), the input of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                if not stack or stack[0][:2] in _IDLE_LEAVES:
+                    continue
+                path = ";".join(f"{f}:{name}:{line}" for f, name, line in reversed(stack))
+                self.samples[f"{names.get(ident, ident)};{path}"] += 1
+
+
+class ProfileStore:
+    """
+    Profiles on disk as <id>.folded plus <id>.json (endpoint, params, duration). Requested
+    profiles are always kept; sampled ones only while among the `keep_slowest` slowest of
+    their endpoint. The ranking lives in memory, so it restarts with the process.
+    """
+
+    def __init__(self, directory: str, keep_slowest: int = 5):
+        self.directory = directory
+        self.keep_slowest = keep_slowest
+        self._lock = threading.Lock()
+        # endpoint -> min-heap of (duration, profile id)
+        self._slowest: Dict[str, List[Tuple[float, str]]] = {}
+
+    @staticmethod
+    def new_id(method: str, endpoint: str) -> str:
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", f"{method} {endpoint}").strip("-")
+        return f"{time.strftime('%Y%m%dT%H%M%S')}-{slug}-{os.urandom(3).hex()}"
+
+    def save(self, profile_id: str, endpoint: str, method: str, params: dict, status: int, seconds: float,
+             samples: Counter, requested: bool) -> bool:
+        """Write a profile; False when a sampled one is not among the slowest of its endpoint."""
+        evicted = None
+        if not requested:
+            with self._lock:
+                heap = self._slowest.setdefault(f"{method} {endpoint}", [])
+                if len(heap) < self.keep_slowest:
+                    heapq.heappush(heap, (seconds, profile_id))
+                elif seconds > heap[0][0]:
+                    evicted = heapq.heapreplace(heap, (seconds, profile_id))[1]
+                else:
+                    return False
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile_id)
+        with open(base + ".folded", "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+        with open(base + ".json", "w") as f:
+            json.dump({
+                "endpoint": endpoint, "method": method, "params": params, "status": status,
+                "seconds": round(seconds, 4), "samples": sum(samples.values()), "requested": requested,
+            }, f, indent=2)
+        if evicted:
+            for ext in (".folded", ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, evicted + ext))
+                except OSError:
+                    pass
+        return True
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when it carries `X-Profile: <token>` (token configured, compared
+    exactly) or, with probability `sample_rate`, at random. One request is profiled at a
+    time; the sampler sees the whole process and must not pile up under load.
+    """
+
+    def __init__(self, app: ASGIApp, store: ProfileStore, token: str = "", sample_rate: float = 0.0, interval: float = 0.005):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = Headers(scope=scope).get("x-profile", "")
+        requested = bool(self.token) and hmac.compare_digest(header.encode(), self.token.encode())
+        sampled = not requested and self.sample_rate > 0 and random.random() < self.sample_rate
+        if not (requested or sampled) or not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+        profile_id = [None]
+        body = bytearray()
+        sampler = StackSampler(self.interval)
+
+        async def receive_recorded() -> Message:
+            message = await receive()
+            if message["type"] == "http.request" and len(body) <= MAX_RECORDED_BODY:
+                body.extend(message.get("body", b""))
+            return message
+
+        def endpoint() -> str:
+            return getattr(scope.get("route"), "path", None) or scope["path"]
+
+        async def send_with_status(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                # routing is done by now, so the id can name the endpoint
+                profile_id[0] = self.store.new_id(scope["method"], endpoint())
+                if requested:
+                    MutableHeaders(scope=message)["X-Profile-Id"] = profile_id[0]
+            await send(message)
+
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive_recorded, send_with_status)
+        finally:
+            samples = sampler.stop()
+            seconds = time.perf_counter() - start
+            self._busy.release()
+            params = {**scope.get("path_params", {}), **dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))}
+            if body and len(body) <= MAX_RECORDED_BODY:
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    payload = "<non-JSON body>"
+                if isinstance(payload, dict):
+                    payload = {k: "<redacted>" if _SECRET_FIELDS.search(k) else v for k, v in payload.items()}
+                params["body"] = payload
+            profile_id = profile_id[0] or self.store.new_id(scope["method"], endpoint())
+            try:
+                if self.store.save(profile_id, endpoint(), scope["method"], params, status[0], seconds, samples, requested):
+                    logger.info("Profiled %s %s in %.3fs -> %s", scope["method"], scope["path"], seconds, profile_id)
+            except OSError:
+                logger.exception("Could not write profile")
@@ -1,10 +1,18 @@
 import os
 import io
-from typing import Tuple, Optional, List
+import math
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Tuple, Optional, List
 
 import numpy as np
+import requests
 from PIL import Image
+from requests.adapters import HTTPAdapter
 
+from metrics import PROCESSING_UNITS, UPSTREAM_BYTES, UPSTREAM_REQUESTS, stage
 from sentinelhub import (
     SHConfig,
     DataCollection,
@@ -13,9 +21,14 @@ from sentinelhub import (
     bbox_to_dimensions,
     CRS,
     MimeType,
+    SentinelHubDownloadClient,
+    SentinelHubSession,
 )
 
 
+logger = logging.getLogger("geo-app.sentinel")
+
+
 # NDVI -> color mapping evalscript (returns RGBA)
 EVALSCRIPT_NDVI = """
 //VERSION=3
@@ -63,6 +76,75 @@ function evaluatePixel(sample) {
 }
 """
 
+# Raw NDVI (FLOAT32) + dataMask; the palette is applied locally by colorize_ndvi,
+# so one upstream fetch can be re-styled any number of times.
+EVALSCRIPT_NDVI_RAW = """
+//VERSION=3
+function setup() {
+    return {
+        input: [{
+            bands: ["B04", "B08", "dataMask"]
+        }],
+        output: {
+            bands: 2,
+            sampleType: "FLOAT32"
+        }
+    };
+}
+
+function evaluatePixel(sample) {
+    let val = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
+    return [val, sample.dataMask];
+}
+"""
+
+# "upstream": colour classes computed by EVALSCRIPT_NDVI on Sentinel Hub
+# "local": fetch raw NDVI once and colour it here (EVALSCRIPT_NDVI_RAW)
+NDVI_RENDER_MODE = os.environ.get("NDVI_RENDER_MODE", "local")
+
+# Upper bounds of the NDVI classes used by EVALSCRIPT_NDVI (value < bound).
+NDVI_BREAKS = np.array(
+    [-1.1, -0.2, -0.1, 0, 0.025, 0.05, 0.075, 0.1, 0.125, 0.15,
+     0.175, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6],
+    dtype=np.float32,
+)
+
+# One RGB row per class: len(NDVI_BREAKS) + 1 rows, same order as EVALSCRIPT_NDVI.
+NDVI_COLORS = np.array(
+    [
+        [0, 0, 0], [191, 191, 191], [219, 219, 219], [255, 255, 224],
+        [255, 250, 204], [237, 232, 181], [222, 217, 156], [204, 199, 130],
+        [188, 184, 107], [176, 194, 97], [163, 204, 89], [145, 191, 82],
+        [128, 179, 72], [112, 163, 64], [97, 150, 53], [79, 137, 46],
+        [64, 125, 36], [48, 110, 28], [33, 97, 18], [16, 84, 10],
+        [0, 69, 0],
+    ],
+    dtype=np.uint8,
+)
+
+PALETTES = {
+    "default": NDVI_COLORS,
+    "grayscale": np.repeat(
+        np.linspace(0, 255, len(NDVI_COLORS)).astype(np.uint8)[:, None], 3, axis=1
+    ),
+}
+
+# rows colorized per step, bounds temporary memory on very large rasters
+_COLORIZE_ROW_BLOCK = 512
+
+# Output encodings: "png" is an 8-bit indexed PNG, "webp" lossless and "webp-lossy" WebP
+IMAGE_FORMATS = {"png": "image/png", "webp": "image/webp", "webp-lossy": "image/webp"}
+# zlib level 0-9; NDVI class maps deflate well, so low levels lose little size
+PNG_COMPRESS_LEVEL = int(os.environ.get("NDVI_PNG_COMPRESS_LEVEL", "6"))
+# WebP effort 0 (fast) .. 6 (smallest) and lossy quality 0..100
+WEBP_METHOD = int(os.environ.get("NDVI_WEBP_METHOD", "4"))
+WEBP_QUALITY = int(os.environ.get("NDVI_WEBP_QUALITY", "80"))
+
+# Process API output limit per side; larger rasters are split into sub-tiles
+MAX_TILE_PX = int(os.environ.get("SH_MAX_TILE_PX", "2500"))
+# sub-tiles fetched concurrently for one raster
+TILE_WORKERS = int(os.environ.get("SH_TILE_WORKERS", "8"))
+
 def _load_sh_config() -> SHConfig:
     """Load SHConfig from env variables if present, otherwise fallback to default config file.
        Ensure the sentinelhub config directory is writable (avoid PermissionError in containers).
@@ -106,30 +188,265 @@ def _load_sh_config() -> SHConfig:
 
     return config
 
-def generate_ndvi_png_bytes(
-    bbox_wgs84: Tuple[float, float, float, float],
-    time_interval: Tuple[str, str] = ("2024-07-01", "2024-07-30"),
-    resolution: int = 10,
-    config: Optional[SHConfig] = None,
-) -> bytes:
+
+class _PooledDownloadClient(SentinelHubDownloadClient):
+    """SentinelHubDownloadClient that sends requests over a shared keep-alive requests.Session."""
+
+    def __init__(self, *, http: requests.Session, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.http = http
+
+    def _do_download(self, request):
+        if request.url is None:
+            raise ValueError(f"Faulty request {request}, no URL specified.")
+
+        with stage("sh_request"):
+            response = self.http.request(
+                request.request_type.value,
+                url=request.url,
+                json=request.post_values,
+                headers=self._prepare_headers(request),
+                timeout=self.config.download_timeout_seconds,
+            )
+        UPSTREAM_REQUESTS.inc(1, "sentinelhub", str(response.status_code))
+        UPSTREAM_BYTES.inc(len(response.content), "sentinelhub")
+        units = response.headers.get("x-processingunits-spent")
+        if units:
+            try:
+                PROCESSING_UNITS.inc(float(units))
+            except ValueError:
+                pass
+        return response
+
+
+class SentinelHubClient:
     """
-    Generate an NDVI PNG (RGBA) for the given bbox (x1, y1, x2, y2 in WGS84 lon/lat).
-    Returns PNG bytes ready to be served (Content-Type: image/png).
+    Long-lived, thread-safe Sentinel Hub state: the config is loaded once, the OAuth
+    token is cached and refreshed `refresh_before_expiry` seconds before it expires,
+    and all downloads share one pool of keep-alive HTTP connections.
     """
-    if config is None:
-        config = _load_sh_config()
 
-    # create bbox and compute pixel dimensions
-    aoi_bbox = BBox(bbox=bbox_wgs84, crs=CRS.WGS84)
-    size = bbox_to_dimensions(aoi_bbox, resolution=resolution)
-    # build request
-    request = SentinelHubRequest(
+    def __init__(self, config: Optional[SHConfig] = None, pool_size: int = 32, refresh_before_expiry: float = 300):
+        with stage("sh_config"):
+            self.config = config if config is not None else _load_sh_config()
+        self.refresh_before_expiry = refresh_before_expiry
+        self._session: Optional[SentinelHubSession] = None
+        self._lock = threading.Lock()
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    @property
+    def session(self) -> SentinelHubSession:
+        with self._lock:
+            if self._session is None:
+                with stage("sh_token"):
+                    self._session = SentinelHubSession(
+                        config=self.config, refresh_before_expiry=self.refresh_before_expiry
+                    )
+            # reading the token refreshes it when it is close to expiry
+            self._session.token
+            return self._session
+
+    def warm(self) -> None:
+        """Fetch the OAuth token up front so the first request does not pay for it."""
+        self.session
+
+    def download_client(self) -> SentinelHubDownloadClient:
+        # clients are cheap; one per download() call keeps their rate-limit lock per batch
+        return _PooledDownloadClient(http=self.http, session=self.session, config=self.config)
+
+    def download(self, download_requests: list, max_threads: Optional[int] = None) -> list:
+        # the whole batch: concurrent requests plus decoding of the responses
+        with stage("sh_download"):
+            return self.download_client().download(download_requests, max_threads=max_threads)
+
+
+_client: Optional[SentinelHubClient] = None
+_client_lock = threading.Lock()
+
+
+def get_sh_client() -> SentinelHubClient:
+    """Process-wide SentinelHubClient, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SentinelHubClient(
+                pool_size=int(os.environ.get("SH_HTTP_POOL_SIZE", "32")),
+                refresh_before_expiry=float(os.environ.get("SH_TOKEN_REFRESH_SECONDS", "300")),
+            )
+        return _client
+
+
+def _client_for(config: Optional[SHConfig]) -> SentinelHubClient:
+    return get_sh_client() if config is None else SentinelHubClient(config)
+
+def classify_ndvi(ndvi: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    NDVI (HxW float) -> HxW uint8 palette indices: 0 where `mask` is False,
+    1 + NDVI class elsewhere (rows of palette_lut).
+    """
+    h, w = ndvi.shape
+    indices = np.empty((h, w), dtype=np.uint8)
+    for row in range(0, h, _COLORIZE_ROW_BLOCK):
+        rows = slice(row, row + _COLORIZE_ROW_BLOCK)
+        block = indices[rows]
+        block[...] = np.digitize(ndvi[rows], NDVI_BREAKS)
+        block += 1
+        block *= mask[rows]
+    return indices
+
+
+@functools.lru_cache(maxsize=None)
+def palette_lut(palette: str = "default") -> np.ndarray:
+    """RGBA lookup table for classify_ndvi indices; row 0 is fully transparent."""
+    if palette not in PALETTES:
+        raise ValueError(f"Unknown palette '{palette}'")
+    lut = np.zeros((len(NDVI_COLORS) + 1, 4), dtype=np.uint8)
+    lut[1:, :3] = PALETTES[palette]
+    lut[1:, 3] = 255
+    lut.flags.writeable = False
+    return lut
+
+
+def colorize_ndvi(ndvi: np.ndarray, mask: np.ndarray, palette: str = "default") -> np.ndarray:
+    """
+    Map an NDVI array (HxW float) to RGBA (HxWx4 uint8) with a vectorized class lookup.
+    Pixels outside `mask` are fully transparent.
+    """
+    lut = palette_lut(palette)
+    return lut[classify_ndvi(ndvi, mask)]
+
+
+def _save(image: Image.Image, image_format: str, **params) -> bytes:
+    with stage(f"encode_{image_format}"):
+        return _encode(image, image_format, **params)
+
+
+def _encode(image: Image.Image, image_format: str, **params) -> bytes:
+    buf = io.BytesIO()
+    if image_format == "png":
+        image.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL, **params)
+    elif image_format == "webp":
+        image.save(buf, format="WEBP", lossless=True, quality=100, method=WEBP_METHOD)
+    elif image_format == "webp-lossy":
+        image.save(buf, format="WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
+    else:
+        raise ValueError(f"Unknown image format '{image_format}'")
+    return buf.getvalue()
+
+
+def encode_indexed(indices: np.ndarray, lut: np.ndarray, image_format: str = "png") -> bytes:
+    """
+    Encode HxW palette indices. PNG is written as an 8-bit indexed image whose tRNS
+    chunk carries the LUT alpha (a quarter of the RGBA pixel data, and it deflates better);
+    WebP has no palette mode in Pillow, so it gets the expanded RGBA.
+    """
+    if image_format != "png":
+        return _save(Image.fromarray(lut[indices], mode="RGBA"), image_format)
+    image = Image.fromarray(indices, mode="L")
+    image.putpalette(lut[:, :3].tobytes())
+    return _save(image, "png", transparency=lut[:, 3].tobytes())
+
+
+def encode_image(rgba: np.ndarray, image_format: str = "png") -> bytes:
+    """Encode an HxWx4 RGBA array as is."""
+    return _save(Image.fromarray(rgba, mode="RGBA"), image_format)
+
+
+@functools.lru_cache(maxsize=1)
+def _upstream_colour_index() -> Tuple[np.ndarray, np.ndarray]:
+    """(sorted 0xRRGGBB keys of the EVALSCRIPT_NDVI colours, their palette_lut row)."""
+    keys = (NDVI_COLORS.astype(np.uint32) << np.array([16, 8, 0], dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+    order = np.argsort(keys)
+    return keys[order], (order + 1).astype(np.uint8)
+
+
+def upstream_indices(rgba: np.ndarray) -> Optional[np.ndarray]:
+    """
+    palette_lut indices of an EVALSCRIPT_NDVI render (HxWx4): transparent pixels -> 0,
+    opaque ones looked up among the NDVI_COLORS. None when some pixel is neither.
+    """
+    keys, rows = _upstream_colour_index()
+    rgb = rgba[..., :3].astype(np.uint32)
+    packed = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+    pos = np.minimum(np.searchsorted(keys, packed), len(keys) - 1)
+    alpha = rgba[..., 3]
+    opaque = alpha == 255
+    if not np.all((alpha == 0) | (opaque & (keys[pos] == packed))):
+        return None
+    return np.where(opaque, rows[pos], 0).astype(np.uint8)
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    return encode_image(rgba, "png")
+
+
+def render_ndvi_image(ndvi: np.ndarray, mask: np.ndarray, palette: str = "default", image_format: str = "png") -> bytes:
+    with stage("classify"):
+        indices = classify_ndvi(ndvi, mask)
+    return encode_indexed(indices, palette_lut(palette), image_format)
+
+
+def render_ndvi_png(ndvi: np.ndarray, mask: np.ndarray, palette: str = "default") -> bytes:
+    return render_ndvi_image(ndvi, mask, palette, "png")
+
+
+def pack_ndvi(ndvi: np.ndarray, mask: np.ndarray) -> bytes:
+    """Serialize an NDVI array for caching; masked pixels are stored as NaN."""
+    data = np.where(mask, ndvi, np.nan).astype(np.float32)
+    buf = io.BytesIO()
+    np.save(buf, data, allow_pickle=False)
+    return buf.getvalue()
+
+
+def unpack_ndvi(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    ndvi = np.load(io.BytesIO(data), allow_pickle=False)
+    return ndvi, np.isfinite(ndvi)
+
+
+@functools.lru_cache(maxsize=1)
+def _s2l2a_collection() -> DataCollection:
+    return DataCollection.SENTINEL2_L2A.define_from(
+        name="s2l2a", service_url=os.environ.get("SH_BASE_URL")
+    )
+
+
+def _ndvi_raw_request(
+    aoi_bbox: BBox,
+    time_interval: Tuple[str, str],
+    size: Tuple[int, int],
+    config: SHConfig,
+) -> SentinelHubRequest:
+    return SentinelHubRequest(
+        evalscript=EVALSCRIPT_NDVI_RAW,
+        input_data=[
+            SentinelHubRequest.input_data(
+                data_collection=_s2l2a_collection(),
+                time_interval=time_interval,
+                other_args={"dataFilter": {"mosaickingOrder": "leastCC"}},
+            )
+        ],
+        responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
+        bbox=aoi_bbox,
+        size=size,
+        config=config,
+    )
+
+
+def _ndvi_rgba_request(
+    aoi_bbox: BBox,
+    time_interval: Tuple[str, str],
+    size: Tuple[int, int],
+    config: SHConfig,
+) -> SentinelHubRequest:
+    return SentinelHubRequest(
         evalscript=EVALSCRIPT_NDVI,
         input_data=[
             SentinelHubRequest.input_data(
-                data_collection=DataCollection.SENTINEL2_L2A.define_from(
-                    name="s2l2a", service_url=os.environ.get("SH_BASE_URL")
-                ),
+                data_collection=_s2l2a_collection(),
                 time_interval=time_interval,
                 other_args={"dataFilter": {"mosaickingOrder": "leastCC"}},
             )
@@ -138,31 +455,224 @@ def generate_ndvi_png_bytes(
         bbox=aoi_bbox,
         size=size,
         config=config,
-        # If you expect large images you may want to set maxcc or mosaicking order etc.
     )
 
-    data = request.get_data()
+
+def _tile_grid(
+    bbox_wgs84: Tuple[float, float, float, float], width: int, height: int
+) -> List[Tuple[Tuple[float, float, float, float], Tuple[int, int, int, int]]]:
+    """
+    Split a width x height raster over bbox_wgs84 into sub-tiles of at most
+    MAX_TILE_PX per side. Returns (tile bbox, (row0, row1, col0, col1)) pairs;
+    row 0 is the northern edge. Tile edges fall on whole output pixels, so the
+    stitched mosaic has exactly the same grid as a single request.
+    """
+    lon_min, lat_min, lon_max, lat_max = bbox_wgs84
+    nx = max(1, math.ceil(width / MAX_TILE_PX))
+    ny = max(1, math.ceil(height / MAX_TILE_PX))
+    cols = np.linspace(0, width, nx + 1).round().astype(int)
+    rows = np.linspace(0, height, ny + 1).round().astype(int)
+
+    tiles = []
+    for r0, r1 in zip(rows[:-1], rows[1:]):
+        for c0, c1 in zip(cols[:-1], cols[1:]):
+            tile_bbox = (
+                lon_min + (lon_max - lon_min) * c0 / width,
+                lat_max - (lat_max - lat_min) * r1 / height,
+                lon_min + (lon_max - lon_min) * c1 / width,
+                lat_max - (lat_max - lat_min) * r0 / height,
+            )
+            tiles.append((tile_bbox, (int(r0), int(r1), int(c0), int(c1))))
+    return tiles
+
+
+def _fetch_tiled(
+    bbox_wgs84: Tuple[float, float, float, float],
+    resolution: int,
+    build_request: Callable[[BBox, Tuple[int, int]], SentinelHubRequest],
+    channels: int,
+    dtype,
+    client: SentinelHubClient,
+):
+    """
+    Run build_request(bbox, size) for the bbox. Rasters over MAX_TILE_PX per side
+    are fetched as concurrent sub-tiles, each written straight into one
+    preallocated HxWxC array as it arrives.
+    """
+    aoi_bbox = BBox(bbox=bbox_wgs84, crs=CRS.WGS84)
+    width, height = bbox_to_dimensions(aoi_bbox, resolution=resolution)
+    tiles = _tile_grid(bbox_wgs84, width, height)
+
+    if len(tiles) == 1:
+        data = client.download(build_request(aoi_bbox, (width, height)).download_list)
+        if not data:
+            raise RuntimeError("No data returned from Sentinel Hub request")
+        return data[0]
+
+    out = np.zeros((height, width, channels), dtype=dtype)
+
+    def fetch_tile(tile) -> None:
+        tile_bbox, (r0, r1, c0, c1) = tile
+        request = build_request(BBox(bbox=tile_bbox, crs=CRS.WGS84), (c1 - c0, r1 - r0))
+        element = client.download(request.download_list)[0]
+        if not isinstance(element, np.ndarray) or element.shape[:2] != (r1 - r0, c1 - c0):
+            raise RuntimeError("Unexpected sub-tile response from Sentinel Hub")
+        out[r0:r1, c0:c1] = element.reshape(r1 - r0, c1 - c0, -1)[..., :channels]
+
+    with ThreadPoolExecutor(max_workers=min(TILE_WORKERS, len(tiles))) as executor:
+        list(executor.map(fetch_tile, tiles))
+    return out
+
+
+def _split_raw_ndvi(element) -> Tuple[np.ndarray, np.ndarray]:
+    """Decoded EVALSCRIPT_NDVI_RAW response (HxWx2) -> (ndvi, mask)."""
+    if not isinstance(element, np.ndarray) or element.ndim != 3 or element.shape[2] < 2:
+        raise RuntimeError("Unexpected raw NDVI response from Sentinel Hub")
+
+    ndvi = np.ascontiguousarray(element[..., 0], dtype=np.float32)
+    mask = (element[..., 1] > 0) & np.isfinite(ndvi)
+    return ndvi, mask
+
+
+def fetch_ndvi_array(
+    bbox_wgs84: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str] = ("2024-07-01", "2024-07-30"),
+    resolution: int = 10,
+    config: Optional[SHConfig] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fetch raw NDVI for the bbox with EVALSCRIPT_NDVI_RAW.
+    Returns (ndvi HxW float32, mask HxW bool); pixels without data or with an
+    undefined ratio are False in the mask.
+    """
+    client = _client_for(config)
+    element = _fetch_tiled(
+        bbox_wgs84,
+        resolution,
+        lambda aoi_bbox, size: _ndvi_raw_request(aoi_bbox, time_interval, size, client.config),
+        channels=2,
+        dtype=np.float32,
+        client=client,
+    )
+    return _split_raw_ndvi(element)
+
+
+def fetch_ndvi_tile(
+    bounds_3857: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str],
+    tile_size: int = 256,
+    config: Optional[SHConfig] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Raw NDVI (ndvi, mask) for one web-mercator map tile, tile_size x tile_size pixels."""
+    client = _client_for(config)
+    aoi_bbox = BBox(bbox=bounds_3857, crs=CRS.POP_WEB)
+    request = _ndvi_raw_request(aoi_bbox, time_interval, (tile_size, tile_size), client.config)
+    data = client.download(request.download_list)
     if not data:
         raise RuntimeError("No data returned from Sentinel Hub request")
+    return _split_raw_ndvi(data[0])
+
+
+def fetch_ndvi_series(
+    bbox_wgs84: Tuple[float, float, float, float],
+    time_intervals: List[Tuple[str, str]],
+    resolution: int = 10,
+    config: Optional[SHConfig] = None,
+    max_threads: int = 8,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Raw NDVI for several time intervals over the same bbox. All requests go
+    through one SentinelHubDownloadClient batch with at most `max_threads`
+    concurrent downloads, so latency is close to a single request.
+    Returns one (ndvi, mask) per interval, in order.
+    """
+    if not time_intervals:
+        return []
 
-    element = data[0]
+    aoi_bbox = BBox(bbox=bbox_wgs84, crs=CRS.WGS84)
+    size = bbox_to_dimensions(aoi_bbox, resolution=resolution)
+    if max(size) > MAX_TILE_PX:
+        # each interval needs its own tiled mosaic
+        with ThreadPoolExecutor(max_workers=max_threads) as executor:
+            return list(executor.map(
+                lambda interval: fetch_ndvi_array(bbox_wgs84, interval, resolution, config),
+                time_intervals,
+            ))
+
+    return fetch_ndvi_rasters(
+        [(bbox_wgs84, interval) for interval in time_intervals], size, config, max_threads
+    )
+
+
+def fetch_ndvi_rasters(
+    items: List[Tuple[Tuple[float, float, float, float], Tuple[str, str]]],
+    size: Tuple[int, int],
+    config: Optional[SHConfig] = None,
+    max_threads: int = 8,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Raw NDVI for many (bbox_wgs84, time_interval) pairs at a fixed output size
+    (width, height <= MAX_TILE_PX), downloaded as one concurrent batch.
+    Returns one (ndvi, mask) per item, in order.
+    """
+    if not items:
+        return []
+
+    client = _client_for(config)
+    download_requests = [
+        _ndvi_raw_request(BBox(bbox=bbox, crs=CRS.WGS84), interval, size, client.config).download_list[0]
+        for bbox, interval in items
+    ]
+    data = client.download(download_requests, max_threads=max_threads)
+    return [_split_raw_ndvi(element) for element in data]
+
+
+def generate_ndvi_png_bytes(
+    bbox_wgs84: Tuple[float, float, float, float],
+    time_interval: Tuple[str, str] = ("2024-07-01", "2024-07-30"),
+    resolution: int = 10,
+    config: Optional[SHConfig] = None,
+    mode: Optional[str] = None,
+    palette: str = "default",
+    image_format: str = "png",
+) -> bytes:
+    """
+    Generate an NDVI image for the given bbox (x1, y1, x2, y2 in WGS84 lon/lat).
+    Returns image bytes ready to be served (Content-Type: IMAGE_FORMATS[image_format]).
+    `mode` overrides NDVI_RENDER_MODE; palettes other than "default" always render locally.
+    """
+    mode = mode or NDVI_RENDER_MODE
+    if mode == "local" or palette != "default":
+        ndvi, mask = fetch_ndvi_array(bbox_wgs84, time_interval, resolution, config)
+        return render_ndvi_image(ndvi, mask, palette, image_format)
+
+    client = _client_for(config)
+    element = _fetch_tiled(
+        bbox_wgs84,
+        resolution,
+        lambda aoi_bbox, size: _ndvi_rgba_request(aoi_bbox, time_interval, size, client.config),
+        channels=4,
+        dtype=np.uint8,
+        client=client,
+    )
 
     # element could be either bytes (already PNG) or a numpy array HxWx4 (uint8)
     if isinstance(element, (bytes, bytearray)):
-        png_bytes = bytes(element)
-        return png_bytes
+        if image_format == "png":
+            return bytes(element)
+        element = np.asarray(Image.open(io.BytesIO(element)).convert("RGBA"))
 
-    # if numpy array, convert to PNG bytes
+    # if numpy array, encode it; the evalscript's classes map straight onto the default
+    # palette, so this is a table lookup into an indexed PNG rather than a colour count
     if isinstance(element, np.ndarray):
         # ensure uint8
         arr = element
         if arr.dtype != np.uint8:
             arr = np.clip(arr, 0, 255).astype(np.uint8)
 
-        image = Image.fromarray(arr, mode="RGBA")
-        buf = io.BytesIO()
-        image.save(buf, format="PNG")
-        buf.seek(0)
-        return buf.read()
+        indices = upstream_indices(arr)
+        if indices is not None:
+            return encode_indexed(indices, palette_lut("default"), image_format)
+        return encode_image(arr, image_format)
 
-    raise RuntimeError("Unknown response type from SentinelHubRequest.get_data()")
\ No newline at end of file
+    raise RuntimeError("Unknown response type from Sentinel Hub download")
\ No newline at end of file
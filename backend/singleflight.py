@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+
+logger = logging.getLogger("geo-app.singleflight")
+
+
+class _Flight:
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future: Future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key starts `fn`
+    on a bounded worker pool, later callers with the same key wait on the same
+    future. Every waiter applies its own timeout; when the last waiter gives up
+    before the work has started, the work is cancelled.
+    """
+
+    def __init__(self, name: str, max_workers: int = 8):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-flight")
+        self._lock = threading.RLock()
+        self._flights: Dict[str, _Flight] = {}
+
+        self.started = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Blocking variant, for callers already running on a worker thread."""
+        flight = self._join(key, fn)
+        try:
+            return flight.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self._count_timeout()
+            raise TimeoutError(f"{self.name}: upstream call timed out after {timeout}s")
+        finally:
+            self._leave(key, flight)
+
+    async def do_async(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Awaitable variant: waiting does not hold a threadpool thread. Cancelling
+        the awaiting task only detaches this waiter, not the shared call.
+        """
+        flight = self._join(key, fn)
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight.future)), timeout)
+        except asyncio.TimeoutError:
+            self._count_timeout()
+            raise TimeoutError(f"{self.name}: upstream call timed out after {timeout}s")
+        finally:
+            self._leave(key, flight)
+
+    def in_flight(self, key: str) -> bool:
+        """True while a call for `key` is queued or running; a do() now would join it."""
+        with self._lock:
+            return key in self._flights
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                # submitted calls waiting for a free worker
+                "queued": self._executor._work_queue.qsize(),
+                "started": self.started,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+            }
+
+    def _join(self, key: str, fn: Callable[[], Any]) -> _Flight:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight(self._executor.submit(fn))
+                self._flights[key] = flight
+                flight.future.add_done_callback(lambda _f, k=key, fl=flight: self._finish(k, fl))
+                self.started += 1
+            else:
+                self.coalesced += 1
+            flight.waiters += 1
+            return flight
+
+    def _leave(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters == 0 and flight.future.cancel():
+                logger.info("%s: cancelled unstarted call, no waiters left", self.name)
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _count_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
@@ -0,0 +1,194 @@
+import heapq
+import math
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+
+logger = logging.getLogger("geo-app.spatial")
+
+KM_PER_DEGREE = 111.32
+
+Bbox = Tuple[float, float, float, float]
+
+# Core PostgreSQL geometric types, so no PostGIS extension or schema change is needed:
+# a GiST expression index over the parcel rectangle serves && (overlap) and <-> (KNN).
+PG_BOX_EXPR = "box(point(x1, y1), point(x2, y2))"
+PG_CREATE_INDEX = f"CREATE INDEX IF NOT EXISTS ix_coordinate_box ON coordinate USING GIST (({PG_BOX_EXPR}))"
+
+
+def ensure_spatial_index(engine) -> bool:
+    """Create the GiST index on PostgreSQL; False on other databases (in-process R-tree is used)."""
+    if engine.dialect.name != "postgresql":
+        return False
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(PG_CREATE_INDEX))
+        return True
+    except Exception:
+        logger.exception("Could not create the coordinate GiST index, using the in-process R-tree")
+        return False
+
+
+# The user row is outer-joined to a LATERAL subquery, so resolving the username and the
+# GiST-served coordinate lookup are one statement; no row at all means the user is missing.
+def pg_intersecting_ids(session, username: str, bbox: Bbox, limit: int) -> Optional[List[int]]:
+    """Ids of the user's parcels overlapping bbox, by id; None when the user does not exist."""
+    rows = session.execute(
+        text(
+            f'SELECT c.id FROM "user" u LEFT JOIN LATERAL ('
+            f"SELECT id FROM coordinate WHERE user_id = u.id "
+            f"AND {PG_BOX_EXPR} && box(point(:x1, :y1), point(:x2, :y2)) ORDER BY id LIMIT :limit"
+            f") c ON true WHERE u.username = :username ORDER BY c.id"
+        ),
+        {"username": username, "x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3], "limit": limit},
+    ).all()
+    return _lateral_ids(rows)
+
+
+def pg_nearest_ids(session, username: str, lon: float, lat: float, k: int) -> Optional[List[int]]:
+    """Ids of the user's k parcels closest to (lon, lat), nearest first; None when the user does not exist."""
+    rows = session.execute(
+        text(
+            f'SELECT c.id FROM "user" u LEFT JOIN LATERAL ('
+            f"SELECT id, {PG_BOX_EXPR} <-> point(:lon, :lat) AS dist FROM coordinate WHERE user_id = u.id "
+            f"ORDER BY dist LIMIT :k"
+            f") c ON true WHERE u.username = :username ORDER BY c.dist"
+        ),
+        {"username": username, "lon": lon, "lat": lat, "k": k},
+    ).all()
+    return _lateral_ids(rows)
+
+
+def _lateral_ids(rows) -> Optional[List[int]]:
+    if not rows:
+        return None
+    return [row[0] for row in rows if row[0] is not None]
+
+
+def box_distance_km(box: Sequence[float], lon: float, lat: float) -> float:
+    """Approximate (equirectangular) distance from a point to a lon/lat rectangle; 0 inside."""
+    xmin, ymin, xmax, ymax = min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3])
+    dx = max(xmin - lon, 0.0, lon - xmax) * math.cos(math.radians(lat))
+    dy = max(ymin - lat, 0.0, lat - ymax)
+    return math.hypot(dx, dy) * KM_PER_DEGREE
+
+
+class PackedRTree:
+    """
+    Static R-tree bulk-loaded with Sort-Tile-Recursive packing. Every level is a flat
+    (n, 4) array of boxes, node i on a level owning entries [i * node_size, (i + 1) * node_size)
+    of the level below, so queries test a whole level of candidates with NumPy at once.
+    """
+
+    def __init__(self, ids: Sequence[int], boxes: np.ndarray, node_size: int = 16):
+        self.node_size = node_size
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        boxes = np.column_stack([
+            np.minimum(boxes[:, 0], boxes[:, 2]), np.minimum(boxes[:, 1], boxes[:, 3]),
+            np.maximum(boxes[:, 0], boxes[:, 2]), np.maximum(boxes[:, 1], boxes[:, 3]),
+        ])
+        order = self._str_order(boxes)
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.levels: List[np.ndarray] = [boxes[order]]
+        while len(self.levels[-1]) > node_size:
+            self.levels.append(self._parents(self.levels[-1]))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _str_order(self, boxes: np.ndarray) -> np.ndarray:
+        n = len(boxes)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2.0
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2.0
+        slab = self.node_size * math.ceil(math.sqrt(math.ceil(n / self.node_size)))
+        by_x = np.argsort(cx, kind="stable")
+        return np.concatenate([
+            by_x[start:start + slab][np.argsort(cy[by_x[start:start + slab]], kind="stable")]
+            for start in range(0, n, slab)
+        ])
+
+    def _parents(self, level: np.ndarray) -> np.ndarray:
+        starts = np.arange(0, len(level), self.node_size)
+        return np.column_stack([
+            np.minimum.reduceat(level[:, 0], starts), np.minimum.reduceat(level[:, 1], starts),
+            np.maximum.reduceat(level[:, 2], starts), np.maximum.reduceat(level[:, 3], starts),
+        ])
+
+    def _children(self, nodes: np.ndarray, level: int) -> np.ndarray:
+        children = (nodes[:, None] * self.node_size + np.arange(self.node_size)[None, :]).ravel()
+        return children[children < len(self.levels[level - 1])]
+
+    def intersecting(self, bbox: Bbox) -> np.ndarray:
+        """Ids of the boxes that overlap bbox (touching counts), in index order."""
+        if not len(self.ids):
+            return self.ids
+        xmin, ymin, xmax, ymax = bbox
+        top = len(self.levels) - 1
+        candidates = np.arange(len(self.levels[top]))
+        for level in range(top, -1, -1):
+            boxes = self.levels[level][candidates]
+            hit = candidates[
+                (boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) & (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin)
+            ]
+            if level == 0:
+                return self.ids[hit]
+            candidates = self._children(hit, level)
+        return self.ids[:0]
+
+    def nearest(self, lon: float, lat: float, k: int) -> List[Tuple[int, float]]:
+        """The k boxes closest to (lon, lat) as (id, distance_km), best-first over the tree."""
+        heap: List[Tuple[float, int, int]] = []
+        top = len(self.levels) - 1
+        for i, box in enumerate(self.levels[top]):
+            heapq.heappush(heap, (box_distance_km(box, lon, lat), top, i))
+        result: List[Tuple[int, float]] = []
+        while heap and len(result) < k:
+            dist, level, i = heapq.heappop(heap)
+            if level == 0:
+                result.append((int(self.ids[i]), dist))
+                continue
+            for child in self._children(np.array([i]), level):
+                heapq.heappush(heap, (box_distance_km(self.levels[level - 1][child], lon, lat), level - 1, int(child)))
+        return result
+
+
+class ParcelIndexCache:
+    """
+    Per-user PackedRTree, rebuilt when the user's parcel set changes. `version` is any cheap
+    fingerprint of that set (e.g. row count and max id), so every worker process notices
+    inserts and deletes made by the others.
+    """
+
+    def __init__(self, max_users: int = 256):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._trees: "OrderedDict[int, Tuple[tuple, PackedRTree]]" = OrderedDict()
+        self.builds = 0
+
+    def get(self, user_id: int, version: tuple, load: Callable[[], Tuple[List[int], np.ndarray]]) -> PackedRTree:
+        with self._lock:
+            entry = self._trees.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._trees.move_to_end(user_id)
+                return entry[1]
+
+        ids, boxes = load()
+        tree = PackedRTree(ids, boxes)
+        with self._lock:
+            self._trees[user_id] = (version, tree)
+            self._trees.move_to_end(user_id)
+            while len(self._trees) > self.max_users:
+                self._trees.popitem(last=False)
+            self.builds += 1
+        return tree
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._trees), "builds": self.builds}
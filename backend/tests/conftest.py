@@ -0,0 +1,50 @@
+"""
+Tests run against bench/fakes.py stand-ins for Sentinel Hub and Earth Engine, with a
+throwaway SQLite database and cache directory. From backend/:
+
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# main reads its configuration at import time
+_DATA_DIR = tempfile.mkdtemp(prefix="geo-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_DATA_DIR, 'test.sqlite')}")
+os.environ.setdefault("CACHE_DIR", os.path.join(_DATA_DIR, "cache"))
+os.environ.setdefault("MODIS_BACKEND", "ee")
+
+
+@pytest.fixture(scope="session")
+def api():
+    import main
+
+    main.create_db_and_tables()
+    return main
+
+
+@pytest.fixture
+def sentinelhub(api):
+    """A fresh fake Sentinel Hub client; its stats() count the upstream calls of the test."""
+    from bench.fakes import install_fake_sentinelhub
+
+    return install_fake_sentinelhub(latency=0.0)
+
+
+@pytest.fixture
+def client(api, sentinelhub):
+    from fastapi.testclient import TestClient
+
+    return TestClient(api.app)
+
+
+@pytest.fixture
+def earth_engine(api):
+    from bench.fakes import install_fake_earth_engine
+
+    return install_fake_earth_engine(latency=0.0)
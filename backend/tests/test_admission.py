@@ -0,0 +1,33 @@
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_detach_before_run_withdraws_the_reservation():
+    controller = AdmissionController("test", capacity_bytes=100, interactive_bytes=10)
+    ticket = controller.acquire(60, "a")
+    assert controller.stats()["in_use_bytes"] == 60
+
+    # the caller gave up before the single-flight worker started the work
+    ticket.detach()
+    assert controller.stats()["in_use_bytes"] == 0
+
+    ran = []
+    with pytest.raises(AdmissionRejected) as excinfo:
+        ticket.run(lambda: ran.append(True))
+    assert excinfo.value.status_code == 503
+    assert not ran
+    assert controller.stats()["in_use_bytes"] == 0
+    assert controller.stats()["running"] == 0
+
+
+def test_detach_after_run_started_keeps_the_reservation():
+    controller = AdmissionController("test", capacity_bytes=100, interactive_bytes=10)
+    ticket = controller.acquire(60, "a")
+
+    def work():
+        ticket.detach()
+        return controller.stats()["in_use_bytes"]
+
+    assert ticket.run(work) == 60
+    assert controller.stats()["in_use_bytes"] == 0
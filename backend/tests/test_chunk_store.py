@@ -0,0 +1,25 @@
+"""NDVI chunk store: coarse views over warm finer levels are served from the pyramid."""
+
+
+def test_warm_fine_area_serves_coarser_view_without_upstream(api, client, sentinelhub):
+    store = api.ndvi_chunk_store
+    interval = ("2023-06-01", "2023-06-20")
+    coarse_chunk = store.chunks_for((23.60, 46.70, 23.62, 46.72), 60)[0]
+    lon_min, lat_min, lon_max, lat_max = store.chunk_bbox(coarse_chunk, 60)
+
+    # warm every 20 m chunk under the 60 m chunk
+    store.read((lon_min, lat_min, lon_max, lat_max), interval, 20)
+    before = sentinelhub.stats()["requests"]
+
+    # a view well inside that chunk, at 3x coarser pixels
+    pad_lon, pad_lat = (lon_max - lon_min) / 4, (lat_max - lat_min) / 4
+    bbox = (lon_min + pad_lon, lat_min + pad_lat, lon_max - pad_lon, lat_max - pad_lat)
+    assert store.missing_chunks(bbox, interval, 60) == []
+    assert api._uses_chunk_store(bbox, [interval], 60)
+
+    r = client.post("/ndvi", json={
+        "bbox": list(bbox), "start": interval[0], "end": interval[1], "resolution": 60, "format": "png",
+    })
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/png"
+    assert sentinelhub.stats()["requests"] == before
@@ -0,0 +1,21 @@
+"""Paged coordinate listing."""
+from sqlmodel import Session
+
+
+def test_next_cursor_is_readable_cross_origin(api, client):
+    with Session(api.engine) as session:
+        user = api.User(username="cursor-user")
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+        for i in range(3):
+            session.add(api.Coordinate(user_id=user.id, x1=23.0 + i, y1=46.0, x2=23.1 + i, y2=46.1))
+        session.commit()
+
+    r = client.get(
+        "/users/cursor-user/coords", params={"limit": 2}, headers={"Origin": "http://localhost:3000"}
+    )
+    assert r.status_code == 200
+    assert len(r.json()) == 2
+    assert r.headers["x-next-cursor"] == str(r.json()[-1]["id"])
+    assert "x-next-cursor" in r.headers["access-control-expose-headers"].lower()
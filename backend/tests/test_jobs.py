@@ -0,0 +1,38 @@
+"""Background job queue limits."""
+import threading
+
+import pytest
+
+from cache import TieredCache
+from jobs import DONE, JobQueue, QueueFull
+
+
+def test_submit_rejects_beyond_max_pending():
+    queue = JobQueue(TieredCache("test-jobs"), max_workers=1, max_pending=2)
+    release = threading.Event()
+
+    def blocked(report):
+        release.wait(5)
+        return b"ok", "text/plain"
+
+    running = queue.submit("ndvi", {}, blocked)
+    queued = queue.submit("ndvi", {}, blocked)
+    with pytest.raises(QueueFull):
+        queue.submit("ndvi", {}, blocked)
+    assert queue.stats()["rejected"] == 1
+
+    # a cancelled job frees its slot
+    assert queue.cancel(queued["id"])
+    extra = queue.submit("ndvi", {}, blocked)
+
+    release.set()
+    queue._jobs[extra["id"]].future.result(5)
+    assert queue.get(running["id"])["status"] == DONE
+    assert queue.stats()["pending"] == 0
+    queue.submit("ndvi", {}, blocked)
+
+
+def test_post_jobs_answers_503_when_the_queue_is_full(api, client, monkeypatch):
+    monkeypatch.setattr(api.job_queue, "max_pending", 0)
+    r = client.post("/jobs", json={"kind": "stats", "payload": {"bbox": [23.60, 46.70, 23.62, 46.72]}})
+    assert r.status_code == 503
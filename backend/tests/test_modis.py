@@ -0,0 +1,26 @@
+"""POST /modis/batch input handling."""
+from sqlmodel import Session
+
+
+def test_batch_rejects_non_numeric_bbox(client, earth_engine):
+    r = client.post("/modis/batch", json={"bboxes": [["a", 0, 1, 1]]})
+    assert r.status_code == 400
+
+
+def test_batch_reports_invalid_saved_parcels_in_place(api, client, earth_engine):
+    with Session(api.engine) as session:
+        user = api.User(username="modis-batch-user")
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+        session.add(api.Coordinate(user_id=user.id, x1=23.60, y1=46.70, x2=23.62, y2=46.72))
+        session.add(api.Coordinate(user_id=user.id, x1=20.0, y1=40.0, x2=30.0, y2=48.0))
+        session.commit()
+
+    r = client.post("/modis/batch", json={"username": "modis-batch-user"})
+    assert r.status_code == 200
+    ok, too_large = r.json()["parcels"]
+    assert ok["analysis"] is not None and "error" not in ok
+    assert too_large["analysis"] is None
+    assert "too large" in too_large["error"]
+    assert ok["coord_id"] < too_large["coord_id"]
@@ -0,0 +1,35 @@
+"""NDVI pre-warming fills what interactive reads actually hit."""
+from sqlmodel import Session
+
+
+def _save_parcel(api, username, bbox):
+    with Session(api.engine) as session:
+        user = api.User(username=username)
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+        x1, y1, x2, y2 = bbox
+        session.add(api.Coordinate(user_id=user.id, x1=x1, y1=y1, x2=x2, y2=y2))
+        session.commit()
+
+
+def test_renders_after_prewarm_make_no_upstream_call(api, client, sentinelhub):
+    bbox = (24.11, 45.31, 24.14, 45.33)
+    _save_parcel(api, "prewarm-user", bbox)
+    assert not api._prewarm_is_warm(bbox)
+
+    summary = api.ndvi_prewarmer.run_once()
+    assert summary["failed"] == 0
+    assert api._prewarm_is_warm(bbox)
+    before = sentinelhub.stats()["requests"]
+
+    # default Accept gets PNG, a WebP-preferring client gets WebP, other palettes too
+    r = client.get("/users/prewarm-user/coords/ndvi")
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/png"
+    r = client.get("/users/prewarm-user/coords/ndvi", headers={"Accept": "image/webp,*/*"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/webp"
+    r = client.get("/users/prewarm-user/coords/ndvi", params={"palette": "grayscale", "format": "png"})
+    assert r.status_code == 200
+    assert sentinelhub.stats()["requests"] == before
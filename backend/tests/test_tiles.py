@@ -0,0 +1,37 @@
+"""NDVI tile URLs and encodings."""
+import io
+import math
+
+from PIL import Image
+
+
+def _tile(z, lon, lat):
+    n = 2 ** z
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return int((lon + 180) / 360 * n), int(y)
+
+
+def test_tile_extension_names_the_content_type(client):
+    x, y = _tile(11, 23.6, 46.7)
+    r = client.get(f"/ndvi/tiles/11/{x}/{y}.webp", params={"start": "2023-06-01", "end": "2023-06-20"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/webp"
+    r = client.get(f"/ndvi/tiles/11/{x}/{y}.png", params={"start": "2023-06-01", "end": "2023-06-20"},
+                   headers={"Accept": "image/webp,*/*"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/png"
+    r = client.get(f"/ndvi/tiles/11/{x}/{y}.webp", params={"format": "webp-lossy"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/webp"
+
+    assert client.get(f"/ndvi/tiles/11/{x}/{y}.png", params={"format": "webp"}).status_code == 400
+    assert client.get(f"/ndvi/tiles/11/{x}/{y}.gif").status_code == 404
+
+
+def test_upstream_render_is_written_as_indexed_png(api, sentinelhub):
+    from sentinel_process import generate_ndvi_png_bytes
+
+    data = generate_ndvi_png_bytes(
+        (23.60, 46.70, 23.62, 46.72), ("2023-06-01", "2023-06-20"), 60, mode="upstream"
+    )
+    assert Image.open(io.BytesIO(data)).mode == "P"
@@ -0,0 +1,80 @@
+import io
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+TILE_SIZE = 256
+# Web-mercator half extent in meters (EPSG:3857)
+ORIGIN_SHIFT = 2 * math.pi * 6378137 / 2.0
+# Sentinel-2 acquisitions cover roughly 56°S .. 84°N
+S2_LAT_MIN = -56.0
+S2_LAT_MAX = 84.0
+
+_transparent_tiles: Dict[str, bytes] = {}
+
+
+def tile_bounds_3857(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """XYZ tile -> (minx, miny, maxx, maxy) in EPSG:3857 meters; y grows southwards."""
+    size = 2 * ORIGIN_SHIFT / (2 ** z)
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def mercator_to_lonlat(mx: np.ndarray, my: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    lon = mx / ORIGIN_SHIFT * 180.0
+    lat = np.degrees(np.arctan(np.sinh(my / ORIGIN_SHIFT * math.pi)))
+    return lon, lat
+
+
+def tile_bounds_wgs84(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    minx, miny, maxx, maxy = tile_bounds_3857(z, x, y)
+    (lon_min, lon_max), (lat_min, lat_max) = mercator_to_lonlat(
+        np.array([minx, maxx]), np.array([miny, maxy])
+    )
+    return (float(lon_min), float(lat_min), float(lon_max), float(lat_max))
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return z >= 0 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def outside_coverage(z: int, x: int, y: int, clip_bbox: Optional[Tuple[float, float, float, float]] = None) -> bool:
+    """True when the tile cannot contain any data: outside Sentinel-2 latitudes or the clip bbox."""
+    lon_min, lat_min, lon_max, lat_max = tile_bounds_wgs84(z, x, y)
+    if lat_max < S2_LAT_MIN or lat_min > S2_LAT_MAX:
+        return True
+    if clip_bbox is not None:
+        c_lon_min, c_lat_min, c_lon_max, c_lat_max = clip_bbox
+        if lon_max < c_lon_min or lon_min > c_lon_max or lat_max < c_lat_min or lat_min > c_lat_max:
+            return True
+    return False
+
+
+def clip_mask(
+    z: int, x: int, y: int, clip_bbox: Tuple[float, float, float, float], tile_size: int = TILE_SIZE
+) -> np.ndarray:
+    """tile_size x tile_size bool mask of the pixel centres inside clip_bbox (lon/lat)."""
+    minx, miny, maxx, maxy = tile_bounds_3857(z, x, y)
+    step = (maxx - minx) / tile_size
+    centres = (np.arange(tile_size) + 0.5) * step
+    lon, lat = mercator_to_lonlat(minx + centres, maxy - centres)
+    lon_min, lat_min, lon_max, lat_max = clip_bbox
+    cols = (lon >= lon_min) & (lon <= lon_max)
+    rows = (lat >= lat_min) & (lat <= lat_max)
+    return rows[:, None] & cols[None, :]
+
+
+def transparent_tile(image_format: str = "png") -> bytes:
+    """Empty tile in "png" or one of the WebP formats."""
+    if image_format not in _transparent_tiles:
+        buf = io.BytesIO()
+        if image_format == "png":
+            Image.new("P", (TILE_SIZE, TILE_SIZE), 0).save(buf, format="PNG", transparency=0)
+        else:
+            Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0)).save(buf, format="WEBP", lossless=True)
+        _transparent_tiles[image_format] = buf.getvalue()
+    return _transparent_tiles[image_format]
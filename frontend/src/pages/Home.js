@@ -6,6 +6,7 @@ import { useNdviOverlay } from './hooks/useNdviOverlay';
 import { useGuestStorage } from './hooks/useGuestStorage';
 import { useUserActions } from './hooks/useUserActions';
 import { useCoordinateLogic } from './hooks/useCoordinateLogic';
+import { useVisibleParcels } from './hooks/useVisibleParcels';
 import MapContainer from './components/MapContainer';
 import SidePanel from './components/SidePanel';
 import { LAYOUT_STYLES } from './constants/styleConfig';
@@ -32,6 +33,9 @@ export default function Home() {
     coordinateHooks
   );
 
+  // Saved parcels in view, reloaded on pan / zoom and when the history changes
+  useVisibleParcels(mapSetup.mapRef, mapSetup.mapReady, user, coordinateHooks.historyVersion);
+
   // Combine all coordinate actions
   const coordinateActions = {
     ...coordinateHooks,
@@ -22,13 +22,18 @@ export const TILE_LAYER_CONFIG = {
   url: "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
 };
 
-export const NDVI_OVERLAY_OPTIONS = {
+export const NDVI_TILE_LAYER_OPTIONS = {
+  tileSize: 256,
+  minZoom: 7,
+  maxZoom: 18,
   opacity: 1.0,
-  interactive: false,
-  crossOrigin: false,
+  crossOrigin: true,
   pane: 'overlayPane'
 };
 
+// png, webp or webp-lossy, see GET /ndvi/tiles/{z}/{x}/{y}.png | .webp
+export const NDVI_TILE_FORMAT = 'webp';
+
 export const MAP_BOUNDS_PADDING = [20, 20];
 
 export const RECTANGLE_STYLE = {
@@ -37,6 +42,16 @@ export const RECTANGLE_STYLE = {
   fillOpacity: 0.2
 };
 
+// saved parcels drawn from the viewport query (see useVisibleParcels)
+export const SAVED_PARCEL_STYLE = {
+  color: "#ff7800",
+  weight: 1,
+  fillOpacity: 0.1,
+  interactive: false
+};
+
+export const VISIBLE_PARCELS_DEBOUNCE_MS = 250;
+
 export const DEFAULT_COORDINATES = {
   x1: '25.0',
   y1: '45.0',
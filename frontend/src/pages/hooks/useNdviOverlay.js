@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { fetchAndShowNdviOverlay, fetchAndShowNdviForBBox, removeNdviOverlay } from '../services/ndviService';
+import { showNdviTileLayer, removeNdviOverlay } from '../services/ndviService';
 
 export const useNdviOverlay = (mapRef) => {
   const [isLoadingNdvi, setIsLoadingNdvi] = useState(false);
@@ -20,25 +20,14 @@ export const useNdviOverlay = (mapRef) => {
     setIsLoadingNdvi(true);
     
     try {
-      if (!user || user.username === "guest") {
-        await fetchAndShowNdviForBBox(
-          mapRef, 
-          coord.x1, 
-          coord.y1, 
-          coord.x2, 
-          coord.y2, 
-          { resolution: 60 }
-        );
-      } else {
-        await fetchAndShowNdviOverlay(
-          mapRef, 
-          user.username, 
-          coord.x1, 
-          coord.y1, 
-          coord.x2, 
-          coord.y2
-        );
-      }
+      // NDVI is streamed as map tiles clipped to the parcel, for guests and users alike
+      showNdviTileLayer(
+        mapRef,
+        coord.x1,
+        coord.y1,
+        coord.x2,
+        coord.y2
+      );
       setNdviActive(true);
       return 'NDVI overlay loaded';
     } catch (err) {
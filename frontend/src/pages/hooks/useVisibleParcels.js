@@ -0,0 +1,56 @@
+import { useEffect, useRef } from 'react';
+import L from 'leaflet';
+import { fetchVisibleCoordinates } from '../services/coordinateService';
+import { SAVED_PARCEL_STYLE, VISIBLE_PARCELS_DEBOUNCE_MS } from '../constants/mapConfig';
+
+// Draws the user's saved parcels, loading only the ones inside the current viewport
+// (GET /users/{username}/coords/within) after every pan or zoom.
+export const useVisibleParcels = (mapRef, mapReady, user, version) => {
+  const layerRef = useRef(null);
+
+  useEffect(() => {
+    const map = mapRef.current;
+    if (!mapReady || !map || !user || user.username === 'guest') return;
+
+    const layer = L.layerGroup().addTo(map);
+    layerRef.current = layer;
+    let timer = null;
+    let request = 0;
+
+    const load = async () => {
+      const current = ++request;
+      try {
+        const coords = await fetchVisibleCoordinates(user.username, map.getBounds());
+        // a later pan already asked for another viewport
+        if (current !== request) return;
+        layer.clearLayers();
+        coords.forEach(c => {
+          L.rectangle(
+            [[Math.min(c.y1, c.y2), Math.min(c.x1, c.x2)], [Math.max(c.y1, c.y2), Math.max(c.x1, c.x2)]],
+            SAVED_PARCEL_STYLE
+          ).addTo(layer);
+        });
+      } catch (err) {
+        console.error('Error loading visible parcels:', err);
+      }
+    };
+
+    const onViewChange = () => {
+      clearTimeout(timer);
+      timer = setTimeout(load, VISIBLE_PARCELS_DEBOUNCE_MS);
+    };
+
+    map.on('moveend zoomend', onViewChange);
+    load();
+
+    return () => {
+      clearTimeout(timer);
+      request++;
+      map.off('moveend zoomend', onViewChange);
+      map.removeLayer(layer);
+      layerRef.current = null;
+    };
+  }, [mapRef, mapReady, user, version]);
+
+  return layerRef;
+};
@@ -30,6 +30,26 @@ export const fetchUserCoordinates = async (username) => {
   return await response.json();
 };
 
+// Only the saved parcels intersecting the visible map area (Leaflet LatLngBounds)
+export const fetchVisibleCoordinates = async (username, bounds, limit = 1000) => {
+  const params = new URLSearchParams({
+    x1: bounds.getWest(),
+    y1: bounds.getSouth(),
+    x2: bounds.getEast(),
+    y2: bounds.getNorth(),
+    limit,
+  });
+  const response = await fetch(
+    `http://localhost:8000/users/${username}/coords/within?${params}`
+  );
+
+  if (!response.ok) {
+    throw new Error('Failed to fetch coordinates');
+  }
+
+  return await response.json();
+};
+
 export const savePendingCoordinate = (coordinate, guestCoords, setGuestCoords) => {
   try {
     const arr = JSON.parse(sessionStorage.getItem(PENDING_KEY) || "[]");